@@ -0,0 +1,428 @@
+/*
+ chg.c - client for the chgserver extension of Mercurial
+
+ Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+
+ This software may be used and distributed according to the terms of
+ the GNU General Public License, incorporated herein by reference.
+*/
+
+#include <arpa/inet.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <signal.h>
+#include <stdarg.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/file.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <sys/un.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#ifndef PATH_MAX
+#define PATH_MAX 4096
+#endif
+
+extern char **environ;
+
+static pid_t serverpid = 0;
+
+static void abortmsg(const char *fmt, ...)
+{
+	va_list args;
+	va_start(args, fmt);
+	fputs("chg: abort: ", stderr);
+	vfprintf(stderr, fmt, args);
+	fputc('\n', stderr);
+	va_end(args);
+	exit(255);
+}
+
+static void *mallocx(size_t size)
+{
+	void *p = malloc(size);
+	if (!p)
+		abortmsg("out of memory");
+	return p;
+}
+
+static void writeall(int fd, const void *buf, size_t len)
+{
+	const char *p = buf;
+	while (len > 0) {
+		ssize_t n = write(fd, p, len);
+		if (n < 0) {
+			if (errno == EINTR)
+				continue;
+			abortmsg("cannot write to server (errno = %d)", errno);
+		}
+		p += n;
+		len -= n;
+	}
+}
+
+static void readall(int fd, void *buf, size_t len)
+{
+	char *p = buf;
+	while (len > 0) {
+		ssize_t n = read(fd, p, len);
+		if (n < 0) {
+			if (errno == EINTR)
+				continue;
+			abortmsg("cannot read from server (errno = %d)", errno);
+		}
+		if (n == 0)
+			abortmsg("server connection closed");
+		p += n;
+		len -= n;
+	}
+}
+
+/* writes a command name followed by its data block, if any */
+static void writecommand(int fd, const char *cmd, const char *data,
+			 size_t len)
+{
+	uint32_t l = htonl((uint32_t)len);
+	writeall(fd, cmd, strlen(cmd));
+	writeall(fd, "\n", 1);
+	if (!data)
+		return;
+	writeall(fd, &l, sizeof(l));
+	writeall(fd, data, len);
+}
+
+static char readchannel(int fd, uint32_t *len)
+{
+	char header[5];
+	uint32_t l;
+	readall(fd, header, sizeof(header));
+	memcpy(&l, header + 1, sizeof(l));
+	*len = ntohl(l);
+	return header[0];
+}
+
+static char *readdata(int fd, uint32_t len)
+{
+	char *data = mallocx(len + 1);
+	readall(fd, data, len);
+	data[len] = '\0';
+	return data;
+}
+
+/* reads the channels up to the result of a command, which is returned */
+static int32_t readresult(int fd)
+{
+	for (;;) {
+		uint32_t len;
+		char ch = readchannel(fd, &len);
+		char *data;
+		int32_t r;
+
+		switch (ch) {
+		case 'o':
+		case 'e':
+			data = readdata(fd, len);
+			writeall(ch == 'o' ? STDOUT_FILENO : STDERR_FILENO,
+				 data, len);
+			free(data);
+			break;
+		case 'r':
+			if (len != sizeof(r))
+				abortmsg("unexpected result length %u", len);
+			readall(fd, &r, sizeof(r));
+			return (int32_t)ntohl((uint32_t)r);
+		case 'I':
+		case 'L':
+			data = mallocx(len);
+			if (ch == 'L') {
+				if (!fgets(data, len, stdin))
+					data[0] = '\0';
+				r = strlen(data);
+			} else {
+				r = fread(data, 1, len, stdin);
+			}
+			{
+				uint32_t l = htonl((uint32_t)r);
+				writeall(fd, &l, sizeof(l));
+				writeall(fd, data, r);
+			}
+			free(data);
+			break;
+		default:
+			if (ch >= 'A' && ch <= 'Z')
+				abortmsg("unexpected channel %c", ch);
+			/* optional channels can be ignored */
+			free(readdata(fd, len));
+		}
+	}
+}
+
+static void getsockpath(char *buf, size_t size)
+{
+	const char *name = getenv("CHGSOCKNAME");
+	const char *tmpdir;
+	char dir[PATH_MAX];
+	struct stat st;
+	int n;
+
+	if (name && name[0] == '/') {
+		n = snprintf(buf, size, "%s", name);
+	} else if (name) {
+		char cwd[PATH_MAX];
+		if (!getcwd(cwd, sizeof(cwd)))
+			abortmsg("cannot get current directory");
+		n = snprintf(buf, size, "%s/%s", cwd, name);
+	} else {
+		tmpdir = getenv("TMPDIR");
+		if (!tmpdir || !tmpdir[0])
+			tmpdir = "/tmp";
+		snprintf(dir, sizeof(dir), "%s/chg%d", tmpdir, (int)getuid());
+		if (mkdir(dir, 0700) < 0 && errno != EEXIST)
+			abortmsg("cannot create directory %s", dir);
+		/* the directory must not be usable by anyone else */
+		if (lstat(dir, &st) < 0 || !S_ISDIR(st.st_mode)
+		    || st.st_uid != getuid() || (st.st_mode & 0077))
+			abortmsg("insecure directory %s", dir);
+		n = snprintf(buf, size, "%s/server", dir);
+	}
+	if (n < 0 || (size_t)n >= size)
+		abortmsg("socket path too long");
+}
+
+static int trytoconnect(const char *sockpath)
+{
+	struct sockaddr_un addr;
+	int fd, saved;
+
+	fd = socket(AF_UNIX, SOCK_STREAM, 0);
+	if (fd < 0)
+		abortmsg("cannot create socket (errno = %d)", errno);
+	fcntl(fd, F_SETFD, FD_CLOEXEC);
+	memset(&addr, 0, sizeof(addr));
+	addr.sun_family = AF_UNIX;
+	strncpy(addr.sun_path, sockpath, sizeof(addr.sun_path) - 1);
+	if (connect(fd, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+		saved = errno;
+		close(fd);
+		errno = saved;
+		return -1;
+	}
+	return fd;
+}
+
+static void startserver(const char *sockpath)
+{
+	const char *hgcmd = getenv("CHGHG");
+	int status;
+	pid_t pid;
+
+	if (!hgcmd || !hgcmd[0])
+		hgcmd = "hg";
+
+	pid = fork();
+	if (pid < 0)
+		abortmsg("cannot fork (errno = %d)", errno);
+	if (pid == 0) {
+		const char *argv[] = {hgcmd, "serve", "--cmdserver", "chgunix",
+				      "--address", sockpath,
+				      "--config", "extensions.chgserver=",
+				      "--cwd", "/", "--daemon", NULL};
+		/* hide the startup message */
+		int nullfd = open("/dev/null", O_WRONLY);
+		if (nullfd >= 0) {
+			dup2(nullfd, STDOUT_FILENO);
+			close(nullfd);
+		}
+		execvp(hgcmd, (char **)argv);
+		fprintf(stderr, "chg: abort: cannot execute %s\n", hgcmd);
+		_exit(255);
+	}
+	while (waitpid(pid, &status, 0) < 0)
+		if (errno != EINTR)
+			abortmsg("cannot wait for %s", hgcmd);
+	if (!WIFEXITED(status) || WEXITSTATUS(status) != 0)
+		abortmsg("cannot start server with %s", hgcmd);
+}
+
+/* connects to the server, starting one if there is none */
+static int connectserver(const char *sockpath)
+{
+	char lockpath[PATH_MAX];
+	int fd, lockfd;
+
+	fd = trytoconnect(sockpath);
+	if (fd >= 0)
+		return fd;
+
+	/* only one client starts a server at a time */
+	snprintf(lockpath, sizeof(lockpath), "%s.lock", sockpath);
+	lockfd = open(lockpath, O_RDWR | O_CREAT, 0600);
+	if (lockfd < 0)
+		abortmsg("cannot open %s", lockpath);
+	fcntl(lockfd, F_SETFD, FD_CLOEXEC);
+	while (flock(lockfd, LOCK_EX) < 0)
+		if (errno != EINTR)
+			abortmsg("cannot lock %s", lockpath);
+	fd = trytoconnect(sockpath);
+	if (fd < 0) {
+		/* a server that died leaves its socket behind */
+		unlink(sockpath);
+		startserver(sockpath);
+		fd = trytoconnect(sockpath);
+	}
+	close(lockfd);
+	if (fd < 0)
+		abortmsg("cannot connect to %s (errno = %d)", sockpath, errno);
+	return fd;
+}
+
+/* reads the hello message, returning the pid of the server */
+static pid_t readhello(int fd)
+{
+	uint32_t len;
+	char ch = readchannel(fd, &len);
+	char *data, *caps, *pid;
+	pid_t r;
+
+	if (ch != 'o')
+		abortmsg("unexpected hello channel %c", ch);
+	data = readdata(fd, len);
+	caps = strstr(data, "capabilities: ");
+	if (!caps || !strstr(caps, " attachio"))
+		abortmsg("server does not support attachio "
+			 "(is the chgserver extension enabled?)");
+	pid = strstr(data, "\npid: ");
+	r = pid ? atoi(pid + 6) : 0;
+	free(data);
+	return r;
+}
+
+static void sendenv(int fd)
+{
+	size_t len = 0, n;
+	char **e;
+	char *data, *p;
+
+	for (e = environ; *e; e++)
+		len += strlen(*e) + 1;
+	p = data = mallocx(len + 1);
+	for (e = environ; *e; e++) {
+		n = strlen(*e);
+		memcpy(p, *e, n);
+		p += n;
+		*p++ = '\0';
+	}
+	/* no trailing separator */
+	writecommand(fd, "setenv", data, len ? len - 1 : 0);
+	free(data);
+}
+
+static void attachio(int fd)
+{
+	int fds[3] = {STDIN_FILENO, STDOUT_FILENO, STDERR_FILENO};
+	char dummy = '\0';
+	struct iovec iov = {&dummy, 1};
+	char cbuf[CMSG_SPACE(sizeof(fds))];
+	struct msghdr msgh;
+	struct cmsghdr *cmsg;
+	int32_t r;
+
+	writecommand(fd, "attachio", NULL, 0);
+	memset(&msgh, 0, sizeof(msgh));
+	msgh.msg_iov = &iov;
+	msgh.msg_iovlen = 1;
+	msgh.msg_control = cbuf;
+	msgh.msg_controllen = sizeof(cbuf);
+	cmsg = CMSG_FIRSTHDR(&msgh);
+	cmsg->cmsg_level = SOL_SOCKET;
+	cmsg->cmsg_type = SCM_RIGHTS;
+	cmsg->cmsg_len = CMSG_LEN(sizeof(fds));
+	memcpy(CMSG_DATA(cmsg), fds, sizeof(fds));
+	msgh.msg_controllen = cmsg->cmsg_len;
+	while (sendmsg(fd, &msgh, 0) < 0)
+		if (errno != EINTR)
+			abortmsg("cannot send file descriptors (errno = %d)",
+				 errno);
+	r = readresult(fd);
+	if (r != 3)
+		abortmsg("server attached %d file descriptors", r);
+}
+
+static void forwardsignal(int sig)
+{
+	if (serverpid > 0)
+		kill(serverpid, sig);
+}
+
+static void setupsignals(void)
+{
+	static const int sigs[] = {SIGHUP, SIGINT, SIGQUIT, SIGTERM, SIGUSR1,
+				   SIGUSR2, SIGWINCH};
+	struct sigaction sa;
+	size_t i;
+
+	memset(&sa, 0, sizeof(sa));
+	sa.sa_handler = forwardsignal;
+	sa.sa_flags = SA_RESTART;
+	sigemptyset(&sa.sa_mask);
+	for (i = 0; i < sizeof(sigs) / sizeof(sigs[0]); i++)
+		sigaction(sigs[i], &sa, NULL);
+}
+
+int main(int argc, const char *argv[])
+{
+	char sockpath[sizeof(((struct sockaddr_un *)0)->sun_path)];
+	char cwd[PATH_MAX];
+	size_t len = 0, n;
+	char *args, *p;
+	uint32_t mask;
+	int fd, i, tries;
+
+	getsockpath(sockpath, sizeof(sockpath));
+
+	/* a server is started again once for an outdated one */
+	for (tries = 0;; tries++) {
+		fd = connectserver(sockpath);
+		serverpid = readhello(fd);
+		sendenv(fd);
+		writecommand(fd, "validate", NULL, 0);
+		if (readresult(fd) == 0)
+			break;
+		close(fd);
+		if (tries > 0)
+			abortmsg("server configuration keeps changing");
+	}
+
+	attachio(fd);
+
+	if (!getcwd(cwd, sizeof(cwd)))
+		abortmsg("cannot get current directory");
+	writecommand(fd, "chdir", cwd, strlen(cwd));
+
+	mask = umask(0);
+	umask(mask);
+	mask = htonl(mask);
+	writecommand(fd, "setumask", NULL, 0);
+	writeall(fd, &mask, sizeof(mask));
+
+	for (i = 1; i < argc; i++)
+		len += strlen(argv[i]) + 1;
+	p = args = mallocx(len + 1);
+	for (i = 1; i < argc; i++) {
+		n = strlen(argv[i]);
+		memcpy(p, argv[i], n);
+		p += n;
+		*p++ = '\0';
+	}
+	setupsignals();
+	writecommand(fd, "runcommand", args, len ? len - 1 : 0);
+	free(args);
+
+	return readresult(fd) & 0xff;
+}
@@ -8,6 +8,52 @@ import time, os, sys
 cmdtable = {}
 command = cmdutil.command(cmdtable)
 
+# settings of timer(), see uisetup
+_mintime = 3
+_maxtime = 10
+_statsfile = None
+
+def uisetup(ui):
+    global _mintime, _maxtime, _statsfile
+    _mintime = float(ui.config('perf', 'mintime', _mintime))
+    _maxtime = float(ui.config('perf', 'maxtime', _maxtime))
+    _statsfile = ui.config('perf', 'stats')
+
+def stats(values):
+    """return the minimum, median, mean and standard deviation of values"""
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        median = values[n // 2]
+    else:
+        median = (values[n // 2 - 1] + values[n // 2]) / 2.0
+    mean = sum(values) / float(n)
+    stdev = 0.0
+    if n > 1:
+        stdev = (sum((v - mean) ** 2 for v in values) / (n - 1)) ** 0.5
+    return values[0], median, mean, stdev
+
+def writestats(title, results):
+    """append the statistics of results to the file set by perf.stats
+
+    The file gets one JSON object per timer() call, read by
+    contrib/perfbench.py."""
+    import json
+    entry = {'title': title, 'count': len(results)}
+    columns = [('wall', [r[0] for r in results]),
+               ('comb', [r[1] + r[2] for r in results]),
+               ('user', [r[1] for r in results]),
+               ('sys', [r[2] for r in results])]
+    for name, values in columns:
+        mn, median, mean, stdev = stats(values)
+        entry[name] = {'min': mn, 'median': median, 'mean': mean,
+                       'stdev': stdev}
+    fp = open(_statsfile, 'a')
+    try:
+        fp.write(json.dumps(entry, sort_keys=True) + '\n')
+    finally:
+        fp.close()
+
 def timer(func, title=None):
     results = []
     begin = time.time()
@@ -21,9 +67,9 @@ def timer(func, title=None):
         count += 1
         a, b = ostart, ostop
         results.append((cstop - cstart, b[0] - a[0], b[1]-a[1]))
-        if cstop - begin > 3 and count >= 100:
+        if cstop - begin > _mintime and count >= 100:
             break
-        if cstop - begin > 10 and count >= 3:
+        if cstop - begin > _maxtime and count >= 3:
             break
     if title:
         sys.stderr.write("! %s\n" % title)
@@ -32,6 +78,8 @@ def timer(func, title=None):
     m = min(results)
     sys.stderr.write("! wall %f comb %f user %f sys %f (best of %d)\n"
                      % (m[0], m[1] + m[2], m[1], m[2], count))
+    if _statsfile:
+        writestats(title, results)
 
 @command('perfwalk')
 def perfwalk(ui, repo, *pats):
@@ -304,6 +352,47 @@ def perfrevlog(ui, repo, file_, **opts):
 
     timer(d)
 
+@command('perfrevlogchunks',
+         [('', 'batch', False, 'read the chunks with a single call')],
+         "[INDEXFILE]")
+def perfrevlogchunks(ui, repo, file_, **opts):
+    from mercurial import revlog
+    r = revlog.revlog(lambda fn: open(fn, 'rb'), file_)
+    revs = list(r)
+    def d():
+        r.clearcaches()
+        r._chunkclear()
+        if opts['batch']:
+            r._chunks(revs)
+        else:
+            for rev in revs:
+                r._chunk(rev)
+    timer(d)
+
+@command('perfrevlogcache',
+         [('d', 'dist', 100, 'distance between the revisions'),
+          ('', 'cachesize', 0, 'size of the revision cache in bytes')],
+         "[INDEXFILE]")
+def perfrevlogcache(ui, repo, file_, **opts):
+    """benchmark reading revisions back and forth through the cache"""
+    from mercurial import revlog
+    def opener(fn, mode='rb'):
+        return open(fn, mode)
+    opener.options = {'revlogv1': 1, 'generaldelta': 1,
+                      'revisioncachesize': opts['cachesize']}
+    r = revlog.revlog(opener, file_)
+    revs = range(0, len(r), opts['dist'])
+    def d():
+        r.clearcaches()
+        r._cache = None
+        for k in r.cachestats:
+            r.cachestats[k] = 0
+        for x in revs + revs[::-1]:
+            r.revision(r.node(x))
+    timer(d)
+    ui.write(("hit %(hit)d partial %(partial)d miss %(miss)d\n")
+             % r.cachestats)
+
 @command('perfrevset',
          [('C', 'clear', False, 'clear volatile cache between each call.')],
          "REVSET")
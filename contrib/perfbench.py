@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# perfbench.py - run a suite of perf.py benchmarks and track regressions
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""run a suite of perf.py benchmarks against generated repositories
+
+The suite is an ini file with two sections:
+
+  [repos]
+  linear = debugbuilddag +2000
+  branchy = debugbuilddag "+200:a *a+50 /a+100"
+    phase --public --force -r 150
+
+  [benchmarks]
+  heads = perfheads
+  draft = perfrevset "draft()"
+
+Each repository is created empty under the work directory, then the
+lines of its value are run as hg commands on it, e.g. debugbuilddag or
+synthesize from contrib/synthrepo.py (enabled with --config). They run
+from the directory of the suite, so paths in them are relative to it.
+Repositories are kept between runs and only created again when their
+commands change.
+
+Every benchmark, a perf.py command, is run on every repository and the
+statistics of its timings are written as JSON with --output. Given a
+previous output file with --baseline, the median wall times are compared
+and the script exits with status 1 if one of them got slower than the
+threshold allows.
+"""
+
+import json, optparse, os, shlex, shutil, subprocess, sys, tempfile
+import ConfigParser
+
+def readsuite(path):
+    """return the lists of (name, commands) of the repos and (name,
+    command) of the benchmarks of the suite file at path"""
+    cfg = ConfigParser.RawConfigParser()
+    # keep the case of the names
+    cfg.optionxform = str
+    fp = open(path)
+    try:
+        cfg.readfp(fp)
+    finally:
+        fp.close()
+    for section in ('repos', 'benchmarks'):
+        if not cfg.has_section(section):
+            raise SystemExit('%s: missing [%s] section' % (path, section))
+    repos = []
+    for name, value in cfg.items('repos'):
+        commands = [shlex.split(l) for l in value.splitlines() if l.strip()]
+        repos.append((name, commands))
+    benchmarks = []
+    for name, value in cfg.items('benchmarks'):
+        benchmarks.append((name, shlex.split(value)))
+    return repos, benchmarks
+
+def runhg(hg, args, cwd=None):
+    cmd = shlex.split(hg) + args
+    p = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    out = p.communicate()[0]
+    if p.returncode:
+        raise SystemExit('%s failed:\n%s' % (' '.join(cmd), out))
+    return out
+
+def makerepo(hg, path, commands, cwd, verbose):
+    """create the repository at path with commands, unless it is there"""
+    stamp = os.path.join(path, '.hg', 'perfbench')
+    key = json.dumps(commands)
+    if os.path.exists(stamp) and open(stamp).read() == key:
+        return
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    if verbose:
+        print 'creating %s' % path
+    runhg(hg, ['init', path])
+    for args in commands:
+        runhg(hg, ['-R', path] + args, cwd=cwd)
+    open(stamp, 'w').write(key)
+
+def runbenchmark(hg, perf, path, args, config):
+    """run the perf command args on the repository at path
+
+    Returns the list of the statistics written by its timer() calls."""
+    fd, statsfile = tempfile.mkstemp(prefix='perfbench-')
+    os.close(fd)
+    try:
+        cmd = ['-R', path, '--config', 'extensions.perf=%s' % perf,
+               '--config', 'perf.stats=%s' % statsfile]
+        for c in config:
+            cmd += ['--config', c]
+        runhg(hg, cmd + args)
+        return [json.loads(l) for l in open(statsfile)]
+    finally:
+        os.unlink(statsfile)
+
+def compare(baseline, results, threshold):
+    """print the changes of the median wall times from baseline and
+    return the number of regressions beyond threshold percent"""
+    regressions = 0
+    for key in sorted(results):
+        new = results[key]['wall']['median']
+        old = baseline.get(key)
+        if old is None:
+            print '%-30s %10.6f %10s' % (key, new, 'new')
+            continue
+        old = old['wall']['median']
+        change = old and (new - old) * 100. / old or 0.
+        flag = ''
+        if change > threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+        print '%-30s %10.6f %10.6f %+7.1f%%%s' % (key, new, old, change, flag)
+    return regressions
+
+def main(args):
+    parser = optparse.OptionParser('%prog [options] SUITE')
+    parser.add_option('--hg', default='hg',
+                      help='hg command to benchmark (default: hg)')
+    parser.add_option('--perf',
+                      default=os.path.join(os.path.dirname(
+                          os.path.abspath(__file__)), 'perf.py'),
+                      help='path of the perf extension')
+    parser.add_option('-w', '--workdir', default='perfbench-repos',
+                      help='directory of the generated repositories')
+    parser.add_option('-k', '--keyword', action='append', default=[],
+                      help='only run the benchmarks and repositories whose '
+                      'name contains this')
+    parser.add_option('--config', action='append', default=[],
+                      help='set a config option when running benchmarks, '
+                      'e.g. perf.mintime=1')
+    parser.add_option('-o', '--output', help='write the results to this file')
+    parser.add_option('-b', '--baseline',
+                      help='compare the results with this previous output')
+    parser.add_option('-t', '--threshold', type='float', default=10.,
+                      help='slowdown in percent considered a regression '
+                      '(default: 10)')
+    parser.add_option('-v', '--verbose', action='store_true')
+    opts, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error('expected one suite file')
+
+    suite = args[0]
+    repos, benchmarks = readsuite(suite)
+    suitedir = os.path.dirname(os.path.abspath(suite))
+    workdir = os.path.abspath(opts.workdir)
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    def selected(name):
+        return not opts.keyword or [k for k in opts.keyword if k in name]
+
+    results = {}
+    for reponame, commands in repos:
+        selection = [(name, cmd) for name, cmd in benchmarks
+                     if selected('%s:%s' % (reponame, name))]
+        if not selection:
+            continue
+        path = os.path.join(workdir, reponame)
+        makerepo(opts.hg, path, commands, suitedir, opts.verbose)
+        for name, cmd in selection:
+            key = '%s:%s' % (reponame, name)
+            if opts.verbose:
+                print 'running %s' % key
+            for entry in runbenchmark(opts.hg, opts.perf, path, cmd,
+                                      opts.config):
+                if entry['title']:
+                    results['%s:%s' % (key, entry['title'])] = entry
+                else:
+                    results[key] = entry
+
+    if opts.output:
+        version = runhg(opts.hg, ['version', '-q']).strip()
+        fp = open(opts.output, 'w')
+        try:
+            json.dump({'version': version, 'results': results}, fp,
+                      indent=1, sort_keys=True)
+        finally:
+            fp.close()
+
+    if opts.baseline:
+        baseline = json.load(open(opts.baseline))['results']
+        if compare(baseline, results, opts.threshold):
+            return 1
+    else:
+        for key in sorted(results):
+            wall = results[key]['wall']
+            print '%-30s %10.6f +- %.6f (%d runs)' % (
+                key, wall['median'], wall['stdev'], results[key]['count'])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
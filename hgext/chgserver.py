@@ -0,0 +1,184 @@
+# chgserver.py - command server extension for the chg client
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+'''command server extension for the chg client (EXPERIMENTAL)
+
+The chg client, found in contrib/chg, runs hg commands through a server
+so that they do not pay for starting Python, importing Mercurial and
+loading the extensions and configuration files each time. The server is
+started by the client on first use, with::
+
+  hg serve --cmdserver chgunix --address SOCKET --config extensions.chgserver=
+
+It listens on a unix domain socket and forks a process for each
+command, which runs with the standard input, output and error, the
+working directory, the environment and the umask of the client.
+
+The server exits once the configuration files or the code of the
+loaded extensions change, or when a client comes with an environment
+the loaded configuration does not match, the client then starts a new
+one.
+'''
+
+from mercurial import commandserver, extensions, osutil, scmutil, util
+import atexit, cStringIO, os, signal, struct, sys
+
+testedwith = 'internal'
+
+# the environment variables read only when Mercurial starts
+_envnames = ['HGENCODING', 'HGENCODINGAMBIGUOUS', 'HGENCODINGMODE',
+             'HGRCPATH', 'HOME', 'LANG', 'LANGUAGE', 'LC_ALL', 'LC_CTYPE',
+             'LC_MESSAGES', 'PYTHONPATH']
+
+# modules most commands use, imported by the server so that the
+# processes it forks do not have to
+_preloadmodules = ['bookmarks', 'branchmap', 'changegroup', 'changelog',
+                   'cmdutil', 'context', 'copies', 'dirstate', 'discovery',
+                   'filelog', 'hg', 'ignore', 'localrepo', 'manifest',
+                   'match', 'mdiff', 'merge', 'obsolete', 'patch', 'phases',
+                   'repoview', 'revlog', 'revset', 'store', 'tags',
+                   'templatefilters', 'templatekw', 'templater']
+
+def _confighash(environ):
+    '''return a hash of what the configuration and the code loaded by the
+    server depend on'''
+    items = [util.version()]
+    for name in _envnames:
+        items.append('%s=%s' % (name, environ.get(name, '')))
+    paths = scmutil.rcpath()[:]
+    for name, module in extensions.extensions():
+        path = getattr(module, '__file__', '')
+        if path[-4:] in ('.pyc', '.pyo'):
+            path = path[:-1]
+        paths.append(path)
+    for path in paths:
+        try:
+            st = os.stat(path)
+            items.append('%s:%d:%d' % (path, st.st_mtime, st.st_size))
+        except OSError:
+            items.append('%s:' % path)
+    return util.sha1('\0'.join(items)).hexdigest()
+
+def _preload():
+    for name in _preloadmodules:
+        mod = __import__('mercurial.%s' % name)
+        # accessing an attribute loads a module delayed by demandimport
+        getattr(getattr(mod, name), '__name__')
+
+class chgcmdserver(commandserver.server):
+    """
+    Runs a command for a chg client, with its standard input, output and
+    error, working directory, environment and umask.
+    """
+    def __init__(self, ui, repo, fin, fout, sock, service):
+        commandserver.server.__init__(self, ui, repo, fin, fout)
+        self.clientsock = sock
+        self.service = service
+
+    def _readstr(self):
+        length = struct.unpack('>I', self._read(4))[0]
+        return self._read(length)
+
+    def attachio(self):
+        """receive the file descriptors of the standard input, output and
+        error of the client, sent along with one byte of data"""
+        clientfds = osutil.recvfds(self.clientsock.fileno())
+        files = [sys.stdin, sys.stdout, sys.stderr]
+        for fd, fp in zip(clientfds, files):
+            fp.flush()
+            os.dup2(fd, fp.fileno())
+            os.close(fd)
+        if len(clientfds) == len(files):
+            self.cin, self.cout, self.cerr = files
+        self.cresult.write(struct.pack('>i', len(clientfds)))
+
+    def chdir(self):
+        """change to the working directory of the client"""
+        path = self._readstr()
+        os.chdir(path)
+        self.cwd = path
+
+    def setenv(self):
+        """replace the environment with the one of the client"""
+        env = {}
+        for item in self._readstr().split('\0'):
+            if '=' in item:
+                name, value = item.split('=', 1)
+                env[name] = value
+        os.environ.clear()
+        os.environ.update(env)
+
+    def setumask(self):
+        """set the umask of the client"""
+        mask = struct.unpack('>I', self._read(4))[0]
+        os.umask(mask)
+        util.umask = util.platform.umask = mask
+
+    def validate(self):
+        """check that the server matches the configuration of the client
+
+        The result is 0 when it does, otherwise 1 and the server exits."""
+        if _confighash(os.environ) == self.service.confighash:
+            self.cresult.write(struct.pack('>i', 0))
+            return
+        self.service.retire()
+        self.cresult.write(struct.pack('>i', 1))
+
+    def runcommand(self):
+        # run the exit functions, e.g. the one waiting for the pager, before
+        # the client is told the command is done
+        result = self.cresult
+        self.cresult = held = cStringIO.StringIO()
+        try:
+            commandserver.server.runcommand(self)
+        finally:
+            self.cresult = result
+        # os._exit() skips them
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.cresult.write(held.getvalue())
+
+    capabilities = commandserver.server.capabilities.copy()
+    capabilities.update({'attachio': attachio,
+                         'chdir': chdir,
+                         'runcommand': runcommand,
+                         'setenv': setenv,
+                         'setumask': setumask,
+                         'validate': validate})
+
+class chgunixservice(commandserver.unixservice):
+    """
+    Listens on a unix domain socket for chg clients.
+
+    The commands run in the repositories of the working directories of
+    the clients, never in the one the server was started in.
+    """
+    def __init__(self, ui, repo, opts):
+        if repo:
+            ui = repo.baseui
+        commandserver.unixservice.__init__(self, ui, None, opts)
+
+    def init(self):
+        commandserver.unixservice.init(self)
+        _preload()
+        self.confighash = _confighash(os.environ)
+
+    def retire(self):
+        """stop listening, so that clients start a new server"""
+        try:
+            if os.stat(self.address).st_ino == self._sockino:
+                os.unlink(self.address)
+        except OSError:
+            pass
+        os.kill(os.getppid(), signal.SIGTERM)
+
+    def _createserver(self, conn, fin, fout):
+        return chgcmdserver(self.ui, self.repo, fin, fout, conn, self)
+
+def uisetup(ui):
+    commandserver._servicemap['chgunix'] = chgunixservice
@@ -6,13 +6,18 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2 or any later version.
 
-'''accelerate status report using Linux's inotify service'''
+'''accelerate status report using Linux's inotify service
+
+With ``fsmonitor.backend`` set to ``inotify``, the changes recorded by
+the :hg:`inrecord` daemon restrict the files status looks at instead
+of the status being answered by the :hg:`inserve` server.
+'''
 
 # todo: socket permissions
 
 from mercurial.i18n import _
-from mercurial import util
-import server
+from mercurial import util, fsmonitor
+import server, recorder
 from client import client, QueryFailed
 
 testedwith = 'internal'
@@ -21,6 +26,10 @@ def serve(ui, repo, **opts):
     '''start an inotify server for this repository'''
     server.start(ui, repo.dirstate, repo.root, opts)
 
+def record(ui, repo, **opts):
+    '''record the changes of the working directory for fsmonitor'''
+    recorder.record(ui, repo, opts)
+
 def debuginotify(ui, repo, **opts):
     '''debugging information for inotify extension
 
@@ -33,9 +42,14 @@ def debuginotify(ui, repo, **opts):
     for path in response:
         ui.write(('  %s/\n') % path)
 
+def uisetup(ui):
+    fsmonitor.backends['inotify'] = recorder.inotifybackend
+
 def reposetup(ui, repo):
     if not util.safehasattr(repo, 'dirstate'):
         return
+    if ui.config('fsmonitor', 'backend') == 'inotify':
+        return
 
     class inotifydirstate(repo.dirstate.__class__):
 
@@ -90,4 +104,12 @@ cmdtable = {
           ('', 'pid-file', '',
            _('name of file to write process ID to'), _('FILE'))],
          _('hg inserve [OPTION]...')),
+    'inrecord':
+        (record,
+         [('d', 'daemon', None, _('run recorder in background')),
+          ('', 'daemon-pipefds', '',
+           _('used internally by daemon mode'), _('NUM')),
+          ('', 'pid-file', '',
+           _('name of file to write process ID to'), _('FILE'))],
+         _('hg inrecord [OPTION]...')),
     }
@@ -0,0 +1,183 @@
+# recorder.py - record working directory changes for the fsmonitor backend
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+'''inotify backend of the filesystem monitor
+
+The inrecord command watches the working directory and appends the
+changed paths to the event log read by the eventlog backend. A status
+creates a cookie file in .hg and waits for the recorder to log it, so
+that all the changes made before it are in the log.
+'''
+
+from mercurial.i18n import _
+from mercurial import cmdutil, fsmonitor, util
+import errno, os, select, time
+
+_cookieprefix = 'fsmonitor-cookie-'
+_pidfile = 'fsmonitor.pid'
+
+class inotifybackend(fsmonitor.eventlog):
+    '''the eventlog backend, synchronized with a running recorder'''
+
+    _cookies = 0
+
+    def _running(self):
+        try:
+            pid = int(self._opener.read(_pidfile))
+        except (IOError, ValueError):
+            return False
+        return util.testpid(pid)
+
+    def clock(self):
+        if not self._running():
+            self._ui.debug('fsmonitor: inotify recorder not running\n')
+            return None
+        inotifybackend._cookies += 1
+        cookie = '%s%d-%d' % (_cookieprefix, os.getpid(), self._cookies)
+        line = '.hg/%s\n' % cookie
+        timeout = float(self._ui.config('inotify', 'cookietimeout', 2))
+        self._opener.write(cookie, '')
+        try:
+            start = time.time()
+            while time.time() - start < timeout:
+                session, data = self._read()
+                if data is None:
+                    return None
+                pos = data.rfind(line)
+                if pos >= 0:
+                    return '%s:%d' % (session,
+                                      len(session) + 1 + pos + len(line))
+                time.sleep(0.001)
+            self._ui.debug('fsmonitor: no reply from the inotify recorder\n')
+            return None
+        finally:
+            util.unlink(self._opener.join(cookie))
+
+class recorder(object):
+    '''write the paths reported by inotify to the event log'''
+
+    def __init__(self, ui, repo, maxsize):
+        try:
+            import linux as inotify
+            from linux import watcher
+        except ImportError:
+            raise util.Abort(_('inotify service not available'))
+        self.ui = ui
+        self.inotify = inotify
+        self.root = repo.root
+        self.prefixlen = len(repo.root) + 1
+        self.dirstate = repo.dirstate
+        self.opener = repo.opener
+        self.logpath = fsmonitor.eventlog(ui, repo.root, repo.opener)._path
+        self.maxsize = maxsize
+        self.mask = (inotify.IN_ATTRIB | inotify.IN_CREATE |
+                     inotify.IN_DELETE | inotify.IN_DELETE_SELF |
+                     inotify.IN_MODIFY | inotify.IN_MOVED_FROM |
+                     inotify.IN_MOVED_TO | inotify.IN_MOVE_SELF |
+                     inotify.IN_ONLYDIR)
+        try:
+            self.watcher = watcher.autowatcher(addfilter=self.watched)
+        except OSError, err:
+            raise util.Abort(_('inotify service not available: %s') %
+                             err.strerror)
+        self.log = None
+        self.newsession()
+        self.watcher.add(os.path.join(self.root, '.hg'),
+                         inotify.IN_CREATE | inotify.IN_ONLYDIR)
+        self.addwatches(self.root)
+
+    def watched(self, evt):
+        '''tell if a new directory is to be watched'''
+        path = evt.fullpath[self.prefixlen:]
+        return (path != '.hg' and not path.startswith('.hg/')
+                and not self.dirstate._dirignore(path))
+
+    def addwatches(self, top):
+        self.watcher.add(top, self.mask)
+        for root, dirs, files in os.walk(top):
+            for d in dirs[:]:
+                path = os.path.join(root, d)
+                if (path == os.path.join(self.root, '.hg') or
+                    self.dirstate._dirignore(path[self.prefixlen:])):
+                    dirs.remove(d)
+                    continue
+                try:
+                    self.watcher.add(path, self.mask)
+                except OSError, err:
+                    if err.errno not in self.watcher.ignored_errors:
+                        raise
+
+    def newsession(self):
+        '''start a new log, invalidating the clock tokens of the old one'''
+        if self.log:
+            self.log.close()
+        self.log = util.atomictempfile(self.logpath)
+        self.log.write('inotify %d %f\n' % (os.getpid(), time.time()))
+        self.log.close()
+        self.log = open(self.logpath, 'ab')
+        self.size = self.log.tell()
+
+    def record(self, events):
+        paths = []
+        for evt in events:
+            if evt.mask & self.inotify.IN_Q_OVERFLOW:
+                self.ui.note(_('event queue overflow\n'))
+                self.newsession()
+                return
+            path = evt.fullpath[self.prefixlen:]
+            if path == '.hg' or (path.startswith('.hg/') and
+                                 not path.startswith('.hg/' + _cookieprefix)):
+                continue
+            if path == '.hgignore' and '_ignore' in self.dirstate.__dict__:
+                # watch the directories that are no longer ignored
+                delattr(self.dirstate, '_ignore')
+                self.addwatches(self.root)
+            paths.append(path or '.')
+        if paths:
+            data = ''.join(p + '\n' for p in paths)
+            if self.size + len(data) > self.maxsize:
+                self.newsession()
+            self.log.write(data)
+            self.log.flush()
+            self.size += len(data)
+
+    def run(self):
+        while True:
+            try:
+                select.select([self.watcher.fileno()], [], [])
+            except select.error, err:
+                if err.args[0] != errno.EINTR:
+                    raise
+                continue
+            self.record(self.watcher.read())
+
+    def shutdown(self):
+        try:
+            util.unlink(self.opener.join(_pidfile))
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+        self.log.close()
+        self.watcher.close()
+
+def record(ui, repo, opts):
+    maxsize = ui.configint('inotify', 'maxlogsize', 10 * 1024 * 1024)
+
+    class service(object):
+        def init(self):
+            self.recorder = recorder(ui, repo, maxsize)
+            repo.opener.write(_pidfile, '%d\n' % os.getpid())
+
+        def run(self):
+            try:
+                self.recorder.run()
+            finally:
+                self.recorder.shutdown()
+
+    service = service()
+    cmdutil.service(opts, initfn=service.init, runfn=service.run,
+                    logfile=ui.config('inotify', 'log'))
@@ -13,6 +13,10 @@ config = "/path/to/repo/or/config"
 # Uncomment to send python tracebacks to the browser if an error occurs:
 #import cgitb; cgitb.enable()
 
+# Uncomment to keep the parsed configuration files between requests
+# (see 'hg help environment'):
+#import os; os.environ["HGRCCACHE"] = "/path/to/writable/cache"
+
 from mercurial import demandimport; demandimport.enable()
 from mercurial.hgweb import hgweb, wsgicgi
 application = hgweb(config)
@@ -82,6 +82,17 @@ class bundlerevlog(revlog.revlog):
         self.bundle.seek(self.start(rev))
         return self.bundle.read(self.length(rev))
 
+    def _slicechunk(self, revs):
+        # chunks not stored in the revlog are read one at a time by _chunk
+        return revlog.revlog._slicechunk(self, revs,
+                                         lambda rev: rev <= self.repotiprev)
+
+    def deltaparent(self, rev):
+        if rev <= self.repotiprev:
+            return revlog.revlog.deltaparent(self, rev)
+        # the base field of bundle revisions is their delta base
+        return self.index[rev][3]
+
     def revdiff(self, rev1, rev2):
         """return or calculate a delta between two revisions"""
         if rev1 > self.repotiprev and rev2 > self.repotiprev:
@@ -7,10 +7,11 @@
 
 from i18n import _
 from node import nullrev
-import mdiff, util
+import error, mdiff, util
 import struct, os, bz2, zlib, tempfile
 
 _BUNDLE10_DELTA_HEADER = "20s20s20s20s"
+_BUNDLE20_DELTA_HEADER = "20s20s20s20s20s"
 
 def readexactly(stream, n):
     '''read n bytes from stream.read and abort if less was available'''
@@ -45,17 +46,273 @@ class nocompress(object):
     def flush(self):
         return ""
 
+class nodecompress(object):
+    def decompress(self, x):
+        return x
+
+class compengine(object):
+    """base class of the compression engines used for bundles and wire
+    transfers
+
+    name selects the engine in the configuration and with hg bundle
+    --type. bundletype holds the two letters following HG10 in bundle
+    headers and wiretype identifies the engine with peers. Either is
+    None when the engine cannot be used there. Peers prefer the wire
+    engines of highest priority, those with a priority of 0 or less are
+    only used when configured explicitly.
+    """
+    name = None
+    bundletype = None
+    wiretype = None
+    priority = 0
+
+    def available(self):
+        return True
+
+    def bundleheader(self):
+        return 'HG10' + self.bundletype
+
+    def compressobj(self, level=None):
+        """return an object with compress() and flush() methods"""
+        raise NotImplementedError
+
+    def decompressobj(self):
+        """return an object with a decompress() method"""
+        raise NotImplementedError
+
+    def compressstream(self, chunks, level=None):
+        z = self.compressobj(level)
+        for chunk in chunks:
+            data = z.compress(chunk)
+            if data:
+                yield data
+        data = z.flush()
+        if data:
+            yield data
+
+    def decompressstream(self, chunks):
+        zd = self.decompressobj()
+        for chunk in chunks:
+            data = zd.decompress(chunk)
+            if data:
+                yield data
+
+class _noneengine(compengine):
+    name = 'none'
+    bundletype = 'UN'
+    wiretype = 'none'
+
+    def compressobj(self, level=None):
+        return nocompress()
+
+    def decompressobj(self):
+        return nodecompress()
+
+    def compressstream(self, chunks, level=None):
+        return chunks
+
+    def decompressstream(self, chunks):
+        return chunks
+
+class _zlibengine(compengine):
+    name = 'gzip'
+    bundletype = 'GZ'
+    wiretype = 'zlib'
+    priority = 20
+
+    def compressobj(self, level=None):
+        if level is None:
+            level = -1
+        return zlib.compressobj(level)
+
+    def decompressobj(self):
+        return zlib.decompressobj()
+
+    def decompressstream(self, chunks):
+        # bound the memory used by highly compressed data
+        zd = zlib.decompressobj()
+        for chunk in chunks:
+            while chunk:
+                yield zd.decompress(chunk, 2**18)
+                chunk = zd.unconsumed_tail
+        yield zd.flush()
+
+class _bz2engine(compengine):
+    name = 'bzip2'
+    bundletype = 'BZ'
+    priority = 10
+
+    def bundleheader(self):
+        # the compressed stream starts with "BZ"
+        return 'HG10'
+
+    def compressobj(self, level=None):
+        if level is None:
+            level = 9
+        return bz2.BZ2Compressor(level)
+
+    def decompressobj(self):
+        zd = bz2.BZ2Decompressor()
+        zd.decompress("BZ")
+        return zd
+
+try:
+    import zstandard
+    zstandard.ZstdCompressor # force demandimport to really import the module
+except ImportError:
+    zstandard = None
+
+class _zstdengine(compengine):
+    name = 'zstd'
+    bundletype = 'ZS'
+    wiretype = 'zstd'
+    priority = 50
+
+    def available(self):
+        return zstandard is not None
+
+    def compressobj(self, level=None):
+        if level is None:
+            level = 3
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+    def decompressobj(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+# engine name -> engine
+compengines = {}
+
 bundletypes = {
-    "": ("", nocompress), # only when using unbundle on ssh and old http servers
-                          # since the unification ssh accepts a header but there
-                          # is no capability signaling it.
-    "HG10UN": ("HG10UN", nocompress),
-    "HG10BZ": ("HG10", lambda: bz2.BZ2Compressor()),
-    "HG10GZ": ("HG10GZ", lambda: zlib.compressobj()),
+    "": ("", _noneengine()), # only when using unbundle on ssh and old http
+                             # servers since the unification ssh accepts a
+                             # header but there is no capability signaling it.
 }
 
 # hgweb uses this list to communicate its preferred type
-bundlepriority = ['HG10GZ', 'HG10BZ', 'HG10UN']
+bundlepriority = []
+
+def registercompengine(engine):
+    """make a compression engine available to bundles and peers"""
+    compengines[engine.name] = engine
+    if engine.bundletype and engine.available():
+        bundletypes['HG10' + engine.bundletype] = (engine.bundleheader(),
+                                                   engine)
+        bundlepriority[:] = [t for t, (h, e) in
+                             sorted(bundletypes.iteritems(),
+                                    key=lambda x: -x[1][1].priority) if t]
+
+for engine in (_noneengine, _zlibengine, _bz2engine, _zstdengine):
+    registercompengine(engine())
+
+def namedbundletype(name):
+    """return the bundle type of the engine called name, None if it
+    cannot be used for bundles"""
+    engine = compengines.get(name.lower())
+    if engine is None or not engine.bundletype:
+        return None
+    return 'HG10' + engine.bundletype
+
+def wireengines(ui):
+    """the engines a server offers for wire transfers, preferred first
+
+    They are listed by the server.compression option, or are all the
+    available engines of positive priority.
+    """
+    names = ui.configlist('server', 'compression')
+    if names:
+        engines = [compengines[n] for n in names if n in compengines]
+    else:
+        engines = sorted(compengines.values(), key=lambda e: -e.priority)
+        engines = [e for e in engines if e.priority > 0]
+    return [e for e in engines if e.wiretype and e.available()]
+
+def wireengine(ui, wiretype):
+    """the engine a server uses for the given wire type, None if it
+    does not offer it"""
+    for e in wireengines(ui):
+        if e.wiretype == wiretype:
+            return e
+    return None
+
+def peerwireengine(ui, cap):
+    """pick the engine used with a peer advertising the given
+    compression capability
+
+    The engines of ui.compression come first, then the preferences of
+    the server.
+    """
+    if not cap or cap is True:
+        return None
+    wiretypes = cap.split(',')
+    names = ui.configlist('ui', 'compression')
+    candidates = [compengines.get(n) for n in names]
+    for t in wiretypes:
+        candidates.extend(e for e in compengines.values() if e.wiretype == t)
+    for e in candidates:
+        if e and e.wiretype in wiretypes and e.available():
+            return e
+    return None
+
+def compressframes(engine, chunks, level):
+    '''compress chunks into frames made of a line with their length
+    followed by their data, ending with an empty frame
+
+    The last chunk is only compressed with the end of the stream, so the
+    end of the data is never sent before the last frame.'''
+    z = engine.compressobj(level)
+    prev = None
+    for chunk in chunks:
+        if prev is not None:
+            data = z.compress(prev)
+            if data:
+                yield '%d\n%s' % (len(data), data)
+        prev = chunk
+    data = z.compress(prev or '') + z.flush()
+    if data:
+        yield '%d\n%s' % (len(data), data)
+    yield '0\n'
+
+def readframes(fp):
+    '''read the data of the frames written by compressframes
+
+    The length of the next frame is read before returning one, so the
+    empty frame ending the stream is read with the last one.'''
+    l = fp.readline()
+    while True:
+        try:
+            l = int(l)
+        except ValueError:
+            raise error.ResponseError(_("unexpected response:"), l)
+        if not l:
+            break
+        data = readexactly(fp, l)
+        l = fp.readline()
+        yield data
+
+def _bundlechunks(cg):
+    # parse the changegroup data, otherwise we will block
+    # in case of sshrepo because we don't know the end of the stream
+
+    # an empty chunkgroup is the end of the changegroup
+    # a changegroup has at least 2 chunkgroups (changelog and manifest).
+    # after that, an empty chunkgroup is the end of the changegroup
+    empty = False
+    count = 0
+    while not empty or count <= 2:
+        empty = True
+        count += 1
+        while True:
+            chunk = getchunk(cg)
+            if not chunk:
+                break
+            empty = False
+            yield chunkheader(len(chunk))
+            pos = 0
+            while pos < len(chunk):
+                next = pos + 2**20
+                yield chunk[pos:next]
+                pos = next
+        yield closechunk()
 
 def writebundle(cg, filename, bundletype):
     """Write a bundle file and return its filename.
@@ -76,34 +333,10 @@ def writebundle(cg, filename, bundletype):
             fh = os.fdopen(fd, "wb")
         cleanup = filename
 
-        header, compressor = bundletypes[bundletype]
+        header, engine = bundletypes[bundletype]
         fh.write(header)
-        z = compressor()
-
-        # parse the changegroup data, otherwise we will block
-        # in case of sshrepo because we don't know the end of the stream
-
-        # an empty chunkgroup is the end of the changegroup
-        # a changegroup has at least 2 chunkgroups (changelog and manifest).
-        # after that, an empty chunkgroup is the end of the changegroup
-        empty = False
-        count = 0
-        while not empty or count <= 2:
-            empty = True
-            count += 1
-            while True:
-                chunk = getchunk(cg)
-                if not chunk:
-                    break
-                empty = False
-                fh.write(z.compress(chunkheader(len(chunk))))
-                pos = 0
-                while pos < len(chunk):
-                    next = pos + 2**20
-                    fh.write(z.compress(chunk[pos:next]))
-                    pos = next
-            fh.write(z.compress(closechunk()))
-        fh.write(z.flush())
+        for chunk in engine.compressstream(_bundlechunks(cg)):
+            fh.write(chunk)
         cleanup = None
         return filename
     finally:
@@ -115,20 +348,12 @@ def writebundle(cg, filename, bundletype):
 def decompressor(fh, alg):
     if alg == 'UN':
         return fh
-    elif alg == 'GZ':
-        def generator(f):
-            zd = zlib.decompressobj()
-            for chunk in util.filechunkiter(f):
-                yield zd.decompress(chunk)
-    elif alg == 'BZ':
-        def generator(f):
-            zd = bz2.BZ2Decompressor()
-            zd.decompress("BZ")
-            for chunk in util.filechunkiter(f, 4096):
-                yield zd.decompress(chunk)
+    for engine in compengines.itervalues():
+        if engine.bundletype == alg and engine.available():
+            break
     else:
         raise util.Abort("unknown bundle compression '%s'" % alg)
-    return util.chunkbuffer(generator(fh))
+    return util.chunkbuffer(engine.decompressstream(util.filechunkiter(fh)))
 
 class unbundle10(object):
     deltaheader = _BUNDLE10_DELTA_HEADER
@@ -194,6 +419,39 @@ class unbundle10(object):
         return dict(node=node, p1=p1, p2=p2, cs=cs,
                     deltabase=deltabase, delta=delta)
 
+class unbundle20(unbundle10):
+    """changegroup version 02, whose chunk headers name the delta base"""
+    deltaheader = _BUNDLE20_DELTA_HEADER
+    deltaheadersize = struct.calcsize(deltaheader)
+
+    def _deltaheader(self, headertuple, prevnode):
+        node, p1, p2, deltabase, cs = headertuple
+        return node, p1, p2, deltabase, cs
+
+class bufferedgroup(object):
+    """the delta chunks of a revlog group read from a changegroup, to
+    be given to revlog.addgroup later, e.g. from another thread"""
+    def __init__(self, source):
+        chunks = []
+        chain = None
+        while True:
+            chunkdata = source.deltachunk(chain)
+            if not chunkdata:
+                break
+            chunks.append(chunkdata)
+            # addgroup chains each delta to the previous node
+            chain = chunkdata['node']
+        chunks.reverse()
+        self._chunks = chunks
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def deltachunk(self, prevnode):
+        if not self._chunks:
+            return {}
+        return self._chunks.pop()
+
 class headerlessfixup(object):
     def __init__(self, fh, h):
         self._h = h
@@ -234,7 +492,7 @@ class bundle10(object):
     def revchunk(self, revlog, rev, prev):
         node = revlog.node(rev)
         p1, p2 = revlog.parentrevs(rev)
-        base = prev
+        base = self.deltaparent(revlog, rev, p1, p2, prev)
 
         prefix = ''
         if base == nullrev:
@@ -251,6 +509,43 @@ class bundle10(object):
         yield chunkheader(l)
         yield meta
         yield delta
+    def deltaparent(self, revlog, rev, p1, p2, prev):
+        # deltas are always against the previous revision in HG10
+        return prev
     def builddeltaheader(self, node, p1n, p2n, basenode, linknode):
         # do nothing with basenode, it is implicitly the previous one in HG10
         return struct.pack(self.deltaheader, node, p1n, p2n, linknode)
+
+class bundle20(bundle10):
+    """changegroup version 02
+
+    The delta base of each revision is sent in its chunk header, so the
+    delta stored in the revlog can be sent as is when its base is known
+    to the receiver: a parent of the revision or the previous revision
+    of the group.
+    """
+    deltaheader = _BUNDLE20_DELTA_HEADER
+    def deltaparent(self, revlog, rev, p1, p2, prev):
+        dp = revlog.deltaparent(rev)
+        if dp != nullrev and dp in (p1, p2, prev):
+            return dp
+        return prev
+    def builddeltaheader(self, node, p1n, p2n, basenode, linknode):
+        return struct.pack(self.deltaheader, node, p1n, p2n, basenode,
+                           linknode)
+
+# changegroup versions that can be exchanged with peers, with the
+# classes writing and reading their chunks. Bundle files are always
+# written with version 01.
+packermap = {'01': (bundle10, unbundle10),
+             '02': (bundle20, unbundle20),
+             }
+
+def peerversion(peer):
+    """return the most recent changegroup version supported by peer and
+    by us, peers not advertising changegroupversions only know 01"""
+    versions = peer.capable('changegroupversions')
+    if not versions or versions is True:
+        return '01'
+    versions = [v for v in versions.split(',') if v in packermap]
+    return max(versions or ['01'])
@@ -0,0 +1,239 @@
+# changesetcache.py - columnar cache of changeset metadata
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""cache of the changeset metadata used to filter revisions
+
+Getting the user, date or branch of a revision means decompressing and
+parsing its whole changeset, and predicates like author() or branch()
+do this for every revision they look at. This module keeps these fields
+in files under .hg/cache, one column per file:
+
+ changesets          number of revisions, node of the last one and
+                     number of strings
+ changesets-strings  user and branch names, one per line
+ changesets-node     node of each revision
+ changesets-user     user of each revision, as a line number of strings
+ changesets-date     commit time of each revision
+ changesets-branch   branch of each revision, as a line number of strings
+ changesets-flags    flags of each revision
+ changesets-files    number of files changed by each revision
+
+Columns hold little endian values. New revisions are appended to the
+columns before the changesets file is replaced, so interrupted updates are
+ignored by readers. The cache is created the first time it is used and
+then kept up to date after each transaction.
+"""
+
+from node import hex, bin, nullid
+import encoding, error, util
+import array, sys
+
+_filename = 'cache/changesets'
+
+# column name, array type code
+_columns = [('user', 'i'), ('date', 'd'), ('branch', 'i'), ('flags', 'B'),
+            ('files', 'i')]
+
+# flags
+CLOSED = 1
+
+def _colfile(name):
+    return '%s-%s' % (_filename, name)
+
+def _tostring(a):
+    if sys.byteorder != 'little':
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+def _fromstring(a, data):
+    a.fromstring(data)
+    if sys.byteorder != 'little':
+        a.byteswap()
+
+def read(repo):
+    """read the cache of repo from disk, None if missing or invalid"""
+    opener = repo.opener
+    try:
+        key = opener.read(_filename).split()
+        count, tipnode, nstrings = int(key[0]), bin(key[1]), int(key[2])
+        cache = changesetcache()
+        data = opener.read(_colfile('strings'))
+        strings = data.split('\n')[:nstrings]
+        if len(strings) != nstrings:
+            raise ValueError('missing strings')
+        cache._ondiskstrings = sum(len(s) + 1 for s in strings)
+        for s in strings:
+            cache._addstring(s)
+        cache.nodes = opener.read(_colfile('node'))[:count * 20]
+        if len(cache.nodes) != count * 20:
+            raise ValueError('missing nodes')
+        for name, code in _columns:
+            a = getattr(cache, name)
+            data = opener.read(_colfile(name))[:count * a.itemsize]
+            _fromstring(a, data)
+            if len(a) != count:
+                raise ValueError('missing values for %s' % name)
+        if count and cache.nodes[-20:] != tipnode:
+            raise ValueError('tip differs')
+        cache._ondisk = count
+    except (IOError, OSError, IndexError, ValueError, TypeError), inst:
+        if repo.ui.debugflag:
+            repo.ui.debug('invalid changeset cache: %s\n' % inst)
+        return None
+    return cache
+
+def available(repo):
+    """tell whether the cache of repo is loaded or on disk, so that using
+    it does not require reading the whole changelog"""
+    repo = repo.unfiltered()
+    return (repo._changesetcache is not None
+            or repo.opener.exists(_filename))
+
+def updatecache(repo, create=True):
+    """bring the changeset cache of repo up to date with its changelog
+
+    If create is False, nothing is done unless the cache has already
+    been loaded or written."""
+    repo = repo.unfiltered()
+    cache = repo._changesetcache
+    if cache is None:
+        if not create and not repo.opener.exists(_filename):
+            return
+        cache = read(repo) or changesetcache()
+    cache.update(repo)
+    tr = repo._transref and repo._transref() or None
+    if cache._dirty and (tr is None or not tr.running()):
+        # revisions of a running transaction may still be rolled back
+        cache.write(repo)
+    repo._changesetcache = cache
+
+class changesetcache(object):
+    """metadata of the changesets of a repository, stored in columns
+
+    The columns are arrays indexed by revision number. User and branch
+    names are stored once in the strings list and referenced by their
+    index in it."""
+
+    def __init__(self):
+        self.strings = []
+        self._stringids = {}
+        self.nodes = ''
+        for name, code in _columns:
+            setattr(self, name, array.array(code))
+        # content of the files on disk
+        self._ondisk = 0
+        self._ondiskstrings = 0
+        # changed since the last write
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.nodes) // 20
+
+    def node(self, rev):
+        return self.nodes[rev * 20:rev * 20 + 20]
+
+    def _addstring(self, s):
+        self._stringids[s] = len(self.strings)
+        self.strings.append(s)
+
+    def _stringid(self, s):
+        i = self._stringids.get(s)
+        if i is None:
+            i = len(self.strings)
+            self._addstring(s)
+        return i
+
+    def matchingstrings(self, match):
+        """set of the ids of the strings for which match is true
+
+        The strings are converted to the local encoding first."""
+        return set(i for i, s in enumerate(self.strings)
+                   if match(encoding.tolocal(s)))
+
+    def _truncate(self, count):
+        self.nodes = self.nodes[:count * 20]
+        for name, code in _columns:
+            del getattr(self, name)[count:]
+        self._ondisk = min(self._ondisk, count)
+
+    def update(self, repo):
+        """add the revisions missing from the cache
+
+        Revisions no longer in the changelog, after a strip, are removed
+        first. Returns True if the cache changed."""
+        cl = repo.changelog
+        count = len(self)
+        valid = min(count, len(cl))
+        while valid and self.node(valid - 1) != cl.node(valid - 1):
+            valid -= 1
+        if valid < count:
+            self._truncate(valid)
+            self._dirty = True
+
+        if valid == len(cl):
+            return valid < count
+        nodes = [self.nodes]
+        for rev in xrange(valid, len(cl)):
+            node = cl.node(rev)
+            manifest, user, date, files, desc, extra = cl.read(node)
+            nodes.append(node)
+            self.user.append(self._stringid(encoding.fromlocal(user)))
+            self.date.append(date[0])
+            self.branch.append(self._stringid(extra.get('branch',
+                                                        'default')))
+            flags = 0
+            if 'close' in extra:
+                flags |= CLOSED
+            self.flags.append(flags)
+            self.files.append(len(files))
+        self.nodes = ''.join(nodes)
+        self._dirty = True
+        return True
+
+    def write(self, repo):
+        opener = repo.opener
+        try:
+            wlock = repo.wlock(False)
+        except (error.LockError, IOError, OSError, util.Abort):
+            # another process is writing, or the repository is read only
+            return
+        try:
+            try:
+                self._write(opener)
+            except (IOError, OSError, util.Abort):
+                # Abort may be raised by read only opener
+                pass
+        finally:
+            wlock.release()
+
+    def _write(self, opener):
+        def writecolumn(name, data, ondisk):
+            # append to the files left as they were by the last write
+            path = _colfile(name)
+            if (ondisk and opener.exists(path)
+                and opener.stat(path).st_size == ondisk):
+                opener.append(path, data[ondisk:])
+            else:
+                f = opener(path, 'w', atomictemp=True)
+                f.write(data)
+                f.close()
+
+        strings = ''.join(s + '\n' for s in self.strings)
+        writecolumn('strings', strings, self._ondiskstrings)
+        writecolumn('node', self.nodes, self._ondisk * 20)
+        for name, code in _columns:
+            a = getattr(self, name)
+            writecolumn(name, _tostring(a), self._ondisk * a.itemsize)
+
+        tipnode = self.nodes[-20:] or nullid
+        f = opener(_filename, 'w', atomictemp=True)
+        f.write('%d %s %d\n' % (len(self), hex(tipnode), len(self.strings)))
+        f.close()
+        self._ondisk = len(self)
+        self._ondiskstrings = len(strings)
+        self._dirty = False
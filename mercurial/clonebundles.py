@@ -0,0 +1,222 @@
+# clonebundles.py - pre-generated bundles for cloning clients
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""serve clones from pre-generated bundles
+
+Computing and compressing the changegroup of a full clone is by far
+the most expensive request a server answers. The debugclonebundles
+command writes full bundles and stream snapshots of the repository
+into .hg/clonebundles/ and lists them in .hg/clonebundles.manifest,
+which the server then advertises with the "clonebundles" capability.
+The files are meant to be published by a plain web server at the URL
+configured with server.clonebundlesurl.
+
+A cloning client fetches and applies the first bundle of the manifest
+it supports, then pulls the changesets added since it was generated.
+"""
+
+from i18n import _
+from node import hex
+import os
+import changegroup, util, wireproto
+import url as urlmod
+
+manifestname = 'clonebundles.manifest'
+bundledir = 'clonebundles'
+streammagic = 'HGSTREAM1'
+
+def parsemanifest(data):
+    """parse the content of a manifest into a list of (url, attrs)
+
+    Each non-empty line holds the URL of a bundle followed by space
+    separated KEY=VALUE attributes.
+    """
+    entries = []
+    for line in data.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        attrs = {}
+        for field in fields[1:]:
+            if '=' in field:
+                key, value = field.split('=', 1)
+                attrs[key] = value
+        entries.append((fields[0], attrs))
+    return entries
+
+def formatmanifest(entries):
+    """return the content of a manifest listing entries"""
+    lines = []
+    for url, attrs in entries:
+        fields = [url] + ['%s=%s' % a for a in sorted(attrs.iteritems())]
+        lines.append(' '.join(fields) + '\n')
+    return ''.join(lines)
+
+def _writebundle(repo, path, bundletype, heads):
+    cg = repo.getbundle('bundle', heads=heads)
+    tmpname = repo.join(path + '.tmp')
+    changegroup.writebundle(cg, tmpname, bundletype)
+    util.rename(tmpname, repo.join(path))
+
+def _writestream(repo, path, entries, total_bytes, requirements):
+    fp = repo.opener(path, 'wb', atomictemp=True)
+    try:
+        fp.write('%s %s\n' % (streammagic, ','.join(sorted(requirements))))
+        for chunk in wireproto.generatestream(repo, entries, total_bytes):
+            fp.write(chunk)
+        fp.close()
+    finally:
+        fp.discard()
+
+def generate(ui, repo, types):
+    """write the bundles of the given types for the current heads of
+    repo and list them in the manifest
+
+    Bundles are named after a hash of the heads they contain, so
+    existing ones are reused when the repository did not change. The
+    bundles of the previous manifest are kept for clients that may
+    still be downloading them, older ones are removed.
+    """
+    baseurl = ui.config('server', 'clonebundlesurl')
+    if not baseurl:
+        raise util.Abort(_('no URL configured for clone bundles'),
+                         hint=_('set server.clonebundlesurl'))
+    for t in types:
+        if t != 'stream' and not changegroup.bundletypes.get(t, ('',))[0]:
+            raise util.Abort(_('unknown clone bundle type: %s') % t)
+
+    repo = repo.filtered('served')
+    lock = repo.lock()
+    try:
+        heads = sorted(repo.heads())
+        requirements = repo.requirements & repo.supportedformats
+        streamentries = None
+        if 'stream' in types:
+            streamentries = wireproto.scanstream(repo)
+    finally:
+        lock.release()
+
+    key = hex(util.sha1(''.join(heads)).digest())[:12]
+    if not repo.opener.isdir(bundledir):
+        repo.opener.makedirs(bundledir)
+    entries = []
+    names = set()
+    for t in types:
+        name = '%s.%s' % (key, t.lower())
+        path = os.path.join(bundledir, name)
+        if repo.opener.exists(path):
+            ui.status(_('%s is up to date\n') % name)
+        else:
+            ui.status(_('writing %s\n') % name)
+            if t == 'stream':
+                _writestream(repo, path, streamentries[0], streamentries[1],
+                             requirements)
+            else:
+                _writebundle(repo, path, t, heads)
+        attrs = {'TYPE': t}
+        if t == 'stream':
+            attrs['REQUIREMENTS'] = ','.join(sorted(requirements))
+        entries.append(('%s/%s' % (baseurl.rstrip('/'), name), attrs))
+        names.add(name)
+
+    old = parsemanifest(repo.opener.tryread(manifestname))
+    names.update(url.rsplit('/', 1)[-1] for url, attrs in old)
+    fp = repo.opener(manifestname, 'w', atomictemp=True)
+    fp.write(formatmanifest(entries))
+    fp.close()
+
+    for name, kind in repo.opener.readdir(bundledir):
+        if name not in names:
+            ui.note(_('removing %s\n') % name)
+            util.unlink(repo.join(os.path.join(bundledir, name)))
+    return entries
+
+def _supported(repo, attrs):
+    t = attrs.get('TYPE')
+    if t == 'stream':
+        requirements = set(attrs.get('REQUIREMENTS', 'revlogv1').split(','))
+        return not requirements - repo.supportedformats
+    return bool(changegroup.bundletypes.get(t, ('',))[0])
+
+def _applystream(repo, fh, url):
+    l = fh.readline()
+    magic, requirements = (l.split(' ', 1) + [''])[:2]
+    if magic != streammagic:
+        raise util.Abort(_('%s: not a stream snapshot') % url)
+    requirements = set(requirements.strip().split(','))
+    if requirements - repo.supportedformats:
+        raise util.Abort(_('%s: unsupported repository format') % url)
+    repo.applystream(fh, requirements)
+
+def _cleanstore(repo):
+    """remove the revlogs left in the store of repo, which was empty
+    before a bundle failed to apply"""
+    for a, b, size in list(repo.store.walk()):
+        util.unlink(repo.store.rawvfs.join(b))
+    # listing the data files again drops the removed ones from the fncache
+    for f in repo.store.datafiles():
+        pass
+    repo.invalidate()
+
+def clone(repo, remote, stream=False):
+    """apply the first pre-generated bundle advertised by remote that
+    repo supports, stream snapshots first when stream is set
+
+    Returns True if a bundle was applied. The caller is expected to
+    pull the changesets added to remote since the bundle was generated.
+    If the bundle cannot be fetched or applied, the store is left empty
+    and False is returned, so that the caller falls back to a regular
+    clone.
+    """
+    ui = repo.ui
+    if len(repo):
+        # the revisions of a broken bundle could not be told apart
+        ui.debug('not applying a clone bundle to a non-empty repository\n')
+        return False
+    entries = []
+    for url, attrs in parsemanifest(remote.clonebundles()):
+        if _supported(repo, attrs):
+            entries.append((url, attrs))
+        else:
+            ui.debug('skipping unsupported clone bundle %s\n' % url)
+    if stream:
+        entries.sort(key=lambda e: e[1]['TYPE'] != 'stream')
+    if not entries:
+        ui.debug('no usable clone bundle\n')
+        return False
+
+    url, attrs = entries[0]
+    ui.status(_('applying clone bundle from %s\n') % url)
+    try:
+        fh = urlmod.open(ui, url)
+    except IOError, inst:
+        ui.warn(_('error fetching bundle: %s\n')
+                % (getattr(inst, 'reason', None) or inst))
+        ui.warn(_('falling back to regular clone\n'))
+        return False
+    lock = repo.lock()
+    try:
+        try:
+            if attrs['TYPE'] == 'stream':
+                _applystream(repo, fh, url)
+            else:
+                cg = changegroup.readbundle(fh, url)
+                repo.addchangegroup(cg, 'clonebundles', url)
+        except Exception, inst:
+            # a corrupt or truncated bundle can fail in many ways, none
+            # of which should prevent the regular clone
+            ui.warn(_('error applying bundle: %s\n')
+                    % (getattr(inst, 'strerror', None) or
+                       (inst.args and inst.args[0]) or inst))
+            ui.warn(_('falling back to regular clone\n'))
+            _cleanstore(repo)
+            return False
+    finally:
+        lock.release()
+        fh.close()
+    ui.status(_('finished applying clone bundle\n'))
+    return True
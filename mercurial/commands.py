@@ -17,7 +17,7 @@ import merge as mergemod
 import minirst, revset, fileset
 import dagparser, context, simplemerge, graphmod
 import random, setdiscovery, treediscovery, dagutil, pvec, localrepo
-import phases, obsolete
+import phases, obsolete, redelta, clonebundles
 
 table = {}
 
@@ -1057,8 +1057,9 @@ def bundle(ui, repo, fname, dest=None, **opts):
     -a/--all (or --base null).
 
     You can change compression method with the -t/--type option.
-    The available compression methods are: none, bzip2, and
-    gzip (by default, bundles are compressed using bzip2).
+    The available compression methods are: none, bzip2, gzip, and
+    zstd when the zstandard Python module is installed (by default,
+    bundles are compressed using bzip2).
 
     The bundle file can then be transferred using conventional means
     and applied to another repository with the unbundle or pull
@@ -1074,9 +1075,7 @@ def bundle(ui, repo, fname, dest=None, **opts):
     if 'rev' in opts:
         revs = scmutil.revrange(repo, opts['rev'])
 
-    bundletype = opts.get('type', 'bzip2').lower()
-    btypes = {'none': 'HG10UN', 'bzip2': 'HG10BZ', 'gzip': 'HG10GZ'}
-    bundletype = btypes.get(bundletype)
+    bundletype = changegroup.namedbundletype(opts.get('type', 'bzip2'))
     if bundletype not in changegroup.bundletypes:
         raise util.Abort(_('unknown bundle type specified with --type'))
 
@@ -1668,6 +1667,31 @@ def debugcheckstate(ui, repo):
         error = _(".hg/dirstate inconsistent with current parent's manifest")
         raise util.Abort(error)
 
+@command('debugclonebundles',
+    [('t', 'type', [], _('bundle type to generate (HG10BZ, HG10GZ, '
+                         'HG10UN or stream)'), _('TYPE'))],
+    _('[-t TYPE]...'))
+def debugclonebundles(ui, repo, **opts):
+    """pre-generate the bundles offered to cloning clients
+
+    Full bundles of the repository are written to .hg/clonebundles/
+    and listed in .hg/clonebundles.manifest. The server advertises
+    them to clients, which fetch the first one they support at the
+    URL set by ``server.clonebundlesurl`` before pulling the
+    remaining changesets. The directory must be published at that URL
+    by a web server.
+
+    Bundles are only generated again when the heads of the repository
+    change, so this command can be run periodically. The bundles of
+    the previous run are kept, older ones are removed.
+
+    By default a bzip2 compressed bundle is generated. The stream type
+    is a snapshot of the store applied like an uncompressed clone.
+    """
+    types = opts.get('type') or ['HG10BZ']
+    for url, attrs in clonebundles.generate(ui, repo, types):
+        ui.note('%s\n' % url)
+
 @command('debugcommands', [], _('[COMMAND]'))
 def debugcommands(ui, cmd='', *args):
     """list all available commands and options"""
@@ -1909,9 +1933,7 @@ def debuggetbundle(ui, repopath, bundlepath, head=None, common=None, **opts):
         args['heads'] = [bin(s) for s in head]
     bundle = repo.getbundle('debug', **args)
 
-    bundletype = opts.get('type', 'bzip2').lower()
-    btypes = {'none': 'HG10UN', 'bzip2': 'HG10BZ', 'gzip': 'HG10GZ'}
-    bundletype = btypes.get(bundletype)
+    bundletype = changegroup.namedbundletype(opts.get('type', 'bzip2'))
     if bundletype not in changegroup.bundletypes:
         raise util.Abort(_('unknown bundle type specified with --type'))
     changegroup.writebundle(bundle, bundlepath, bundletype)
@@ -2290,6 +2312,22 @@ def debugrebuilddirstate(ui, repo, rev):
     finally:
         wlock.release()
 
+@command('debugredelta', [], '')
+def debugredelta(ui, repo):
+    """rewrite the revlogs of the store with better delta parents
+
+    The deltas of every revision are recomputed against its parents
+    and the previous revision in parallel, and the smallest one is
+    stored. Revlogs of repositories using generaldelta that were
+    created before it was enabled are converted to it. The repository
+    must not be accessed by other processes during the rewrite. After
+    an interrupted rewrite, :hg:`recover` or the next run puts the
+    original revlogs back and removes the temporary files.
+    """
+    oldsize, newsize = redelta.redelta(ui, repo)
+    ui.write(_('old store size: %d bytes\n') % oldsize)
+    ui.write(_('new store size: %d bytes\n') % newsize)
+
 @command('debugrename',
     [('r', 'rev', '', _('revision to debug'), _('REV'))],
     _('[-r REV] FILE'))
@@ -2360,10 +2398,12 @@ def debugrevlog(ui, repo, file_ = None, **opts):
     nump1prev = 0
     nump2prev = 0
     chainlengths = []
+    chainbases = []
 
     datasize = [None, 0, 0L]
     fullsize = [None, 0, 0L]
     deltasize = [None, 0, 0L]
+    chainspan = [None, 0, 0L]
 
     def addsize(size, l):
         if l[0] is None or size < l[0]:
@@ -2383,10 +2423,12 @@ def debugrevlog(ui, repo, file_ = None, **opts):
         size = r.length(rev)
         if delta == nullrev:
             chainlengths.append(0)
+            chainbases.append(rev)
             numfull += 1
             addsize(size, fullsize)
         else:
             chainlengths.append(chainlengths[delta] + 1)
+            chainbases.append(chainbases[delta])
             addsize(size, deltasize)
             if delta == rev - 1:
                 numprev += 1
@@ -2400,9 +2442,10 @@ def debugrevlog(ui, repo, file_ = None, **opts):
                 nump2 += 1
             elif delta != nullrev:
                 numother += 1
+        addsize(r.end(rev) - r.start(chainbases[rev]), chainspan)
 
     # Adjust size min value for empty cases
-    for size in (datasize, fullsize, deltasize):
+    for size in (datasize, fullsize, deltasize, chainspan):
         if size[0] is None:
             size[0] = 0
 
@@ -2417,6 +2460,8 @@ def debugrevlog(ui, repo, file_ = None, **opts):
         deltasize[2] /= numrevs - numfull
     totalsize = fulltotal + deltatotal
     avgchainlen = sum(chainlengths) / numrevs
+    maxchainlen = max(chainlengths or [0])
+    chainspan[2] /= numrevs
     compratio = totalrawsize / totalsize
 
     basedfmtstr = '%%%dd\n'
@@ -2447,8 +2492,9 @@ def debugrevlog(ui, repo, file_ = None, **opts):
     ui.write(('    deltas    : ') + fmt % pcfmt(deltatotal, totalsize))
 
     ui.write('\n')
-    fmt = dfmtstr(max(avgchainlen, compratio))
+    fmt = dfmtstr(max(maxchainlen, compratio))
     ui.write(('avg chain length  : ') + fmt % avgchainlen)
+    ui.write(('max chain length  : ') + fmt % maxchainlen)
     ui.write(('compression ratio : ') + fmt % compratio)
 
     if format > 0:
@@ -2459,6 +2505,27 @@ def debugrevlog(ui, repo, file_ = None, **opts):
              % tuple(fullsize))
     ui.write(('delta size (min/max/avg)             : %d / %d / %d\n')
              % tuple(deltasize))
+    ui.write(('chain span (min/max/avg)             : %d / %d / %d\n')
+             % tuple(chainspan))
+
+    # chain lengths grouped by powers of two
+    buckets = []
+    for clen in chainlengths:
+        b = 0
+        while clen >= (1 << b):
+            b += 1
+        while len(buckets) <= b:
+            buckets.append(0)
+        buckets[b] += 1
+    ui.write('\n')
+    ui.write(('chain length distribution:\n'))
+    fmt = pcfmtstr(numrevs)
+    for b, count in enumerate(buckets):
+        if b < 2:
+            label = '%d' % b
+        else:
+            label = '%d-%d' % (1 << (b - 1), (1 << b) - 1)
+        ui.write('    %-8s : ' % label + fmt % pcfmt(count, numrevs))
 
     if numdeltas > 0:
         ui.write('\n')
@@ -2485,7 +2552,7 @@ def debugrevspec(ui, repo, expr):
     """parse and apply a revision specification
 
     Use --verbose to print the parsed tree before and after aliases
-    expansion.
+    expansion, and the tree actually evaluated with its estimated cost.
     """
     if ui.verbose:
         tree = revset.parse(expr)[0]
@@ -2493,6 +2560,11 @@ def debugrevspec(ui, repo, expr):
         newtree = revset.findaliases(ui, tree)
         if newtree != tree:
             ui.note(revset.prettyformat(newtree), "\n")
+        weight, optimizedtree = revset.optimize(newtree, True)
+        cost, size, plannedtree = revset.plan(repo, optimizedtree)
+        ui.note(_("* plan (estimated cost %.1f, %.1f revisions):\n")
+                % (cost, size))
+        ui.note(revset.prettyformat(plannedtree), "\n")
     func = revset.match(ui, expr)
     for c in func(repo, range(len(repo))):
         ui.write("%s\n" % c)
@@ -5102,9 +5174,8 @@ def serve(ui, repo, **opts):
         s.serve_forever()
 
     if opts["cmdserver"]:
-        checkrepo()
-        s = commandserver.server(ui, repo, opts["cmdserver"])
-        return s.serve()
+        service = commandserver.createservice(ui, repo, opts)
+        return cmdutil.service(opts, initfn=service.init, runfn=service.run)
 
     # this way we can check if something was given in the command-line
     if opts.get('port'):
@@ -5230,6 +5301,7 @@ def showconfig(ui, repo, *values, **opts):
     ('0', 'print0', None, _('end filenames with NUL, for use with xargs')),
     ('', 'rev', [], _('show difference from revision'), _('REV')),
     ('', 'change', '', _('list the changed files of a revision'), _('REV')),
+    ('', 'stream', None, _('show files as soon as their status is known')),
     ] + walkopts + subrepoopts,
     _('[OPTION]... [FILE]...'))
 def status(ui, repo, *pats, **opts):
@@ -5256,6 +5328,11 @@ def status(ui, repo, *pats, **opts):
     shown. The --change option can also be used as a shortcut to list
     the changed files of a revision from its first parent.
 
+    With --stream, files of the working directory are shown as soon as
+    their status is known rather than sorted and grouped by status,
+    which lets front-ends display them while the working directory is
+    being walked.
+
     The codes used to show the status of files are::
 
       M = modified
@@ -5293,6 +5370,9 @@ def status(ui, repo, *pats, **opts):
     if revs and change:
         msg = _('cannot specify --rev and --change at the same time')
         raise util.Abort(msg)
+    elif opts.get('stream') and (revs or change or opts.get('subrepos')):
+        msg = _('cannot specify --stream with --rev, --change or --subrepos')
+        raise util.Abort(msg)
     elif change:
         node2 = scmutil.revsingle(repo, change, None).node()
         node1 = repo[node2].p1().node()
@@ -5309,10 +5389,17 @@ def status(ui, repo, *pats, **opts):
     if not show:
         show = ui.quiet and states[:4] or states[:5]
 
-    stat = repo.status(node1, node2, scmutil.match(repo[node2], pats, opts),
-                       'ignored' in show, 'clean' in show, 'unknown' in show,
-                       opts.get('subrepos'))
-    changestates = zip(states, 'MAR!?IC', stat)
+    m = scmutil.match(repo[node2], pats, opts)
+    if opts.get('stream'):
+        stat = repo.iterstatus(m, 'ignored' in show, 'clean' in show,
+                               'unknown' in show)
+        changes = ((state, f) for state, f in stat if state in show)
+    else:
+        stat = repo.status(node1, node2, m, 'ignored' in show,
+                           'clean' in show, 'unknown' in show,
+                           opts.get('subrepos'))
+        changes = ((state, f) for state, files in zip(states, stat)
+                   if state in show for f in files)
 
     if (opts.get('all') or opts.get('copies')) and not opts.get('no_status'):
         copy = copies.pathcopies(repo[node1], repo[node2])
@@ -5320,17 +5407,16 @@ def status(ui, repo, *pats, **opts):
     fm = ui.formatter('status', opts)
     fmt = '%s' + end
     showchar = not opts.get('no_status')
+    chars = dict(zip(states, 'MAR!?IC'))
 
-    for state, char, files in changestates:
-        if state in show:
-            label = 'status.' + state
-            for f in files:
-                fm.startitem()
-                fm.condwrite(showchar, 'status', '%s ', char, label=label)
-                fm.write('path', fmt, repo.pathto(f, cwd), label=label)
-                if f in copy:
-                    fm.write("copy", '  %s' + end, repo.pathto(copy[f], cwd),
-                             label='status.copied')
+    for state, f in changes:
+        label = 'status.' + state
+        fm.startitem()
+        fm.condwrite(showchar, 'status', '%s ', chars[state], label=label)
+        fm.write('path', fmt, repo.pathto(f, cwd), label=label)
+        if f in copy:
+            fm.write("copy", '  %s' + end, repo.pathto(copy[f], cwd),
+                     label='status.copied')
     fm.end()
 
 @command('^summary|sum',
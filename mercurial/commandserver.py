@@ -7,8 +7,8 @@
 
 from i18n import _
 import struct
-import sys, os
-import dispatch, encoding, util
+import sys, os, errno, signal, socket
+import dispatch, encoding, util, cmdutil, error, hg, scmutil
 
 logfile = None
 
@@ -125,12 +125,96 @@ class channeledinput(object):
             raise AttributeError(attr)
         return getattr(self.in_, attr)
 
+class repocache(object):
+    """
+    A repository kept between requests.
+
+    The caches of the repository not tracked by filecache (tags, branch
+    heads, ...) are kept as long as the files they are computed from do
+    not change.
+    """
+    def __init__(self, repo):
+        self.repo = repo
+        self.repoui = repo.ui
+        self._entries = None
+
+    def _changed(self):
+        repo = self.repo
+        paths = [repo.sjoin('00changelog.i'), repo.sjoin('phaseroots'),
+                 repo.sjoin('obsstore'), repo.join('bookmarks'),
+                 repo.join('localtags'), repo.join('dirstate')]
+        if self._entries is None:
+            self._entries = [scmutil.filecacheentry(p) for p in paths]
+            return True
+        changed = False
+        for entry in self._entries:
+            # check all of them so their stat information is refreshed
+            if entry.changed():
+                changed = True
+        return changed
+
+    def prepare(self, ui):
+        """prepare the repository for a request using ui"""
+        repo = self.repo
+        # copy the uis so changes (e.g. --config or --verbose) don't
+        # persist between requests
+        repo.baseui = ui
+        repo.ui = repo.dirstate._ui = self.repoui.copy()
+        # the file caches are checked again when used, the other caches
+        # only need to go if one of the files changed
+        repo.invalidate(clearcaches=False)
+        if self._changed():
+            repo.invalidatecaches()
+        repo.invalidatedirstate()
+
+    def preload(self):
+        """read the data most commands need"""
+        repo = self.repo
+        repo.changelog
+        repo.dirstate._map
+        repo.branchmap()
+
+    def _caches(self, dirstate):
+        repo = self.repo.unfiltered()
+        caches = {}
+        # the tags are cached on the filtered repository
+        if '_tagscache' in vars(self.repo):
+            caches['tags'] = vars(self.repo)['_tagscache']
+        for name, cache in repo._branchcaches.iteritems():
+            caches['branchmap.%s' % name] = cache
+        if dirstate is not None and '_map' in vars(dirstate):
+            caches['dirstate.map'] = dirstate._map
+        return caches
+
+    def snapshot(self):
+        """return the caches of the repository used by a request, by name"""
+        repo = self.repo.unfiltered()
+        caches = self._caches(vars(repo).get('dirstate'))
+        for name in repo._filecache:
+            if name in vars(repo):
+                caches[name.lstrip('_')] = vars(repo)[name]
+        return caches
+
+    def cachedobjects(self):
+        """return the caches a request can reuse, by name"""
+        repo = self.repo.unfiltered()
+        # the file caches were invalidated but their objects are reused
+        # if the files did not change
+        dirstate = None
+        if 'dirstate' in repo._filecache:
+            dirstate = repo._filecache['dirstate'].obj
+        caches = self._caches(dirstate)
+        for name, entry in repo._filecache.iteritems():
+            if entry.obj is not None:
+                caches[name.lstrip('_')] = entry.obj
+        return caches
+
 class server(object):
     """
-    Listens for commands on stdin, runs them and writes the output on a channel
-    based stream to stdout.
+    Listens for commands on fin, runs them and writes the output on a channel
+    based stream to fout.
     """
-    def __init__(self, ui, repo, mode):
+    def __init__(self, ui, repo, fin, fout):
         self.cwd = os.getcwd()
 
         logpath = ui.config("cmdserver", "log", None)
@@ -138,25 +222,36 @@ class server(object):
             global logfile
             if logpath == '-':
                 # write log on a special 'd' (debug) channel
-                logfile = channeledoutput(sys.stdout, sys.stdout, 'd')
+                logfile = channeledoutput(fout, fout, 'd')
             else:
                 logfile = open(logpath, 'a')
 
-        # the ui here is really the repo ui so take its baseui so we don't end
-        # up with its local configuration
-        self.ui = repo.baseui
+        if repo:
+            # the ui here is really the repo ui so take its baseui so we don't
+            # end up with its local configuration
+            self.ui = repo.baseui
+            self.repoui = repo.ui
+            self.repocache = repocache(repo)
+        else:
+            # the repositories are then found by dispatch
+            self.ui = ui
+            self.repoui = None
+            self.repocache = None
         self.repo = repo
-        self.repoui = repo.ui
+        # the other repositories requests were run in with -R or --cwd
+        self.repos = util.lrucachedict(
+            max(1, ui.configint('cmdserver', 'repocachesize', 4)))
 
-        if mode == 'pipe':
-            self.cerr = channeledoutput(sys.stderr, sys.stdout, 'e')
-            self.cout = channeledoutput(sys.stdout, sys.stdout, 'o')
-            self.cin = channeledinput(sys.stdin, sys.stdout, 'I')
-            self.cresult = channeledoutput(sys.stdout, sys.stdout, 'r')
+        self.cerr = channeledoutput(fout, fout, 'e')
+        self.cout = channeledoutput(fout, fout, 'o')
+        self.cin = channeledinput(fin, fout, 'I')
+        self.cresult = channeledoutput(fout, fout, 'r')
+        self.cstats = None
+        if ui.configbool('cmdserver', 'cachestats'):
+            # per request cache use, on a special 's' (statistics) channel
+            self.cstats = channeledoutput(fout, fout, 's')
 
-            self.client = sys.stdin
-        else:
-            raise util.Abort(_('unknown mode %s') % mode)
+        self.client = fin
 
     def _read(self, size):
         if not size:
@@ -170,6 +265,33 @@ class server(object):
 
         return data
 
+    def _repofor(self, args):
+        """return the cached repository a request with args runs in"""
+        args = args[:]
+        cwd = dispatch._earlygetopt(['--cwd'], args)
+        rpath = dispatch._earlygetopt(["-R", "--repository", "--repo"], args)
+        if not cwd and not rpath:
+            return self.repocache
+
+        wd = os.path.join(self.cwd, cwd and cwd[-1] or '')
+        if rpath and rpath[-1]:
+            path = os.path.join(wd, util.expandpath(rpath[-1]))
+        else:
+            path = cmdutil.findrepo(wd)
+        # anything else (bundles, paths aliases, ...) is left to dispatch
+        if not path or not os.path.isdir(os.path.join(path, '.hg')):
+            return self.repocache
+        root = os.path.realpath(path)
+        if self.repo and root == self.repo.root:
+            return self.repocache
+        if root not in self.repos:
+            try:
+                repo = hg.repository(self.ui, root)
+            except error.RepoError:
+                return self.repocache
+            self.repos[root] = repocache(repo)
+        return self.repos[root]
+
     def runcommand(self):
         """ reads a list of \0 terminated arguments, executes
         and writes the return code to the result channel """
@@ -180,15 +302,16 @@ class server(object):
         else:
             args = self._read(length).split('\0')
 
-        # copy the uis so changes (e.g. --config or --verbose) don't
-        # persist between requests
+        cache = self._repofor(args)
         copiedui = self.ui.copy()
-        self.repo.baseui = copiedui
-        self.repo.ui = self.repo.dirstate._ui = self.repoui.copy()
-        self.repo.invalidate()
-        self.repo.invalidatedirstate()
-
-        req = dispatch.request(args[:], copiedui, self.repo, self.cin,
+        repo = None
+        if cache:
+            cache.prepare(copiedui)
+            repo = cache.repo
+            if self.cstats:
+                before = cache.cachedobjects()
+
+        req = dispatch.request(args[:], copiedui, repo, self.cin,
                                self.cout, self.cerr)
 
         ret = dispatch.dispatch(req) or 0 # might return None
@@ -197,6 +320,15 @@ class server(object):
         if '--cwd' in args:
             os.chdir(self.cwd)
 
+        if self.cstats and cache:
+            stats = []
+            for name, obj in sorted(cache.snapshot().iteritems()):
+                if before.get(name) is obj:
+                    stats.append('%s=hit' % name)
+                else:
+                    stats.append('%s=miss' % name)
+            self.cstats.write(' '.join(stats) + '\n')
+
         self.cresult.write(struct.pack('>i', int(ret)))
 
     def getencoding(self):
@@ -223,6 +355,8 @@ class server(object):
         hellomsg = 'capabilities: ' + ' '.join(sorted(self.capabilities))
         hellomsg += '\n'
         hellomsg += 'encoding: ' + encoding.encoding
+        hellomsg += '\n'
+        hellomsg += 'pid: %d' % os.getpid()
 
         # write the hello msg in -one- chunk
         self.cout.write(hellomsg)
@@ -236,3 +370,128 @@ class server(object):
             return 1
 
         return 0
+
+class pipeservice(object):
+    """serve a single client on the standard input and output"""
+    def __init__(self, ui, repo, opts):
+        self.server = server(ui, repo, sys.stdin, sys.stdout)
+
+    def init(self):
+        pass
+
+    def run(self):
+        return self.server.serve()
+
+class unixservice(object):
+    """
+    Listens on a unix domain socket and serves each client in a process
+    forked from a parent holding the preloaded repository.
+    """
+    def __init__(self, ui, repo, opts):
+        self.ui = ui
+        self.repo = repo
+        self.repocache = repo and repocache(repo)
+        self.address = opts['address']
+        if not util.safehasattr(socket, 'AF_UNIX'):
+            raise util.Abort(_('unsupported platform'))
+        if not self.address:
+            raise util.Abort(_('no socket path specified with --address'))
+
+    def init(self):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.bind(self.address)
+        # the socket may be replaced by the one of a new server before
+        # this one exits
+        self._sockino = os.stat(self.address).st_ino
+        self.sock.listen(5)
+        self.ui.status(_('listening at %s\n') % self.address)
+        self.ui.flush()  # avoid buffering of status message
+
+    def _reapchildren(self, signum, frame):
+        while True:
+            try:
+                pid = os.waitpid(-1, os.WNOHANG)[0]
+            except OSError, inst:
+                if inst.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+
+    def _createserver(self, conn, fin, fout):
+        sv = server(self.ui, self.repo, fin, fout)
+        sv.repocache = self.repocache
+        return sv
+
+    def _serveone(self, conn):
+        # unbuffered, so that nothing past a command is read from the
+        # socket before it is run
+        fin = conn.makefile('rb', 0)
+        fout = conn.makefile('wb')
+        try:
+            try:
+                sv = self._createserver(conn, fin, fout)
+                return sv.serve()
+            except util.Abort, inst:
+                # the client has no other way to be told
+                self.ui.warn(_('abort: %s\n') % inst)
+                return 255
+        finally:
+            fin.close()
+            try:
+                fout.close()
+            except IOError, inst:
+                if inst.errno != errno.EPIPE:
+                    raise
+
+    def run(self):
+        cache = self.repocache
+        oldhandler = signal.signal(signal.SIGCHLD, self._reapchildren)
+        try:
+            while True:
+                # have the data most requests need read once, in the parent
+                if cache:
+                    cache.prepare(self.repo.baseui.copy())
+                    cache.preload()
+                try:
+                    conn = self.sock.accept()[0]
+                except socket.error, inst:
+                    if inst.args[0] == errno.EINTR:
+                        continue
+                    raise
+                pid = os.fork()
+                if pid:
+                    conn.close()
+                    continue
+                ret = 255
+                try:
+                    try:
+                        signal.signal(signal.SIGCHLD, oldhandler)
+                        self.sock.close()
+                        ret = self._serveone(conn)
+                    except Exception:
+                        self.ui.traceback(force=True)
+                finally:
+                    conn.close()
+                    os._exit(ret)
+        finally:
+            signal.signal(signal.SIGCHLD, oldhandler)
+            self.sock.close()
+            try:
+                if os.stat(self.address).st_ino == self._sockino:
+                    os.unlink(self.address)
+            except OSError, inst:
+                if inst.errno != errno.ENOENT:
+                    raise
+
+_servicemap = {
+    'pipe': pipeservice,
+    'unix': unixservice,
+    }
+
+def createservice(ui, repo, opts):
+    mode = opts['cmdserver']
+    try:
+        return _servicemap[mode](ui, repo, opts)
+    except KeyError:
+        raise util.Abort(_('unknown mode %s') % mode)
@@ -7,7 +7,7 @@
 
 from i18n import _
 import error, util
-import os, errno
+import os, errno, marshal, time
 
 class sortdict(dict):
     'a simple sorted dictionary'
@@ -45,10 +45,14 @@ class config(object):
         self._data = {}
         self._source = {}
         self._unset = []
+        # the (argument, directory, path) of the %include lines parsed
+        # by readcached
+        self._includes = None
         if data:
             for k in data._data:
                 self._data[k] = data[k].copy()
             self._source = data._source.copy()
+            self._unset = list(data._unset)
     def copy(self):
         return config(self)
     def __contains__(self, section):
@@ -141,9 +145,10 @@ class config(object):
                 cont = False
             m = includere.match(l)
             if m:
-                inc = util.expandpath(m.group(1))
                 base = os.path.dirname(src)
-                inc = os.path.normpath(os.path.join(base, inc))
+                inc = _includepath(m.group(1), base)
+                if self._includes is not None:
+                    self._includes.append((m.group(1), base, inc))
                 if include:
                     try:
                         include(inc, remap=remap, sections=sections)
@@ -187,3 +192,114 @@ class config(object):
         if not fp:
             fp = util.posixfile(path)
         self.parse(path, fp.read(), sections, remap, self.read)
+
+    def readcached(self, path, fp, sections=None, remap=None):
+        """read the file at path, opened as fp, into this empty config
+
+        The file is only parsed again once it or one of the files it
+        includes changed since it was last read by this process, or since
+        it was stored in the file named by the HGRCCACHE environment
+        variable. %include arguments expanding to other paths, as with a
+        different environment, count as a change."""
+        if _cachepath is None:
+            _loadcache()
+        key = (path, tuple(sections or ()),
+               tuple(sorted((remap or {}).items())))
+        entry = _cache.get(key)
+        signatures = [_signature(path, fp)]
+        if (entry and entry[0][0] == signatures[0] and
+            [_signature(s[0]) for s in entry[0][1:]] == entry[0][1:] and
+            [_includepath(a, b) for a, b, p in entry[2]] ==
+            [p for a, b, p in entry[2]]):
+            data, unset = entry[1]
+            for section, items in data:
+                self._data[section] = sortdict()
+                for item, value, source in items:
+                    self.set(section, item, value, source)
+            self._unset = list(unset)
+            return
+
+        def include(path, sections=None, remap=None):
+            signatures.append(_signature(path))
+            self.parse(path, util.posixfile(path).read(), sections, remap,
+                       include)
+        self._includes = []
+        try:
+            self.parse(path, fp.read(), sections, remap, include)
+        finally:
+            includes, self._includes = self._includes, None
+
+        # a file changed in the current second may change again unnoticed,
+        # and the clock of its filesystem may be a little off ours
+        now = int(time.time())
+        for s in signatures:
+            if len(s) > 1 and max(s[2], s[3]) >= now - _clockmargin:
+                return
+        data = [(section, [(item, value, self.source(section, item))
+                           for item, value in self.items(section)])
+                for section in self.sections()]
+        _cache[key] = (signatures, (data, list(self._unset)), includes)
+        _savecache()
+
+# the parsed configuration files, by path and read options, with the
+# signatures of the files they were read from and the %include lines
+# they hold, optionally kept in the file named by HGRCCACHE
+_cache = {}
+_cachepath = None
+_cacheversion = 2
+# seconds by which the clocks of the filesystems holding configuration
+# files may be ahead of or behind ours
+_clockmargin = 2
+
+def _includepath(arg, base):
+    """return the path of the file included by an %include line with
+    argument arg in a file of directory base"""
+    return os.path.normpath(os.path.join(base, util.expandpath(arg)))
+
+def _signature(path, fp=None):
+    """return what tells whether the file at path changed, or that it
+    does not exist"""
+    try:
+        if fp:
+            st = util.fstat(fp)
+        else:
+            st = os.stat(path)
+    except OSError:
+        return (path,)
+    return (path, st.st_size, int(st.st_mtime), int(st.st_ctime), st.st_ino)
+
+def _loadcache():
+    global _cachepath
+    _cachepath = os.environ.get('HGRCCACHE', '')
+    if not _cachepath:
+        return
+    try:
+        fp = util.posixfile(_cachepath, 'rb')
+        try:
+            st = util.fstat(fp)
+            # do not trust a cache others may have written
+            if util.safehasattr(os, 'getuid') and (st.st_uid != os.getuid()
+                                                   or st.st_mode & 022):
+                return
+            version, entries = marshal.loads(fp.read())
+        finally:
+            fp.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return
+    if version == _cacheversion and isinstance(entries, dict):
+        _cache.update(entries)
+
+def _savecache():
+    if not _cachepath:
+        return
+    try:
+        # the configuration may hold passwords
+        fp = util.atomictempfile(_cachepath, 'wb', createmode=0600)
+        try:
+            fp.write(marshal.dumps((_cacheversion, _cache)))
+            fp.close()
+        except: # re-raises
+            fp.discard()
+            raise
+    except (IOError, OSError):
+        pass
@@ -24,8 +24,58 @@ These imports will not be delayed:
   b = __import__(a)
 '''
 
-import __builtin__
-_origimport = __import__
+import __builtin__, os, sys, time
+_origimport = _builtinimport = __import__
+
+# time spent loading each module, without the modules it imports
+_importtimes = {}
+# time spent in the imports done by the modules being loaded
+_nestedtimes = []
+
+def _modulename(name, globals):
+    """return the name of the module imported as name by the module of
+    globals, which may be relative to its package"""
+    if globals and '__name__' in globals:
+        pkg = globals['__name__']
+        if '__path__' not in globals:
+            pkg = '.' in pkg and pkg.rsplit('.', 1)[0] or ''
+        if pkg and '%s.%s' % (pkg, name) in sys.modules:
+            return '%s.%s' % (pkg, name)
+    return name
+
+def _timedimport(name, *args):
+    "call __import__, recording the time taken by the modules it loads"
+    count = len(sys.modules)
+    start = time.time()
+    _nestedtimes.append(0.0)
+    try:
+        mod = _builtinimport(name, *args)
+    finally:
+        nested = _nestedtimes.pop()
+        elapsed = time.time() - start
+        if _nestedtimes:
+            _nestedtimes[-1] += elapsed
+    if len(sys.modules) > count:
+        name = _modulename(name, args and args[0])
+        _importtimes[name] = _importtimes.get(name, 0) + elapsed - nested
+    return mod
+
+def recordimports():
+    """record the time spent loading the modules imported from now on
+
+    Setting HGPROF=startup in the environment records it from the start
+    of the process."""
+    global _origimport, _import
+    if _origimport is _timedimport:
+        return
+    if _import is _origimport:
+        _import = _timedimport
+    _origimport = _timedimport
+
+def importtimes():
+    """return the time spent loading each module, by name, without the
+    modules it imports"""
+    return dict(_importtimes)
 
 nothing = object()
 
@@ -38,6 +88,9 @@ except TypeError: # no level argument
 else:
     _import = _origimport
 
+if os.environ.get('HGPROF') == 'startup':
+    recordimports()
+
 class _demandmod(object):
     """module demand-loader and proxy"""
     def __init__(self, name, globals, locals):
@@ -152,4 +205,4 @@ def enable():
 
 def disable():
     "disable global demand-loading of modules"
-    __builtin__.__import__ = _origimport
+    __builtin__.__import__ = _builtinimport
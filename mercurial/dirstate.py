@@ -8,12 +8,15 @@ import errno
 
 from node import nullid
 from i18n import _
-import scmutil, util, ignore, osutil, parsers, encoding
-import os, stat, errno, gc
+import scmutil, util, ignore, osutil, parsers, encoding, worker, fsmonitor
+import dirstatetree
+import os, stat, errno, gc, tempfile
 
 propertycache = util.propertycache
 filecache = scmutil.filecache
 _rangemask = 0x7fffffff
+_statenames = ('unsure', 'modified', 'added', 'removed', 'deleted', 'unknown',
+               'ignored', 'clean')
 
 class repocache(filecache):
     """filecache for files in .hg/"""
@@ -27,12 +30,12 @@ class rootcache(filecache):
 
 class dirstate(object):
 
-    def __init__(self, opener, ui, root, validate):
+    def __init__(self, opener, ui, root, validate, tree=False):
         '''Create a new dirstate object.
 
         opener is an open()-like callable that can be used to open the
         dirstate file; root is the root of the directory tracked by
-        the dirstate.
+        the dirstate; tree selects the format of dirstatetree.py.
         '''
         self._opener = opener
         self._validate = validate
@@ -43,6 +46,21 @@ class dirstate(object):
         self._lastnormaltime = 0
         self._ui = ui
         self._filecache = {}
+        self._monitor = fsmonitor.getbackend(ui, root, opener)
+        # the paths changed in memory since the dirstate was read, the
+        # state of the monitor not saved yet
+        self._monitortouched = None
+        if self._monitor is not None:
+            self._monitortouched = set()
+        self._monitorstate = None
+        self._tree = tree
+        # with the tree format, the directories whose blocks are written
+        # by the next write, or None to write all of them
+        self._changeddirs = None
+        self._mtimesdirty = False
+        # the ignore matcher and the directories known to be ignored or
+        # not by it
+        self._dirignored = (None, {})
 
     @propertycache
     def _map(self):
@@ -94,18 +112,30 @@ class dirstate(object):
 
     @propertycache
     def _dirs(self):
-        return scmutil.dirs(self._map, 'r')
+        dmap = self._map
+        if '_dirs' in self.__dict__:
+            # built from the child counts of the tree format
+            return self.__dict__['_dirs']
+        return scmutil.dirs(dmap, 'r')
 
     def dirs(self):
         return self._dirs
 
-    @rootcache('.hgignore')
-    def _ignore(self):
+    def _ignorefiles(self):
         files = [self._join('.hgignore')]
         for name, path in self._ui.configitems("ui"):
             if name == 'ignore' or name.startswith('ignore.'):
                 files.append(util.expandpath(path))
-        return ignore.ignore(self._root, files, self._ui.warn)
+        return files
+
+    @rootcache('.hgignore')
+    def _ignore(self):
+        return ignore.ignore(self._root, self._ignorefiles(), self._ui.warn,
+                             self._opener)
+
+    def _ignoreidentity(self):
+        '''hash of the names and contents of the ignore files'''
+        return ignore.identity(self._ignorefiles(), self._opener)
 
     @propertycache
     def _slash(self):
@@ -264,6 +294,11 @@ class dirstate(object):
         except IOError, err:
             if err.errno != errno.ENOENT:
                 raise
+            st = ''
+        if self._monitor is not None:
+            self._identity = util.sha1(st).hexdigest()
+        if self._tree:
+            self._readtree(st)
             return
         if not st:
             return
@@ -288,6 +323,56 @@ class dirstate(object):
         if not self._dirtypl:
             self._pl = p
 
+    def _readtree(self, docket):
+        self._dirmtimes = {}
+        self._changeddirs = set()
+        self._treeuid = None
+        self._treesize = 0
+        self._treeignore = ''
+        self._treedata = ''
+        self._treeoffsets = {}
+        self._treelengths = {}
+        if not docket:
+            return
+        pl, uid, size, ignorehash = dirstatetree.parsedocket(docket)
+        try:
+            fp = self._opener(dirstatetree.datafile(uid))
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            newdocket = self._opener.read("dirstate")
+            if newdocket == docket:
+                raise util.Abort(_('working directory state appears '
+                                   'damaged!'))
+            # replaced by a concurrent write
+            return self._readtree(newdocket)
+        try:
+            data = fp.read(size)
+        finally:
+            fp.close()
+        if len(data) != size:
+            raise util.Abort(_('working directory state appears damaged!'))
+
+        # see _read
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            mtimes, counts, offsets, lengths = dirstatetree.parse(
+                self._map, self._copymap, data)
+        finally:
+            if gcenabled:
+                gc.enable()
+        self._dirs = dirstatetree.dirs(counts)
+        self._dirmtimes = mtimes
+        self._treeuid = uid
+        self._treesize = size
+        self._treeignore = ignorehash
+        self._treedata = data
+        self._treeoffsets = offsets
+        self._treelengths = lengths
+        if not self._dirtypl:
+            self._pl = pl
+
     def invalidate(self):
         for a in ("_map", "_copymap", "_foldmap", "_branch", "_pl", "_dirs",
                 "_ignore"):
@@ -295,12 +380,29 @@ class dirstate(object):
                 delattr(self, a)
         self._lastnormaltime = 0
         self._dirty = False
+        self._mtimesdirty = False
+        if self._monitor is not None:
+            self._monitortouched = set()
+            self._monitorstate = None
+
+    def _touch(self, f):
+        '''record that the entry of f changed in memory'''
+        if self._monitortouched is not None:
+            self._monitortouched.add(f)
+        if self._tree:
+            self._map # the tree is read with the map
+            if self._changeddirs is not None:
+                d = f[:max(f.rfind('/'), 0)]
+                self._changeddirs.add(d)
+                self._dirmtimes.pop(d, None)
+                self._treeoffsets.pop(d, None)
 
     def copy(self, source, dest):
         """Mark dest as a copy of source. Unmark dest if source is None."""
         if source == dest:
             return
         self._dirty = True
+        self._touch(dest)
         if source is not None:
             self._copymap[dest] = source
         elif dest in self._copymap:
@@ -332,6 +434,7 @@ class dirstate(object):
         if oldstate in "?r" and "_dirs" in self.__dict__:
             self._dirs.addpath(f)
         self._dirty = True
+        self._touch(f)
         self._map[f] = (state, mode, size, mtime)
 
     def normal(self, f):
@@ -388,6 +491,7 @@ class dirstate(object):
     def remove(self, f):
         '''Mark a file removed.'''
         self._dirty = True
+        self._touch(f)
         self._droppath(f)
         size = 0
         if self._pl[1] != nullid and f in self._map:
@@ -415,6 +519,7 @@ class dirstate(object):
         '''Drop a file from the dirstate'''
         if f in self._map:
             self._dirty = True
+            self._touch(f)
             self._droppath(f)
             del self._map[f]
 
@@ -480,6 +585,13 @@ class dirstate(object):
         self._pl = [nullid, nullid]
         self._lastnormaltime = 0
         self._dirty = True
+        # the next status walks the whole working directory
+        self._monitortouched = None
+        self._monitorstate = None
+        if self._tree:
+            self._changeddirs = None
+            self._dirmtimes = {}
+            self._treeoffsets = {}
 
     def rebuild(self, parent, allfiles, changedfiles=None):
         changedfiles = changedfiles or allfiles
@@ -497,7 +609,7 @@ class dirstate(object):
         self._dirty = True
 
     def write(self):
-        if not self._dirty:
+        if not self._dirty and not self._mtimesdirty:
             return
         st = self._opener("dirstate", "w", atomictemp=True)
 
@@ -505,22 +617,153 @@ class dirstate(object):
             st.write(s)
             st.close()
             self._lastnormaltime = 0
-            self._dirty = self._dirtypl = False
+            self._dirty = self._dirtypl = self._mtimesdirty = False
 
         # use the modification time of the newly created temporary file as the
         # filesystem's notion of 'now'
         now = util.fstat(st).st_mtime
-        finish(parsers.pack_dirstate(self._map, self._copymap, self._pl, now))
+        if self._tree:
+            s = self._writetree(now)
+        else:
+            s = parsers.pack_dirstate(self._map, self._copymap, self._pl, now)
+        finish(s)
+        if self._tree and self._changeddirs is None:
+            self._changeddirs = set()
+            dirstatetree.removeunused(self._opener, self._treeuid)
+        if self._monitor is not None:
+            self._savemonitor(util.sha1(s).hexdigest())
+
+    def _writetree(self, now):
+        '''write the blocks of the changed directories to the data file
+        and return the new docket
+
+        The blocks are appended to the data file, unless the replaced
+        ones would then make more than half of it.'''
+        dmap = self._map
+        copymap = self._copymap
+        mtimes = self._dirmtimes
+        lengths = self._treelengths
+        changed = self._changeddirs
+        if changed is not None and self._treeuid is not None:
+            # the child counts of the parents may have changed too
+            for d in list(changed):
+                changed.update(scmutil.finddirs(d))
+            blocks = dict((d, {}) for d in changed)
+        else:
+            changed = None
+            blocks = {}
+        counts = {}
+        for d in self._dirs:
+            d = d[:max(d.rfind('/'), 0)]
+            counts[d] = counts.get(d, 0) + 1
+        for f, e in dmap.iteritems():
+            d = f[:max(f.rfind('/'), 0)]
+            if e[0] != 'r':
+                counts[d] = counts.get(d, 0) + 1
+            if changed is None:
+                blocks.setdefault(d, {})[f] = e
+            elif d in blocks:
+                blocks[d][f] = e
+        if changed is None:
+            for d in counts:
+                blocks.setdefault(d, {})
+            for d in mtimes:
+                blocks.setdefault(d, {})
+
+        data = []
+        newlengths = {}
+        for d, entries in sorted(blocks.iteritems()):
+            block = dirstatetree.packblock(d, entries, copymap, mtimes.get(d),
+                                           counts.get(d, 0), now)
+            # entries modified at now were unset
+            dmap.update(entries)
+            data.append(block)
+            newlengths[d] = len(block)
+        data = ''.join(data)
+
+        if changed is not None:
+            size = self._treesize + len(data)
+            garbage = size - sum(lengths.itervalues())
+            garbage += sum(lengths.get(d, 0) for d in newlengths)
+            garbage -= len(data)
+            if garbage * 2 <= size:
+                fp = self._opener(dirstatetree.datafile(self._treeuid), 'r+b')
+                try:
+                    # drop what an interrupted write left
+                    fp.seek(self._treesize)
+                    fp.write(data)
+                    fp.truncate()
+                finally:
+                    fp.close()
+                lengths.update(newlengths)
+                self._treesize = size
+                self._changeddirs = set()
+                return dirstatetree.packdocket(self._pl, self._treeuid, size,
+                                               self._treeignore)
+            # too much garbage
+            self._changeddirs = None
+            return self._writetree(now)
+
+        uid = dirstatetree.newuid()
+        self._changeddirs = None
+        self._opener.write(dirstatetree.datafile(uid), data)
+        self._treeuid = uid
+        self._treesize = len(data)
+        self._treelengths = newlengths
+        self._treedata = data
+        self._treeoffsets = {}
+        pos = 0
+        for d, entries in sorted(blocks.iteritems()):
+            pos += newlengths[d]
+            size = newlengths[d] - dirstatetree.headerlength(d)
+            self._treeoffsets[d] = pos - size, size
+        return dirstatetree.packdocket(self._pl, uid, len(data),
+                                       self._treeignore)
+
+    def _savemonitor(self, identity):
+        '''save the state of the filesystem monitor for the dirstate
+        contents identified by identity
+
+        The state recorded by the last walk in this process, or else the
+        one saved for the dirstate that was read, is updated with the
+        paths changed in memory since.'''
+        state = self._monitorstate
+        if state is None:
+            state = fsmonitor.readstate(self._opener)
+        touched = self._monitortouched
+        if touched is None or state is None or state[1] != self._identity:
+            fsmonitor.removestate(self._opener)
+        else:
+            fsmonitor.writestate(self._opener, state[0], identity, state[2],
+                                 state[3] | touched)
+        self._identity = identity
+        self._monitortouched = set()
+        self._monitorstate = None
 
     def _dirignore(self, f):
         if f == '.':
             return False
-        if self._ignore(f):
+        ignore = self._ignore
+        if ignore(f):
             return True
+        if self._dirignored[0] is not ignore:
+            self._dirignored = (ignore, {})
+        known = self._dirignored[1]
+        # a directory is ignored if it or one of its parents matches,
+        # which is remembered for all the directories looked at
+        seen = []
+        ignored = False
         for p in scmutil.finddirs(f):
-            if self._ignore(p):
-                return True
-        return False
+            if p in known:
+                ignored = known[p]
+                break
+            seen.append(p)
+            if ignore(p):
+                ignored = True
+                break
+        for p in seen:
+            known[p] = ignored
+        return ignored
 
     def walk(self, match, subrepos, unknown, ignored):
         '''
@@ -530,6 +773,11 @@ class dirstate(object):
         Return a dict mapping filename to stat-like object (either
         mercurial.osutil.stat instance or return value of os.stat()).
         '''
+        return dict(self.iterwalk(match, subrepos, unknown, ignored))
+
+    def iterwalk(self, match, subrepos, unknown, ignored):
+        '''like walk(), but yield the (filename, stat-like object) pairs
+        as soon as they are found, in no particular order'''
 
         def fwarn(f, msg):
             self._ui.warn('%s: %s\n' % (self.pathto(f), msg))
@@ -643,41 +891,112 @@ class dirstate(object):
                     else:
                         badfn(ff, inst.strerror)
 
+        for nf, st in results.items():
+            if nf != '.hg' and nf not in subrepos:
+                yield nf, st
+
         # step 2: visit subdirectories
-        while work:
-            nd = work.pop()
-            skip = None
+        def readdir(nd):
             if nd == '.':
-                nd = ''
-            else:
-                skip = '.hg'
-            try:
-                entries = listdir(join(nd), stat=True, skip=skip)
-            except OSError, inst:
-                if inst.errno in (errno.EACCES, errno.ENOENT):
-                    fwarn(nd, inst.strerror)
-                    continue
-                raise
-            for f, kind, st in entries:
-                if normalize:
-                    nf = normalize(nd and (nd + "/" + f) or f, True, True)
-                else:
-                    nf = nd and (nd + "/" + f) or f
-                if nf not in results:
-                    if kind == dirkind:
-                        if not ignore(nf):
-                            match.dir(nf)
-                            wadd(nf)
-                        if nf in dmap and (matchalways or matchfn(nf)):
-                            results[nf] = None
-                    elif kind == regkind or kind == lnkkind:
-                        if nf in dmap:
-                            if matchalways or matchfn(nf):
+                return listdir(join(''), stat=True)
+            return listdir(join(nd), stat=True, skip='.hg')
+
+        # with the tree format, directories holding only tracked or ignored
+        # entries are not listed again until their mtime changes
+        cachedirs = (self._tree and unknown and not ignored and matchalways
+                     and not normalize)
+        cacheable = False
+        if cachedirs:
+            dirs = self._dirs
+            dirmtimes = self._treemtimes()
+            offsets = self._treeoffsets
+            newmtimes = {}
+            now = None
+            subdirs = {}
+            for d in dirs:
+                pos = d.rfind('/')
+                subdirs.setdefault(d[:max(pos, 0)], []).append(d[pos + 1:])
+            listdirstat = readdir
+            def readdir(nd):
+                d = nd != '.' and nd or ''
+                mtime = int(lstat(join(d)).st_mtime)
+                if mtime == dirmtimes.get(d) and d in offsets:
+                    return mtime, True, self._treeentries(d, subdirs.get(d))
+                return mtime, False, listdirstat(nd)
+
+        pool = None
+        numthreads = self._ui.configint('worker', 'walkthreads', 0)
+        if numthreads > 1 and work:
+            # directories are listed by the threads as soon as they are
+            # found, and their entries processed here in the usual order
+            pool = worker.threadedmap(readdir, numthreads)
+            for nd in work:
+                pool.put(nd)
+            readdir = pool.get
+            def wadd(nd):
+                work.append(nd)
+                pool.put(nd)
+
+        # no try/finally, as entries are yielded
+        try:
+            while work:
+                nd = work.pop()
+                try:
+                    entries = readdir(nd)
+                except OSError, inst:
+                    if inst.errno in (errno.EACCES, errno.ENOENT):
+                        fwarn(nd == '.' and '' or nd, inst.strerror)
+                        continue
+                    raise
+                if nd == '.':
+                    nd = ''
+                if cachedirs:
+                    mtime, cached, entries = entries
+                    cacheable = not cached
+                for f, kind, st in entries:
+                    if normalize:
+                        nf = normalize(nd and (nd + "/" + f) or f, True, True)
+                    else:
+                        nf = nd and (nd + "/" + f) or f
+                    if nf not in results:
+                        if kind == dirkind:
+                            if not ignore(nf):
+                                match.dir(nf)
+                                wadd(nf)
+                                if cacheable and nf not in dirs:
+                                    cacheable = False
+                            if nf in dmap and (matchalways or matchfn(nf)):
+                                results[nf] = None
+                                yield nf, None
+                        elif kind == regkind or kind == lnkkind:
+                            if nf in dmap:
+                                if matchalways or matchfn(nf):
+                                    results[nf] = st
+                                    yield nf, st
+                            elif ((matchalways or matchfn(nf))
+                                  and not ignore(nf)):
                                 results[nf] = st
-                        elif (matchalways or matchfn(nf)) and not ignore(nf):
-                            results[nf] = st
-                    elif nf in dmap and (matchalways or matchfn(nf)):
-                        results[nf] = None
+                                yield nf, st
+                                cacheable = False
+                        elif nf in dmap and (matchalways or matchfn(nf)):
+                            results[nf] = None
+                            yield nf, None
+                if cachedirs and not cached:
+                    if cacheable and now is None:
+                        now = self._fsnow()
+                    if cacheable and mtime < now:
+                        newmtimes[nd] = mtime
+                    elif nd in dirmtimes:
+                        newmtimes[nd] = None
+        except: # re-raises, also when the walk is not finished
+            if pool:
+                pool.close()
+            raise
+        if pool:
+            pool.close()
+
+        if cachedirs:
+            self._setdirmtimes(newmtimes)
 
         for s in subrepos:
             del results[s]
@@ -702,19 +1021,203 @@ class dirstate(object):
                     # under a symlink directory.
                     if audit_path.check(nf):
                         try:
-                            results[nf] = lstat(join(nf))
+                            st = lstat(join(nf))
                         except OSError:
                             # file doesn't exist
-                            results[nf] = None
+                            st = None
                     else:
                         # It's either missing or under a symlink directory
-                        results[nf] = None
+                        st = None
+                    results[nf] = st
+                    yield nf, st
             else:
                 # We may not have walked the full directory tree above,
                 # so stat everything we missed.
                 nf = iter(visit).next
                 for st in util.statfiles([join(i) for i in visit]):
-                    results[nf()] = st
+                    f = nf()
+                    results[f] = st
+                    yield f, st
+
+    def _fsnow(self):
+        '''return the current time of the filesystem of the repository, as
+        the modification time of a file created in .hg, or 0 if none can
+        be created
+
+        Directories modified in that second may still change unnoticed.
+        The clock of a network filesystem may differ from ours.'''
+        try:
+            fd, name = tempfile.mkstemp(prefix='.dirstate-now-',
+                                        dir=self._opener.join(''))
+        except (IOError, OSError):
+            return 0
+        try:
+            return int(os.fstat(fd).st_mtime)
+        finally:
+            os.close(fd)
+            util.unlink(name)
+
+    def _treemtimes(self):
+        '''return the cached mtimes of the directories, dropping them if
+        the ignore rules changed since they were computed'''
+        ignoreidentity = self._ignoreidentity()
+        if ignoreidentity != self._treeignore:
+            if self._changeddirs is not None:
+                self._changeddirs.update(self._dirmtimes)
+            self._dirmtimes.clear()
+            self._treeignore = ignoreidentity
+            self._mtimesdirty = True
+        return self._dirmtimes
+
+    def _setdirmtimes(self, newmtimes):
+        dirmtimes = self._dirmtimes
+        for d, mtime in newmtimes.iteritems():
+            if dirmtimes.get(d) == mtime:
+                continue
+            if mtime is None:
+                del dirmtimes[d]
+            else:
+                dirmtimes[d] = mtime
+            if self._changeddirs is not None:
+                self._changeddirs.add(d)
+            self._mtimesdirty = True
+
+    def _treeentries(self, d, subdirs):
+        '''return the entries of directory d like osutil.listdir, from
+        its tracked files and subdirectories'''
+        entries = []
+        getkind = stat.S_IFMT
+        join = self._join
+        lstat = os.lstat
+        start = d and len(d) + 1 or 0
+        for f in dirstatetree.parseblock(self._treedata, self._treeoffsets[d]):
+            try:
+                st = lstat(join(f))
+            except OSError:
+                continue
+            entries.append((f[start:], getkind(st.st_mode), st))
+        for name in subdirs or ():
+            entries.append((name, stat.S_IFDIR, None))
+        return entries
+
+    def _monitoredwalk(self, match, subrepos, unknown, ignored):
+        '''like walk() on the whole working directory, but leaving out
+        files the filesystem monitor knows are still clean
+
+        Only the files that did not look clean on the previous walk, the
+        ones changed in the dirstate since and the paths reported by the
+        monitor are looked at, unless a full walk is needed.'''
+        ui = self._ui
+        dmap = self._map
+        token = self._monitor.clock()
+        ignoreidentity = self._ignoreidentity()
+        changed = state = None
+        if token is not None and self._monitortouched is not None:
+            state = self._monitorstate or fsmonitor.readstate(self._opener)
+            if (state is not None and state[1] == self._identity
+                and state[2] == ignoreidentity):
+                changed = self._monitor.changes(state[0])
+        if changed is None:
+            ui.debug('fsmonitor: walking the whole working directory\n')
+            results = self.walk(match, subrepos, unknown, ignored)
+            if (token is None or not unknown
+                or self._monitortouched is None):
+                # the next walk would miss the unknown files, or the
+                # dirstate was cleared
+                return results
+        else:
+            ui.debug('fsmonitor: %d paths changed\n' % len(changed))
+            results = self._walkpaths(subrepos, changed | state[3] |
+                                      self._monitortouched)
+
+        copymap = self._copymap
+        checkexec = self._checkexec
+        notable = set()
+        for f, st in results.iteritems():
+            e = dmap.get(f)
+            if (e is None or st is None or e[0] != 'n' or f in copymap
+                or e[2] != st.st_size & _rangemask
+                or e[3] != int(st.st_mtime) & _rangemask
+                or checkexec and (e[1] ^ st.st_mode) & 0100):
+                notable.add(f)
+        self._monitorstate = token, self._identity, ignoreidentity, notable
+        if not self._dirty:
+            self._savemonitor(self._identity)
+
+        if not unknown:
+            for f in notable:
+                if f not in dmap:
+                    del results[f]
+        return results
+
+    def _walkpaths(self, subrepos, paths):
+        '''walk the given paths, and the directories among them that are
+        not in the dirstate
+
+        Return a dict like walk() with unknown files but not ignored
+        ones.'''
+        dmap = self._map
+        dirs = self._dirs
+        dirignore = self._dirignore
+        listdir = osutil.listdir
+        lstat = os.lstat
+        getkind = stat.S_IFMT
+        dirkind = stat.S_IFDIR
+        regkind = stat.S_IFREG
+        lnkkind = stat.S_IFLNK
+        join = self._join
+        audit_path = scmutil.pathauditor(self._root)
+        skip = set(subrepos)
+        skip.add('.hg')
+
+        results = {}
+        seen = set()
+        work = list(paths)
+        while work:
+            nf = work.pop()
+            if nf in seen:
+                continue
+            seen.add(nf)
+            if nf in skip or [d for d in scmutil.finddirs(nf) if d in skip]:
+                continue
+            try:
+                st = lstat(join(nf))
+                kind = getkind(st.st_mode)
+            except OSError:
+                st = kind = None
+
+            if kind == dirkind:
+                if nf in dmap:
+                    results[nf] = None
+                if dirignore(nf or '.'):
+                    continue
+                try:
+                    entries = listdir(join(nf), skip='.hg')
+                except OSError, inst:
+                    if inst.errno in (errno.EACCES, errno.ENOENT):
+                        self._ui.warn('%s: %s\n' % (self.pathto(nf),
+                                                    inst.strerror))
+                        continue
+                    raise
+                # changed files of known directories are reported
+                # on their own
+                for f, k in entries:
+                    f = nf and (nf + '/' + f) or f
+                    if f not in dmap and f not in dirs:
+                        work.append(f)
+            elif nf in dmap:
+                if ((kind == regkind or kind == lnkkind)
+                    and audit_path.check(nf)):
+                    results[nf] = st
+                else:
+                    results[nf] = None
+            elif kind == regkind or kind == lnkkind:
+                if not dirignore(nf):
+                    results[nf] = st
+            if kind != dirkind and nf in dirs:
+                # the files of a directory that went away
+                prefix = nf + '/'
+                work.extend(f for f in dmap if f.startswith(prefix))
         return results
 
     def status(self, match, subrepos, ignored, clean, unknown):
@@ -744,19 +1247,21 @@ class dirstate(object):
             files that have definitely not been modified since the
             dirstate was written
         '''
+        lists = ([], [], [], [], [], [], [], [])
+        adds = dict(zip(_statenames, [l.append for l in lists]))
+        for state, fn in self.iterstatus(match, subrepos, ignored, clean,
+                                         unknown):
+            adds[state](fn)
+        return lists
+
+    def iterstatus(self, match, subrepos, ignored, clean, unknown):
+        '''like status(), but yield (state, filename) pairs as soon as
+        the state of each file is known, state being one of 'unsure',
+        'modified', 'added', 'removed', 'deleted', 'unknown',
+        'ignored' and 'clean'. Files come in no particular order.'''
         listignored, listclean, listunknown = ignored, clean, unknown
-        lookup, modified, added, unknown, ignored = [], [], [], [], []
-        removed, deleted, clean = [], [], []
 
         dmap = self._map
-        ladd = lookup.append            # aka "unsure"
-        madd = modified.append
-        aadd = added.append
-        uadd = unknown.append
-        iadd = ignored.append
-        radd = removed.append
-        dadd = deleted.append
-        cadd = clean.append
         mexact = match.exact
         dirignore = self._dirignore
         checkexec = self._checkexec
@@ -766,20 +1271,26 @@ class dirstate(object):
 
         lnkkind = stat.S_IFLNK
 
-        for fn, st in self.walk(match, subrepos, listunknown,
-                                listignored).iteritems():
+        if (self._monitor is not None and not listclean and
+            not listignored and match.always() and not self._checkcase):
+            entries = self._monitoredwalk(match, subrepos, listunknown,
+                                          listignored).iteritems()
+        else:
+            entries = self.iterwalk(match, subrepos, listunknown, listignored)
+
+        for fn, st in entries:
             if fn not in dmap:
                 if (listignored or mexact(fn)) and dirignore(fn):
                     if listignored:
-                        iadd(fn)
+                        yield 'ignored', fn
                 elif listunknown:
-                    uadd(fn)
+                    yield 'unknown', fn
                 continue
 
             state, mode, size, time = dmap[fn]
 
             if not st and state in "nma":
-                dadd(fn)
+                yield 'deleted', fn
             elif state == 'n':
                 # The "mode & lnkkind != lnkkind or self._checklink"
                 # lines are an expansion of "islink => checklink"
@@ -792,24 +1303,21 @@ class dirstate(object):
                     and (mode & lnkkind != lnkkind or checklink)
                     or size == -2 # other parent
                     or fn in copymap):
-                    madd(fn)
+                    yield 'modified', fn
                 elif ((time != mtime and time != mtime & _rangemask)
                       and (mode & lnkkind != lnkkind or checklink)):
-                    ladd(fn)
+                    yield 'unsure', fn
                 elif mtime == lastnormaltime:
                     # fn may have been changed in the same timeslot without
                     # changing its size. This can happen if we quickly do
                     # multiple commits in a single transaction.
                     # Force lookup, so we don't miss such a racy file change.
-                    ladd(fn)
+                    yield 'unsure', fn
                 elif listclean:
-                    cadd(fn)
+                    yield 'clean', fn
             elif state == 'm':
-                madd(fn)
+                yield 'modified', fn
             elif state == 'a':
-                aadd(fn)
+                yield 'added', fn
             elif state == 'r':
-                radd(fn)
-
-        return (lookup, modified, added, removed, deleted, unknown, ignored,
-                clean)
+                yield 'removed', fn
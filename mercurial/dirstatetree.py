@@ -0,0 +1,158 @@
+# dirstatetree.py - dirstate format grouping entries by directory
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""dirstate format grouping entries by directory
+
+With the dirstatetree requirement, .hg/dirstate is a small docket
+holding the working directory parents, the name and used size of a data
+file, and the hash of the ignore rules the cached directory mtimes were
+computed with. The data file is a sequence of directory blocks::
+
+  name length, data length, cached mtime, child count  (>IIiI)
+  directory name
+  entries of the files of the directory, as in the flat format
+
+A block replaces the earlier ones of the same directory, so writing the
+dirstate only appends the blocks of the directories that changed. The
+data file is rewritten under a new name once most of it is made of
+replaced blocks. The child count of a directory is its number of files
+and subdirectories that are tracked, which gives dirstate.dirs() without
+going through all the entries. The cached mtime is set when status found
+that the entries of a directory are all tracked or ignored: as long as
+it does not change, the directory does not need to be listed again.
+"""
+
+from node import nullid
+from i18n import _
+import scmutil, util, parsers
+import errno, os, struct
+
+_docketformat = '>40s16sQ40s'
+_docketsize = struct.calcsize(_docketformat)
+_blockformat = '>IIiI'
+_blocksize = struct.calcsize(_blockformat)
+_nullheader = nullid + nullid
+
+def datafile(uid):
+    return 'dirstate.%s' % uid
+
+def newuid():
+    return os.urandom(8).encode('hex')
+
+def parsedocket(data):
+    '''return the parents, data file uid, used data size and ignore hash
+    of a docket'''
+    if len(data) != _docketsize:
+        raise util.Abort(_('working directory state appears damaged!'))
+    pl, uid, size, ignorehash = struct.unpack(_docketformat, data)
+    return (pl[:20], pl[20:]), uid, size, ignorehash
+
+def packdocket(pl, uid, size, ignorehash):
+    return struct.pack(_docketformat, ''.join(pl), uid, size, ignorehash)
+
+def parse(dmap, copymap, data):
+    '''fill dmap and copymap with the entries of the data file
+
+    Returns the dicts of the cached directory mtimes, of the non-zero
+    child counts, of the (offset, length) of the entries of each
+    directory in data and of the length of their blocks.'''
+    unpack = struct.unpack
+    blocks = {}
+    pos, end = 0, len(data)
+    while pos < end:
+        namelen, size, mtime, count = unpack(_blockformat,
+                                             data[pos:pos + _blocksize])
+        pos += _blocksize
+        name = data[pos:pos + namelen]
+        pos += namelen
+        blocks[name] = pos, size, mtime, count
+        pos += size
+    if pos != end:
+        raise util.Abort(_('working directory state appears damaged!'))
+
+    mtimes, counts, offsets, lengths = {}, {}, {}, {}
+    entries = [_nullheader]
+    for name, (pos, size, mtime, count) in blocks.iteritems():
+        entries.append(data[pos:pos + size])
+        offsets[name] = pos, size
+        lengths[name] = headerlength(name) + size
+        if mtime != -1:
+            mtimes[name] = mtime
+        if count and name:
+            counts[name] = count
+    parsers.parse_dirstate(dmap, copymap, ''.join(entries))
+    return mtimes, counts, offsets, lengths
+
+def parseblock(data, offset):
+    '''return the set of file names of the block of data at offset'''
+    pos, size = offset
+    dmap = {}
+    parsers.parse_dirstate(dmap, {}, _nullheader + data[pos:pos + size])
+    return set(dmap)
+
+def headerlength(name):
+    '''return the length of the block of directory name before its
+    entries'''
+    return _blocksize + len(name)
+
+def packblock(name, dmap, copymap, mtime, count, now):
+    '''return the block of directory name holding the entries of dmap
+
+    Entries of files modified at now are changed in dmap as with the flat
+    format.'''
+    data = parsers.pack_dirstate(dmap, copymap, (nullid, nullid), now)[40:]
+    if mtime is None:
+        mtime = -1
+    return (struct.pack(_blockformat, len(name), len(data), mtime, count)
+            + name + data)
+
+def removeunused(opener, uid):
+    '''remove the data files not used by the dirstate docket with uid or
+    by the ones saved for rollback'''
+    used = set([datafile(uid)])
+    for name in ('journal.dirstate', 'undo.dirstate'):
+        try:
+            used.add(datafile(parsedocket(opener.read(name))[1]))
+        except (IOError, util.Abort):
+            pass
+    for name in os.listdir(opener.join('')):
+        if (name.startswith('dirstate.') and len(name) == 25
+            and name not in used):
+            try:
+                util.unlink(opener.join(name))
+            except OSError, inst:
+                if inst.errno != errno.ENOENT:
+                    raise
+
+class dirs(object):
+    '''the multiset of directories of scmutil.dirs, built from the child
+    counts of the blocks instead of from the entries'''
+
+    def __init__(self, counts):
+        self._dirs = counts
+
+    def addpath(self, path):
+        dirs = self._dirs
+        for base in scmutil.finddirs(path):
+            if base in dirs:
+                dirs[base] += 1
+                return
+            dirs[base] = 1
+
+    def delpath(self, path):
+        dirs = self._dirs
+        for base in scmutil.finddirs(path):
+            if dirs[base] > 1:
+                dirs[base] -= 1
+                return
+            del dirs[base]
+
+    def __iter__(self):
+        return self._dirs.iterkeys()
+
+    def __contains__(self, d):
+        return d in self._dirs
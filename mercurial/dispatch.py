@@ -8,7 +8,7 @@
 from i18n import _
 import os, sys, atexit, signal, pdb, socket, errno, shlex, time, traceback, re
 import util, commands, hg, fancyopts, extensions, hook, error
-import cmdutil, encoding
+import cmdutil, encoding, demandimport
 import ui as uimod
 
 class request(object):
@@ -471,6 +471,21 @@ def _parse(ui, args):
 
     return (cmd, cmd and entry[0] or None, args, options, cmdoptions)
 
+def _cmdnames(ui, args):
+    """return the names the command run by args may be given as, to load
+    the deferred extensions it may come from"""
+    try:
+        args = fancyopts.fancyopts(args[:], commands.globalopts, {})
+    except fancyopts.getopt.GetoptError:
+        return []
+    if not args:
+        return ['']
+    cmds = [args[0]]
+    for name, definition in ui.configitems('alias'):
+        if name.startswith(args[0]) and definition and definition[0] != '!':
+            cmds.append(definition.split(None, 1)[0])
+    return cmds
+
 def _parseconfig(ui, config):
     """parse the --config options from the command line"""
     configs = []
@@ -637,10 +652,16 @@ def _dispatch(req):
     if shellaliasfn:
         return shellaliasfn()
 
+    # the modules imported so far are only timed with HGPROF=startup
+    if ('--profile' in args and
+        lui.config('profiling', 'type') == 'startup'):
+        demandimport.recordimports()
+
     # Configure extensions in phases: uisetup, extsetup, cmdtable, and
     # reposetup. Programs like TortoiseHg will call _dispatch several
     # times so we keep track of configured extensions in _loaded.
     extensions.loadall(lui)
+    extensions.loaddeferred(lui, _cmdnames(lui, args))
     exts = [ext for ext in extensions.extensions() if ext[0] not in _loaded]
     # Propagate any changes to lui.__class__ by extensions
     ui.__class__ = lui.__class__
@@ -731,9 +752,13 @@ def _dispatch(req):
     repo = None
     cmdpats = args[:]
     if cmd not in commands.norepo.split():
-        # use the repo from the request only if we don't have -R
+        # use the repo from the request only if we don't have -R, or if
+        # -R and --cwd lead to it
         if not rpath and not cwd:
             repo = req.repo
+        elif (req.repo and path and
+              os.path.realpath(path) == req.repo.root):
+            repo = req.repo
 
         if repo:
             # set the descriptors of the repo ui to those of ui
@@ -834,6 +859,28 @@ def statprofile(ui, func, fp):
         statprof.stop()
         statprof.display(fp)
 
+def startupprofile(ui, func, fp):
+    limit = ui.configint('profiling', 'limit', default=30)
+    try:
+        return func()
+    finally:
+        imports = demandimport.importtimes().items()
+        imports.sort(key=lambda x: (-x[1], x[0]))
+        fp.write(_('imported %d modules in %.3f secs:\n')
+                 % (len(imports), sum([t for n, t in imports])))
+        for name, t in imports[:limit]:
+            fp.write('  %.3f %s\n' % (t, name))
+
+        exts = extensions.setuptimes().items()
+        exts.sort(key=lambda x: (-sum(x[1].values()), x[0]))
+        fp.write(_('set up %d extensions in %.3f secs:\n')
+                 % (len(exts), sum([sum(t.values()) for n, t in exts])))
+        for name, times in exts[:limit]:
+            steps = ', '.join(['%s %.3f' % (step, times[step])
+                               for step in ('import', 'uisetup', 'extsetup')
+                               if step in times])
+            fp.write('  %.3f %s (%s)\n' % (sum(times.values()), name, steps))
+
 def _runcommand(ui, options, cmd, cmdfunc):
     def checkargs():
         try:
@@ -845,7 +892,7 @@ def _runcommand(ui, options, cmd, cmdfunc):
         profiler = os.getenv('HGPROF')
         if profiler is None:
             profiler = ui.config('profiling', 'type', default='ls')
-        if profiler not in ('ls', 'stat'):
+        if profiler not in ('ls', 'stat', 'startup'):
             ui.warn(_("unrecognized profiler '%s' - ignored\n") % profiler)
             profiler = 'ls'
 
@@ -860,6 +907,8 @@ def _runcommand(ui, options, cmd, cmdfunc):
         try:
             if profiler == 'ls':
                 return lsprofile(ui, checkargs, fp)
+            elif profiler == 'startup':
+                return startupprofile(ui, checkargs, fp)
             else:
                 return statprofile(ui, checkargs, fp)
         finally:
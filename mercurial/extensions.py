@@ -5,7 +5,7 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2 or any later version.
 
-import imp, os
+import imp, os, time
 import util, cmdutil, error
 from i18n import _, gettext
 
@@ -13,6 +13,36 @@ _extensions = {}
 _order = []
 _ignore = ['hbisect', 'bookmarks', 'parentrevspec', 'interhg']
 
+# The commands of the bundled extensions that do nothing else than adding
+# commands, or hooks imported by name. They are only loaded once one of
+# their commands may be run. Extensions looked up by name by others at
+# setup time (fetch and purge are wrapped by largefiles) are not listed.
+_lazycommands = {
+    'acl': [],
+    'bugzilla': [],
+    'children': ['children'],
+    'churn': ['churn'],
+    'gpg': ['sigcheck', 'sign', 'sigs'],
+    'graphlog': ['glog'],
+    'hgcia': [],
+    'hgk': ['view', 'debug-cat-file', 'debug-config', 'debug-diff-tree',
+            'debug-merge-base', 'debug-rev-list', 'debug-rev-parse'],
+    'histedit': ['histedit'],
+    'notify': [],
+    'patchbomb': ['email'],
+    'relink': ['relink'],
+    'share': ['share', 'unshare'],
+    }
+# the extensions wrapping the commands of every other loaded extension,
+# nothing is deferred when one of them is enabled
+_wrapall = ['mq']
+# the commands showing or checking every command or extension
+_allcommands = ['debugcommands', 'debugcomplete', 'help', 'version']
+# the lazy extensions not loaded yet, with their configured names
+_deferred = {}
+# the time spent importing and setting up each extension
+_setuptimes = {}
+
 def extensions():
     for name in _order:
         module = _extensions[name]
@@ -49,11 +79,26 @@ def loadpath(path, module_name):
                 exc.filename = path # python does not fill this
             raise
 
-def load(ui, name, path):
+def _shortname(name):
     if name.startswith('hgext.') or name.startswith('hgext/'):
-        shortname = name[6:]
-    else:
-        shortname = name
+        return name[6:]
+    return name
+
+def _timed(name, step, func, *args):
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        times = _setuptimes.setdefault(name, {})
+        times[step] = times.get(step, 0) + time.time() - start
+
+def setuptimes():
+    '''return the time spent in each step (import, uisetup, extsetup) of
+    the setup of each extension, by extension name'''
+    return dict((name, dict(times)) for name, times in _setuptimes.items())
+
+def load(ui, name, path):
+    shortname = _shortname(name)
     if shortname in _ignore:
         return None
     if shortname in _extensions:
@@ -81,15 +126,11 @@ def load(ui, name, path):
     _order.append(shortname)
     return mod
 
-def loadall(ui):
-    result = ui.configitems("extensions")
+def _loadsetup(ui, names):
     newindex = len(_order)
-    for (name, path) in result:
-        if path:
-            if path[0] == '!':
-                continue
+    for (name, path) in names:
         try:
-            load(ui, name, path)
+            _timed(_shortname(name), 'import', load, ui, name, path)
         except KeyboardInterrupt:
             raise
         except Exception, inst:
@@ -105,18 +146,60 @@ def loadall(ui):
     for name in _order[newindex:]:
         uisetup = getattr(_extensions[name], 'uisetup', None)
         if uisetup:
-            uisetup(ui)
+            _timed(name, 'uisetup', uisetup, ui)
 
     for name in _order[newindex:]:
         extsetup = getattr(_extensions[name], 'extsetup', None)
         if extsetup:
             try:
-                extsetup(ui)
+                _timed(name, 'extsetup', extsetup, ui)
             except TypeError:
                 if extsetup.func_code.co_argcount != 0:
                     raise
                 extsetup() # old extsetup with no ui argument
 
+def loadall(ui):
+    '''load and set up the enabled extensions
+
+    The bundled extensions that only add commands are deferred until
+    loaddeferred() is called for one of their commands, unless an
+    extension wrapping the commands of all others is enabled.'''
+    names = []
+    enabled = [_shortname(n) for n, p in ui.configitems("extensions")
+               if not p or p[0] != '!']
+    defer = not [n for n in _wrapall if n in enabled]
+    for (name, path) in ui.configitems("extensions"):
+        if path:
+            if path[0] == '!':
+                continue
+        else:
+            shortname = _shortname(name)
+            if (defer and shortname in _lazycommands
+                and shortname not in _extensions):
+                _deferred[shortname] = name
+                continue
+        names.append((name, path))
+    return _loadsetup(ui, names)
+
+def loaddeferred(ui, cmds):
+    '''load the deferred extensions providing a command whose name starts
+    with one of cmds, or all of them for a command that may show or check
+    every other'''
+    enabled = [n for n, p in ui.configitems("extensions")
+               if not p or p[0] != '!']
+    needed = []
+    for shortname, name in sorted(_deferred.items()):
+        if name not in enabled or shortname in _extensions:
+            continue
+        names = _lazycommands[shortname] + _allcommands
+        for cmd in cmds:
+            if util.any(n.startswith(cmd) for n in names):
+                needed.append((name, ''))
+                break
+    for name, path in needed:
+        del _deferred[_shortname(name)]
+    return _loadsetup(ui, needed)
+
 def wrapcommand(table, command, wrapper):
     '''Wrap the command named `command' in table
 
@@ -0,0 +1,157 @@
+# fsmonitor.py - filesystem monitors restricting working directory walks
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""filesystem monitors telling which paths changed in the working directory
+
+A monitor backend, selected with fsmonitor.backend, hands out clock
+tokens identifying points in time and reports the paths changed since
+one of them. The dirstate keeps the token of its last full status in
+.hg/fsmonitor.state, along with hashes of the dirstate contents and of
+the ignore rules it is valid for and the files that did not look clean
+then, so that the next status only has to look at these files and at
+the changed paths.
+
+The eventlog backend replays the paths recorded in a file by another
+program, one per line. Other backends are registered by extensions in
+the backends dictionary.
+"""
+
+from i18n import _
+import util
+import errno
+
+_statefile = 'fsmonitor.state'
+
+class backend(object):
+    '''base class of the filesystem monitors
+
+    Paths are relative to the root of the working directory and use
+    slashes, the root itself being the empty string. Reported directories
+    are listed, not walked, unless they are not known to the dirstate.'''
+
+    def __init__(self, ui, root, opener):
+        self._ui = ui
+        self._root = root
+        self._opener = opener
+
+    def clock(self):
+        '''return a token for the current point in time, or None if the
+        monitor is not available'''
+        raise NotImplementedError
+
+    def changes(self, token):
+        '''return the set of paths changed since clock() returned token,
+        or None if they are not known'''
+        raise NotImplementedError
+
+class eventlog(backend):
+    '''paths changed according to a log file, .hg/fsmonitor.log by default
+
+    The first line of the log identifies the recording session and the
+    next ones are the changed paths. Tokens are made of the session and
+    a position in the log, so a new session invalidates the older ones.
+    '''
+
+    def __init__(self, ui, root, opener):
+        backend.__init__(self, ui, root, opener)
+        self._path = ui.config('fsmonitor', 'eventlog')
+        if self._path is None:
+            self._path = opener.join('fsmonitor.log')
+        else:
+            self._path = util.expandpath(self._path)
+
+    def _read(self, offset=None):
+        '''return the session of the log and its complete lines after
+        offset, the first one by default, or (None, None) if it is not
+        readable'''
+        try:
+            fp = open(self._path, 'rb')
+        except IOError, inst:
+            if inst.errno != errno.ENOENT:
+                raise
+            return None, None
+        try:
+            session = fp.readline()
+            if not session.endswith('\n'):
+                return None, None
+            if offset is not None:
+                if offset < fp.tell():
+                    # the log was truncated
+                    return session[:-1], None
+                fp.seek(offset)
+            data = fp.read()
+        finally:
+            fp.close()
+        # the last line may still be being written
+        return session[:-1], data[:data.rfind('\n') + 1]
+
+    def clock(self):
+        session, data = self._read()
+        if data is None:
+            return None
+        return '%s:%d' % (session, len(session) + 1 + len(data))
+
+    def changes(self, token):
+        try:
+            session, offset = token.rsplit(':', 1)
+            offset = int(offset)
+        except ValueError:
+            return None
+        current, data = self._read(offset)
+        if current != session or data is None:
+            return None
+        changed = set()
+        for path in data.splitlines():
+            if path == '.':
+                path = ''
+            changed.add(path.rstrip('/'))
+        return changed
+
+backends = {
+    'eventlog': eventlog,
+    }
+
+def getbackend(ui, root, opener):
+    '''return the filesystem monitor of the working directory at root, or
+    None if there is none'''
+    name = ui.config('fsmonitor', 'backend')
+    if not name:
+        return None
+    if name not in backends:
+        ui.warn(_('unknown filesystem monitor: %s\n') % name)
+        return None
+    return backends[name](ui, root, opener)
+
+def readstate(opener):
+    '''return the (token, dirstate identity, ignore identity, notable
+    files) recorded in the state file, or None if there is no state'''
+    try:
+        lines = opener.read(_statefile).split('\n')
+    except IOError, inst:
+        if inst.errno != errno.ENOENT:
+            raise
+        return None
+    if len(lines) < 4 or lines[-1]:
+        return None
+    return lines[0], lines[1], lines[2], set(lines[3:-1])
+
+def writestate(opener, token, identity, ignoreidentity, notable):
+    try:
+        fp = opener(_statefile, 'w', atomictemp=True)
+        lines = [token, identity, ignoreidentity] + sorted(notable)
+        fp.write(''.join('%s\n' % l for l in lines))
+        fp.close()
+    except (IOError, OSError, util.Abort):
+        # an older state stays valid, if less useful
+        pass
+
+def removestate(opener):
+    try:
+        util.unlink(opener.join(_statefile))
+    except OSError, inst:
+        if inst.errno != errno.ENOENT:
+            raise
@@ -19,8 +19,10 @@ import webcommands, protocol, webutil, re
 perms = {
     'changegroup': 'pull',
     'changegroupsubset': 'pull',
+    'clonebundles': 'pull',
     'getbundle': 'pull',
     'stream_out': 'pull',
+    'stream_out2': 'pull',
     'listkeys': 'pull',
     'unbundle': 'push',
     'pushkey': 'push',
@@ -5,8 +5,8 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2 or any later version.
 
-import cgi, cStringIO, zlib, urllib
-from mercurial import util, wireproto
+import cgi, cStringIO, urllib
+from mercurial import changegroup, util, wireproto
 from common import HTTP_OK
 
 HGTYPE = 'application/mercurial-0.1'
@@ -55,13 +55,13 @@ class webproto(object):
         self.ui.ferr, self.ui.fout = self.oldio
         return val
     def groupchunks(self, cg):
-        z = zlib.compressobj()
-        while True:
-            chunk = cg.read(4096)
-            if not chunk:
-                break
-            yield z.compress(chunk)
-        yield z.flush()
+        # clients not asking for an engine expect zlib
+        wiretype = self.req.env.get('HTTP_X_HGCOMPRESSION', 'zlib')
+        engine = changegroup.wireengine(self.ui, wiretype)
+        if engine is None:
+            engine = changegroup.compengines['gzip']
+        level = self.ui.configint('server', 'compressionlevel')
+        return engine.compressstream(util.filechunkiter(cg, 4096), level)
     def _client(self):
         return 'remote:%s:%s:%s' % (
             self.req.env.get('wsgi.url_scheme') or 'http',
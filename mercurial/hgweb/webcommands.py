@@ -14,7 +14,7 @@ from common import paritygen, staticfile, get_contact, ErrorResponse
 from common import HTTP_OK, HTTP_FORBIDDEN, HTTP_NOT_FOUND
 from mercurial import graphmod, patch
 from mercurial import help as helpmod
-from mercurial import scmutil
+from mercurial import scmutil, changesetcache
 from mercurial.i18n import _
 
 # __all__ is populated with the allowed commands. Be sure to add to it if
@@ -132,17 +132,31 @@ def _search(web, req, tmpl):
         def revgen():
             cl = web.repo.changelog
             for i in xrange(len(web.repo) - 1, 0, -100):
-                l = []
-                for j in cl.revs(max(0, i - 100), i + 1):
-                    ctx = web.repo[j]
-                    l.append(ctx)
+                l = list(cl.revs(max(0, i - 100), i + 1))
                 l.reverse()
                 for e in l:
                     yield e
 
-        for ctx in revgen():
-            miss = 0
+        # words found in the user of a revision don't need its changeset
+        # to be read, if the cache does not have to be built for that:
+        # the search usually stops long before reading the whole changelog
+        users = []
+        userwords = {}
+        if changesetcache.available(web.repo):
+            cache = web.repo.changesetcache()
+            users = cache.user
             for q in qw:
+                for i in cache.matchingstrings(lambda u: q in lower(u)):
+                    userwords.setdefault(i, set()).add(q)
+
+        for rev in revgen():
+            words = qw
+            if rev < len(users):
+                words = [q for q in qw
+                         if q not in userwords.get(users[rev], ())]
+            ctx = web.repo[rev]
+            miss = 0
+            for q in words:
                 if not (q in lower(ctx.user()) or
                         q in lower(ctx.description()) or
                         q in lower(" ".join(ctx.files()))):
@@ -9,24 +9,21 @@
 from node import nullid
 from i18n import _
 import changegroup, statichttprepo, error, httpconnection, url, util, wireproto
-import os, urllib, urllib2, zlib, httplib
+import os, urllib, urllib2, httplib
 import errno, socket
 
-def zgenerator(f):
-    zd = zlib.decompressobj()
+def decompressgenerator(engine, f):
     try:
-        for chunk in util.filechunkiter(f):
-            while chunk:
-                yield zd.decompress(chunk, 2**18)
-                chunk = zd.unconsumed_tail
+        for chunk in engine.decompressstream(util.filechunkiter(f)):
+            yield chunk
     except httplib.HTTPException:
         raise IOError(None, _('connection ended unexpectedly'))
-    yield zd.flush()
 
 class httppeer(wireproto.wirepeer):
     def __init__(self, ui, path):
         self.path = path
         self.caps = None
+        self.compengine = None
         self.handler = None
         self.urlopener = None
         u = util.url(path)
@@ -55,6 +52,10 @@ class httppeer(wireproto.wirepeer):
 
     def _fetchcaps(self):
         self.caps = set(self._call('capabilities').split())
+        self.compengine = changegroup.peerwireengine(
+            self.ui, self.capable('compression'))
+        if self.compengine is not None:
+            self.ui.debug('using %s compression\n' % self.compengine.name)
 
     def _capabilities(self):
         if self.caps is None:
@@ -81,6 +82,9 @@ class httppeer(wireproto.wirepeer):
         headers = args.pop('headers', {})
         if data is not None and 'Content-Type' not in headers:
             headers['Content-Type'] = 'application/mercurial-0.1'
+        # servers compress with zlib unless told otherwise
+        if self.compengine is not None and self.compengine.wiretype != 'zlib':
+            headers['X-HgCompression'] = self.compengine.wiretype
 
 
         if size and self.ui.configbool('ui', 'usehttp2', False):
@@ -215,7 +219,8 @@ class httppeer(wireproto.wirepeer):
         raise exception
 
     def _decompress(self, stream):
-        return util.chunkbuffer(zgenerator(stream))
+        engine = self.compengine or changegroup.compengines['gzip']
+        return util.chunkbuffer(decompressgenerator(engine, stream))
 
 class httpspeer(httppeer):
     def __init__(self, ui, path):
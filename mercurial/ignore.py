@@ -7,9 +7,10 @@
 
 from i18n import _
 import util, match
-import re
+import os, re
 
 _commentre = None
+_cachefile = 'cache/ignore'
 
 def ignorepats(lines):
     '''parse lines (iterable) of .hgignore text, returning a tuple of
@@ -52,8 +53,11 @@ def ignorepats(lines):
 
     return patterns, warnings
 
-def readpats(root, files, warn):
-    '''return a dict mapping ignore-file-name to list-of-patterns'''
+def readpats(root, files, warn, contents=None):
+    '''return a dict mapping ignore-file-name to list-of-patterns
+
+    The contents of the files read are added to the contents dict, if
+    given.'''
 
     pats = {}
     for f in files:
@@ -62,8 +66,11 @@ def readpats(root, files, warn):
         try:
             pats[f] = []
             fp = open(f)
-            pats[f], warnings = ignorepats(fp)
+            data = fp.read()
             fp.close()
+            if contents is not None:
+                contents[f] = data
+            pats[f], warnings = ignorepats(data.split('\n'))
             for warning in warnings:
                 warn("%s: %s\n" % (f, warning))
         except IOError, inst:
@@ -72,7 +79,107 @@ def readpats(root, files, warn):
                      (f, inst.strerror))
     return [(f, pats[f]) for f in files if f in pats]
 
-def ignore(root, files, warn):
+def _signatures(files):
+    '''return what tells whether each of files changed'''
+    sigs = []
+    for f in files:
+        try:
+            st = os.stat(f)
+        except OSError:
+            sigs.append((f,))
+            continue
+        sigs.append((f, st.st_size, int(st.st_mtime), int(st.st_ctime),
+                     st.st_ino))
+    return sigs
+
+def _contentidentity(files, contents=None):
+    s = util.sha1()
+    for f in files:
+        s.update(f + '\0')
+        if contents is not None:
+            s.update(contents.get(f, ''))
+        else:
+            try:
+                s.update(util.readfile(f))
+            except IOError:
+                pass
+        s.update('\0')
+    return s.hexdigest()
+
+# the identity and matcher of the ignore files read by this process, by
+# ignore files, for long-lived processes like the command server
+_memo = {}
+
+def identity(files, opener=None):
+    '''return a hash of the names and contents of the ignore files
+
+    If opener is given, the hash kept in its cache/ignore file is used as
+    long as the ignore files are not modified.'''
+    sigs = _signatures(files)
+    entry = _memo.get(tuple(files))
+    if entry is not None and entry[0] == sigs:
+        return entry[1]
+    if opener is not None:
+        cached = _readcache(opener, sigs)
+        if cached is not None:
+            return cached[0]
+    return _contentidentity(files)
+
+def _sigkey(sigs):
+    return util.sha1(repr(sigs)).hexdigest()
+
+def _readcache(opener, sigs):
+    '''return the identity and regular expressions cached for the ignore
+    files with signatures sigs, or None
+
+    The regular expressions are None if they could not be cached.'''
+    try:
+        lines = opener.read(_cachefile).split('\n')
+    except IOError:
+        return None
+    if (len(lines) < 4 or lines[0] != _sigkey(sigs)
+        or lines[2] not in ('r', 'x') or lines[-1]):
+        return None
+    if lines[2] == 'x':
+        return lines[1], None
+    return lines[1], lines[3:-1]
+
+def _opencache(opener):
+    '''return the file to write the cache to and the current time of
+    its filesystem, or (None, None)'''
+    try:
+        fp = opener(_cachefile, 'w', atomictemp=True)
+    except (IOError, OSError, util.Abort):
+        return None, None
+    return fp, int(util.fstat(fp).st_mtime)
+
+def _writecache(fp, sigs, ident, regexes):
+    lines = [_sigkey(sigs), ident]
+    if regexes is None:
+        lines.append('x')
+    else:
+        lines.append('r')
+        lines.extend(regexes)
+    try:
+        fp.write(''.join('%s\n' % l for l in lines))
+        fp.close()
+    except (IOError, OSError):
+        fp.discard()
+
+def _regexes(root, pats):
+    '''return the regular expressions patterns are turned into, or None
+    if they cannot be cached'''
+    regexes = []
+    for kind, name in match._normalize(pats, 'glob', root, '', None):
+        if kind == 'set':
+            return None
+        regex = match._regex(kind, name, '(?:/|$)')
+        if '\n' in regex:
+            return None
+        regexes.append(regex)
+    return regexes
+
+def ignore(root, files, warn, opener=None):
     '''return matcher covering patterns in 'files'.
 
     the files parsed for patterns include:
@@ -90,24 +197,79 @@ def ignore(root, files, warn):
     syntax: glob   # defaults following lines to non-rooted globs
     re:pattern     # non-rooted regular expression
     glob:pattern   # non-rooted glob
-    pattern        # pattern of the current default type'''
+    pattern        # pattern of the current default type
 
-    pats = readpats(root, files, warn)
+    If opener is given, the regular expressions the patterns translate to
+    are kept in the cache/ignore file of opener and reused as long as the
+    ignore files are not modified, which saves reading and parsing them.
+    Only compiling the expressions remains, which the matchers kept by
+    this process also save.'''
+
+    sigs = _signatures(files)
+    entry = _memo.get(tuple(files))
+    if entry is not None and entry[0] == sigs and entry[2] == root:
+        return entry[3]
+
+    def remember(ident, matcher):
+        _memo[tuple(files)] = (sigs, ident, root, matcher)
+        return matcher
+
+    cached = None
+    if opener is not None:
+        cached = _readcache(opener, sigs)
+        if cached is not None and cached[1] is not None:
+            ident, regexes = cached
+            if not regexes:
+                return remember(ident, util.never)
+            try:
+                return remember(ident, match.match(
+                    root, '', [], ['re:' + r for r in regexes]))
+            except util.Abort:
+                pass
+
+    # files modified in the second they are read in, by the clock of the
+    # filesystem, may change again without their signature changing
+    fp = now = None
+    if opener is not None and cached is None:
+        fp, now = _opencache(opener)
+    stable = now is not None and not [s for s in sigs
+                                      if len(s) > 1 and s[2] >= now]
+
+    warnings = []
+    def warnfn(msg):
+        warnings.append(msg)
+        warn(msg)
+    contents = {}
+    pats = readpats(root, files, warnfn, contents)
 
     allpats = []
     for f, patlist in pats:
         allpats.extend(patlist)
     if not allpats:
-        return util.never
-
-    try:
-        ignorefunc = match.match(root, '', [], allpats)
-    except util.Abort:
-        # Re-raise an exception where the src is the right file
-        for f, patlist in pats:
-            try:
-                match.match(root, '', [], patlist)
-            except util.Abort, inst:
-                raise util.Abort('%s: %s' % (f, inst[0]))
+        ignorefunc = util.never
+    else:
+        try:
+            ignorefunc = match.match(root, '', [], allpats)
+        except util.Abort:
+            if fp is not None:
+                fp.discard()
+            # Re-raise an exception where the src is the right file
+            for f, patlist in pats:
+                try:
+                    match.match(root, '', [], patlist)
+                except util.Abort, inst:
+                    raise util.Abort('%s: %s' % (f, inst[0]))
 
-    return ignorefunc
+    if not stable:
+        if fp is not None:
+            fp.discard()
+        return ignorefunc
+    # warnings are given again until the files are fixed
+    regexes = None
+    if not warnings:
+        regexes = _regexes(root, allpats)
+    ident = _contentidentity(files, contents)
+    _writecache(fp, sigs, ident, regexes)
+    if regexes is None:
+        return ignorefunc
+    return remember(ident, ignorefunc)
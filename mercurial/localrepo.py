@@ -8,14 +8,15 @@ from node import hex, nullid, short
 from i18n import _
 import peer, changegroup, subrepo, discovery, pushkey, obsolete, repoview
 import changelog, dirstate, filelog, manifest, context, bookmarks, phases
-import lock, transaction, store, encoding
-import scmutil, util, extensions, hook, error, revset
+import lock, transaction, store, encoding, clonebundles
+import scmutil, util, extensions, hook, error, revset, worker, redelta
 import match as matchmod
 import merge as mergemod
 import tags as tagsmod
 from lock import release
-import weakref, errno, os, time, inspect
+import weakref, errno, os, sys, time, inspect, collections
 import branchmap
+import changesetcache as csetcachemod
 propertycache = util.propertycache
 filecache = scmutil.filecache
 
@@ -58,7 +59,9 @@ def unfilteredmethod(orig):
         return orig(repo.unfiltered(), *args, **kwargs)
     return wrapper
 
-MODERNCAPS = set(('lookup', 'branchmap', 'pushkey', 'known', 'getbundle'))
+MODERNCAPS = set(('lookup', 'branchmap', 'pushkey', 'known', 'getbundle',
+                  'changegroupversions=%s' % ','.join(
+                      sorted(changegroup.packermap))))
 LEGACYCAPS = MODERNCAPS.union(set(['changegroupsubset']))
 
 class localpeer(peer.peerrepository):
@@ -99,8 +102,12 @@ class localpeer(peer.peerrepository):
     def known(self, nodes):
         return self._repo.known(nodes)
 
-    def getbundle(self, source, heads=None, common=None):
-        return self._repo.getbundle(source, heads=heads, common=common)
+    def getbundle(self, source, heads=None, common=None, version='01'):
+        opts = {}
+        if version != '01':
+            opts['version'] = version
+        return self._repo.getbundle(source, heads=heads, common=common,
+                                    **opts)
 
     # TODO We might want to move the next two calls into legacypeer and add
     # unbundle instead.
@@ -144,7 +151,7 @@ class localrepository(object):
 
     supportedformats = set(('revlogv1', 'generaldelta'))
     supported = supportedformats | set(('store', 'fncache', 'shared',
-                                        'dotencode'))
+                                        'dotencode', 'dirstatetree'))
     openerreqs = set(('revlogv1', 'generaldelta'))
     requirements = ['revlogv1']
     filtername = None
@@ -194,6 +201,8 @@ class localrepository(object):
                     )
                 if self.ui.configbool('format', 'generaldelta', False):
                     requirements.append("generaldelta")
+                if self.ui.configbool('format', 'dirstatetree', False):
+                    requirements.append("dirstatetree")
                 requirements = set(requirements)
             else:
                 raise error.RepoError(_("repository %s not found") % path)
@@ -232,6 +241,7 @@ class localrepository(object):
 
 
         self._branchcaches = {}
+        self._changesetcache = None
         self.filterpats = {}
         self._datafilters = {}
         self._transref = self._lockref = self._wlockref = None
@@ -261,6 +271,21 @@ class localrepository(object):
         self.requirements = requirements
         self.sopener.options = dict((r, 1) for r in requirements
                                            if r in self.openerreqs)
+        if self.ui.configbool('format', 'persistentnodemap', False):
+            self.sopener.options['persistentnodemap'] = True
+        mmapthreshold = self.ui.configbytes('format', 'mmapthreshold', None)
+        if mmapthreshold is not None and os.name != 'nt':
+            # mapped files cannot be truncated or replaced on Windows
+            self.sopener.options['mmapthreshold'] = mmapthreshold
+        maxchainlen = self.ui.configint('format', 'maxchainlen', None)
+        if maxchainlen is not None:
+            self.sopener.options['maxchainlen'] = maxchainlen
+        maxchainspan = self.ui.configbytes('format', 'maxchainspan', None)
+        if maxchainspan is not None:
+            self.sopener.options['maxchainspan'] = maxchainspan
+        cachesize = self.ui.configbytes('format', 'revisioncachesize', 0)
+        if cachesize:
+            self.sopener.options['revisioncachesize'] = cachesize
 
     def _writerequirements(self):
         reqfile = self.opener("requires", "w")
@@ -379,7 +404,8 @@ class localrepository(object):
                                    " working parent %s!\n") % short(node))
                 return nullid
 
-        return dirstate.dirstate(self.opener, self.ui, self.root, validate)
+        return dirstate.dirstate(self.opener, self.ui, self.root, validate,
+                                 'dirstatetree' in self.requirements)
 
     def __getitem__(self, changeid):
         if changeid is None:
@@ -405,7 +431,7 @@ class localrepository(object):
         '''Return a list of revisions matching the given revset'''
         expr = revset.formatspec(expr, *args)
         m = revset.match(None, expr)
-        return [r for r in m(self, list(self))]
+        return m(self, revset.spanset(self))
 
     def set(self, expr, *args):
         '''
@@ -636,6 +662,15 @@ class localrepository(object):
         branchmap.updatecache(self)
         return self._branchcaches[self.filtername]
 
+    def changesetcache(self):
+        '''returns the changesetcache of the repository, brought up to date
+        with the changelog'''
+        csetcachemod.updatecache(self)
+        return self.unfiltered()._changesetcache
+
+    def _updatechangesetcache(self):
+        '''update the changesetcache on disk, if it exists'''
+        csetcachemod.updatecache(self, create=False)
 
     def _branchtip(self, heads):
         '''return the tipmost branch head in heads'''
@@ -805,8 +840,10 @@ class localrepository(object):
         if tr and tr.running():
             return tr.nest()
 
-        # abort here if the journal already exists
-        if self.svfs.exists("journal"):
+        # abort here if the journal already exists, or if the files of a
+        # revlog were being replaced by debugredelta
+        if (self.svfs.exists("journal")
+            or self.svfs.exists(redelta.swapfile)):
             raise error.RepoError(
                 _("abandoned transaction found - run hg recover"))
 
@@ -852,6 +889,9 @@ class localrepository(object):
                                      self.ui.warn)
                 self.invalidate()
                 return True
+            elif redelta.restore(self.ui, scmutil.vfs(self.spath)):
+                self.invalidate()
+                return True
             else:
                 self.ui.warn(_("no interrupted transaction available\n"))
                 return False
@@ -967,7 +1007,13 @@ class localrepository(object):
                     pass
             delattr(self.unfiltered(), 'dirstate')
 
-    def invalidate(self):
+    def invalidate(self, clearcaches=True):
+        """Invalidates the file caches, causing them to be checked for
+        changes on their next use.
+
+        The caches computed from them (tags, branch heads, ...) are also
+        cleared unless clearcaches is False, in which case the caller is
+        responsible for knowing they are still valid."""
         unfiltered = self.unfiltered() # all file caches are stored unfiltered
         for k in self._filecache:
             # dirstate is invalidated separately in invalidatedirstate()
@@ -978,7 +1024,8 @@ class localrepository(object):
                 delattr(unfiltered, k)
             except AttributeError:
                 pass
-        self.invalidatecaches()
+        if clearcaches:
+            self.invalidatecaches()
 
     def _lock(self, lockname, wait, releasefn, acquirefn, desc):
         try:
@@ -1371,6 +1418,7 @@ class localrepository(object):
                 phases.retractboundary(self, targetphase, [n])
             tr.close()
             branchmap.updatecache(self.filtered('served'))
+            self._afterlock(self._updatechangesetcache)
             return n
         finally:
             if tr:
@@ -1416,6 +1464,7 @@ class localrepository(object):
         # Thanks to branchcache collaboration this is done from the nearest
         # filtered subset and it is expected to be fast.
         branchmap.updatecache(self.filtered('served'))
+        self._afterlock(self._updatechangesetcache)
 
         # Ensure the persistent tag cache is updated.  Doing it now
         # means that the tag cache only has to worry about destroyed
@@ -1491,32 +1540,38 @@ class localrepository(object):
             cmp, modified, added, removed, deleted, unknown, ignored, clean = s
 
             # check for any possibly clean files
+            fixup = []
             if parentworking and cmp:
-                fixup = []
-                # do a full compare of any files that might have changed
-                for f in sorted(cmp):
-                    if (f not in ctx1 or ctx2.flags(f) != ctx1.flags(f)
-                        or ctx1[f].cmp(ctx2[f])):
-                        modified.append(f)
+                # do a full compare of any files that might have changed,
+                # in worker processes if there are many of them
+                ctx1.manifest() # shared with the workers
+                prog = worker.worker(self.ui, 0.001, cmpfiles, (ctx1, ctx2),
+                                     sorted(cmp))
+                changed = []
+                for ismodified, f in prog:
+                    if ismodified:
+                        changed.append(f)
                     else:
                         fixup.append(f)
-
-                # update dirstate for files that are actually clean
-                if fixup:
-                    if listclean:
-                        clean += fixup
-
+                modified += sorted(changed)
+                fixup.sort()
+                if listclean:
+                    clean += fixup
+
+            # update dirstate for files that are actually clean, and for
+            # the directories found unchanged with the tree format
+            if fixup or self.dirstate._mtimesdirty:
+                try:
+                    # updating the dirstate is optional
+                    # so we don't wait on the lock
+                    wlock = self.wlock(False)
                     try:
-                        # updating the dirstate is optional
-                        # so we don't wait on the lock
-                        wlock = self.wlock(False)
-                        try:
-                            for f in fixup:
-                                self.dirstate.normal(f)
-                        finally:
-                            wlock.release()
-                    except error.LockError:
-                        pass
+                        for f in fixup:
+                            self.dirstate.normal(f)
+                    finally:
+                        wlock.release()
+                except error.LockError:
+                    pass
 
         if not parentworking:
             mf1 = mfmatches(ctx1)
@@ -1590,6 +1645,58 @@ class localrepository(object):
             l.sort()
         return r
 
+    def iterstatus(self, match=None, ignored=False, clean=False,
+                   unknown=False):
+        """yield (state, file) pairs for the files of the working directory
+        as soon as their status relative to its first parent is known
+
+        state is one of 'modified', 'added', 'removed', 'deleted',
+        'unknown', 'ignored' and 'clean'. Unlike status(), files come in
+        no particular order and subrepositories are not looked at.
+        """
+        match = match or matchmod.always(self.root, self.getcwd())
+        ctx1 = self['.']
+        ctx2 = self[None]
+        subrepos = []
+        if '.hgsub' in self.dirstate:
+            subrepos = sorted(ctx2.substate)
+        checklink = self.dirstate._checklink
+
+        fixup = []
+        for state, f in self.dirstate.iterstatus(match, subrepos, ignored,
+                                                 clean, unknown):
+            if state == 'unsure':
+                # compare the contents of the files that might have
+                # changed one by one, not to hold back the others
+                for ismodified, f in cmpfiles(ctx1, ctx2, [f]):
+                    if ismodified:
+                        state = 'modified'
+                    else:
+                        fixup.append(f)
+                        if not clean:
+                            continue
+                        state = 'clean'
+            if (state == 'modified' and not checklink and
+                ctx2.flags(f) == 'l'):
+                # see status()
+                d = ctx2[f].data()
+                if len(d) >= 1024 or '\n' in d or util.binary(d):
+                    self.ui.debug('ignoring suspect symlink placeholder'
+                                  ' "%s"\n' % f)
+                    continue
+            yield state, f
+
+        if fixup or self.dirstate._mtimesdirty:
+            try:
+                wlock = self.wlock(False)
+                try:
+                    for f in fixup:
+                        self.dirstate.normal(f)
+                finally:
+                    wlock.release()
+            except error.LockError:
+                pass
+
     def heads(self, start=None):
         heads = self.changelog.heads(start)
         # sort the output in rev descending order
@@ -1674,8 +1781,13 @@ class localrepository(object):
                     heads = rheads
 
                 if remote.capable('getbundle'):
+                    # peers predating changegroup versions take no version
+                    opts = {}
+                    version = changegroup.peerversion(remote)
+                    if version != '01':
+                        opts['version'] = version
                     cg = remote.getbundle('pull', common=common,
-                                          heads=heads or rheads)
+                                          heads=heads or rheads, **opts)
                 elif heads is None:
                     cg = remote.changegroup(fetch, 'pull')
                 elif not remote.capable('changegroupsubset'):
@@ -1988,7 +2100,7 @@ class localrepository(object):
         common = cl.ancestors([cl.rev(n) for n in bases])
         return self._changegroupsubset(common, csets, heads, source)
 
-    def getlocalbundle(self, source, outgoing):
+    def getlocalbundle(self, source, outgoing, version='01'):
         """Like getbundle, but taking a discovery.outgoing as an argument.
 
         This is only implemented for local repos and reuses potentially
@@ -1998,9 +2110,9 @@ class localrepository(object):
         return self._changegroupsubset(outgoing.common,
                                        outgoing.missing,
                                        outgoing.missingheads,
-                                       source)
+                                       source, version)
 
-    def getbundle(self, source, heads=None, common=None):
+    def getbundle(self, source, heads=None, common=None, version='01'):
         """Like changegroupsubset, but returns the set difference between the
         ancestors of heads and the ancestors common.
 
@@ -2008,6 +2120,10 @@ class localrepository(object):
 
         The nodes in common might not all be known locally due to the way the
         current discovery protocol works.
+
+        version is the changegroup format version to use, one of
+        changegroup.packermap. Only version 01 can be written to bundle
+        files.
         """
         cl = self.changelog
         if common:
@@ -2018,10 +2134,12 @@ class localrepository(object):
         if not heads:
             heads = cl.heads()
         return self.getlocalbundle(source,
-                                   discovery.outgoing(cl, common, heads))
+                                   discovery.outgoing(cl, common, heads),
+                                   version)
 
     @unfilteredmethod
-    def _changegroupsubset(self, commonrevs, csets, heads, source):
+    def _changegroupsubset(self, commonrevs, csets, heads, source,
+                           version='01'):
 
         cl = self.changelog
         mf = self.manifest
@@ -2034,7 +2152,7 @@ class localrepository(object):
         # can we go through the fast path ?
         heads.sort()
         if heads == sorted(self.heads()):
-            return self._changegroup(csets, source)
+            return self._changegroup(csets, source, version)
 
         # slow path
         self.hook('preoutgoing', throw=True, source=source)
@@ -2076,7 +2194,8 @@ class localrepository(object):
                          unit=_files, total=count[1])
                 return fstate[1][x]
 
-        bundler = changegroup.bundle10(lookup)
+        bundler, unbundler = changegroup.packermap[version]
+        bundler = bundler(lookup)
         reorder = self.ui.config('bundle', 'reorder', 'auto')
         if reorder == 'auto':
             reorder = None
@@ -2126,14 +2245,14 @@ class localrepository(object):
             if csets:
                 self.hook('outgoing', node=hex(csets[0]), source=source)
 
-        return changegroup.unbundle10(util.chunkbuffer(gengroup()), 'UN')
+        return unbundler(util.chunkbuffer(gengroup()), 'UN')
 
     def changegroup(self, basenodes, source):
         # to avoid a race we use changegroupsubset() (issue1320)
         return self.changegroupsubset(basenodes, self.heads(), source)
 
     @unfilteredmethod
-    def _changegroup(self, nodes, source):
+    def _changegroup(self, nodes, source, version='01'):
         """Compute the changegroup of all nodes that we have that a recipient
         doesn't.  Return a chunkbuffer object whose read() method will return
         successive changegroup chunks.
@@ -2184,7 +2303,8 @@ class localrepository(object):
                     total=count[1], unit=_files)
                 return cl.node(revlog.linkrev(revlog.rev(x)))
 
-        bundler = changegroup.bundle10(lookup)
+        bundler, unbundler = changegroup.packermap[version]
+        bundler = bundler(lookup)
         reorder = self.ui.config('bundle', 'reorder', 'auto')
         if reorder == 'auto':
             reorder = None
@@ -2224,7 +2344,104 @@ class localrepository(object):
             if nodes:
                 self.hook('outgoing', node=hex(nodes[0]), source=source)
 
-        return changegroup.unbundle10(util.chunkbuffer(gengroup()), 'UN')
+        return unbundler(util.chunkbuffer(gengroup()), 'UN')
+
+    def _addfilegroups(self, source, revmap, trp, pr, needfiles):
+        """add the filelog groups of a changegroup, checking the file
+        revisions listed by needfiles are received
+
+        With worker.filelogthreads set, groups are read from source and
+        added by a pool of threads while the next ones are read. Files
+        are reported by pr once added.
+
+        Returns the number of files and of file revisions added."""
+        counts = [0, 0]
+        def added(f, fl, o):
+            counts[0] += 1
+            counts[1] += len(fl) - o
+            if f in needfiles:
+                needs = needfiles[f]
+                for new in xrange(o, len(fl)):
+                    n = fl.node(new)
+                    if n in needs:
+                        needs.remove(n)
+                    else:
+                        raise util.Abort(
+                            _("received spurious file revlog entry"))
+                if not needs:
+                    del needfiles[f]
+
+        numthreads = self.ui.configint('worker', 'filelogthreads', 0)
+        if numthreads < 2:
+            while True:
+                chunkdata = source.filelogheader()
+                if not chunkdata:
+                    break
+                f = chunkdata["filename"]
+                self.ui.debug("adding %s revisions\n" % f)
+                pr()
+                fl = self.file(f)
+                o = len(fl)
+                if not fl.addgroup(source, revmap, trp):
+                    raise util.Abort(_("received file revlog group is empty"))
+                added(f, fl, o)
+            return counts
+
+        # the store opener updates the fncache and the transaction writes
+        # its journal, neither can be used by several threads at once
+        opener = worker.serialized(self.sopener)
+        trp = worker.serialized(trp)
+        jobs = {}
+        def addgroup(i):
+            f, fl, o, group = jobs.pop(i)
+            if not fl.addgroup(group, revmap, trp):
+                raise util.Abort(_("received file revlog group is empty"))
+            return f, fl, o
+        pool = worker.threadedmap(addgroup, numthreads)
+        # (job number, file name) of the groups being added, oldest first
+        pending = collections.deque()
+        def finish():
+            i, f = pending.popleft()
+            r = pool.get(i)
+            pr()
+            added(*r)
+        try:
+            try:
+                i = 0
+                while True:
+                    chunkdata = source.filelogheader()
+                    if not chunkdata:
+                        break
+                    f = chunkdata["filename"]
+                    self.ui.debug("adding %s revisions\n" % f)
+                    if f in [p[1] for p in pending]:
+                        # the same file twice, wait for its first group
+                        while pending:
+                            finish()
+                    fl = self.file(f)
+                    fl.opener = opener
+                    jobs[i] = f, fl, len(fl), changegroup.bufferedgroup(source)
+                    pending.append((i, f))
+                    pool.put(i)
+                    i += 1
+                    # bound the data read ahead
+                    if len(pending) > numthreads * 4:
+                        finish()
+                while pending:
+                    finish()
+            except: # re-raises
+                exc = sys.exc_info()
+                # the transaction must not be rolled back while groups are
+                # being added
+                for i, f in pending:
+                    try:
+                        pool.get(i)
+                    except Exception:
+                        pass
+                raise exc[0], exc[1], exc[2]
+        finally:
+            pool.close()
+        return counts
 
     @unfilteredmethod
     def addchangegroup(self, source, srctype, url, emptyok=False):
@@ -2318,30 +2535,8 @@ class localrepository(object):
             pr.total = efiles
             source.callback = None
 
-            while True:
-                chunkdata = source.filelogheader()
-                if not chunkdata:
-                    break
-                f = chunkdata["filename"]
-                self.ui.debug("adding %s revisions\n" % f)
-                pr()
-                fl = self.file(f)
-                o = len(fl)
-                if not fl.addgroup(source, revmap, trp):
-                    raise util.Abort(_("received file revlog group is empty"))
-                revisions += len(fl) - o
-                files += 1
-                if f in needfiles:
-                    needs = needfiles[f]
-                    for new in xrange(o, len(fl)):
-                        n = fl.node(new)
-                        if n in needs:
-                            needs.remove(n)
-                        else:
-                            raise util.Abort(
-                                _("received spurious file revlog entry"))
-                    if not needs:
-                        del needfiles[f]
+            files, revisions = self._addfilegroups(source, revmap, trp, pr,
+                                                   needfiles)
             self.ui.progress(_('files'), None)
 
             for f, needs in needfiles.iteritems():
@@ -2407,6 +2602,7 @@ class localrepository(object):
                     # `destroyed` will repair it.
                     # In other case we can safely update cache on disk.
                     branchmap.updatecache(self.filtered('served'))
+                    self._afterlock(self._updatechangesetcache)
                 def runhooks():
                     # forcefully update the on-disk branch cache
                     self.ui.debug("updating the branch cache\n")
@@ -2441,7 +2637,16 @@ class localrepository(object):
             if remote.capable("branchmap"):
                 rbranchmap = remote.branchmap()
 
-            fp = remote.stream_out()
+            engine = None
+            if remote.capable('stream2'):
+                # the server always accepts to send the store uncompressed
+                cap = remote.capable('compression')
+                cap = cap and cap is not True and cap + ',none' or 'none'
+                engine = changegroup.peerwireengine(self.ui, cap)
+                self.ui.debug('streaming with %s compression\n' % engine.name)
+                fp = remote.stream_out2(engine.wiretype)
+            else:
+                fp = remote.stream_out()
             l = fp.readline()
             try:
                 resp = int(l)
@@ -2452,23 +2657,87 @@ class localrepository(object):
                 raise util.Abort(_('operation forbidden by server'))
             elif resp == 2:
                 raise util.Abort(_('locking the remote repository failed'))
+            elif resp == 3:
+                raise util.Abort(_('the server does not support %s '
+                                   'compression') % engine.name)
             elif resp != 0:
                 raise util.Abort(_('the server sent an unknown error code'))
             self.ui.status(_('streaming all changes\n'))
-            l = fp.readline()
-            try:
-                total_files, total_bytes = map(int, l.split(' ', 1))
-            except (ValueError, TypeError):
-                raise error.ResponseError(
-                    _('unexpected response from remote server:'), l)
-            self.ui.status(_('%d files to transfer, %s of data\n') %
-                           (total_files, util.bytecount(total_bytes)))
-            handled_bytes = 0
-            self.ui.progress(_('clone'), 0, total=total_bytes)
-            start = time.time()
+            if engine is None:
+                return self.applystream(fp, requirements, rbranchmap)
+            fp = util.chunkbuffer(
+                engine.decompressstream(changegroup.readframes(fp)))
+            return self.applystream2(fp, requirements, rbranchmap)
+        finally:
+            lock.release()
+
+    def applystream(self, fp, requirements, rbranchmap=None):
+        '''write the store files streamed by fp, in the format sent by
+        the stream_out wire command after its status line, and adopt
+        the given revlog format requirements
+
+        The caller must hold the lock of the repository.'''
+        l = fp.readline()
+        try:
+            total_files, total_bytes = map(int, l.split(' ', 1))
+        except (ValueError, TypeError):
+            raise error.ResponseError(
+                _('unexpected response from remote server:'), l)
+        self.ui.status(_('%d files to transfer, %s of data\n') %
+                       (total_files, util.bytecount(total_bytes)))
+        def entries():
             for i in xrange(total_files):
-                # XXX doesn't support '\n' or '\r' in filenames
+                yield fp.readline()
+        self._writestreamfiles(fp, entries(), total_bytes)
+        return self._adoptstream(requirements, rbranchmap)
+
+    def applystream2(self, fp, requirements, rbranchmap=None):
+        '''write the store files streamed by fp, in the format sent by
+        the stream_out2 wire command once decompressed, and adopt the
+        given revlog format requirements
+
+        The caller must hold the lock of the repository.'''
+        l = fp.readline()
+        try:
+            total_revlogs = int(l)
+        except ValueError:
+            raise error.ResponseError(
+                _('unexpected response from remote server:'), l)
+        self.ui.status(_('%d revlogs to transfer\n') % total_revlogs)
+        def entries():
+            while True:
                 l = fp.readline()
+                if l == '\n':
+                    break
+                yield l
+        self._writestreamfiles(fp, entries(), None)
+        return self._adoptstream(requirements, rbranchmap)
+
+    def _writestreamfiles(self, fp, headers, total_bytes):
+        '''write the files following each of the headers read from fp
+
+        Files of up to 64k are read at once and written by the number of
+        threads set with worker.streamthreads, while the next ones are
+        read.'''
+        numthreads = self.ui.configint('worker', 'streamthreads', 4)
+        pool = None
+        if numthreads > 1:
+            jobs = {}
+            def write(i):
+                ofp, data = jobs.pop(i)
+                try:
+                    ofp.write(data)
+                finally:
+                    ofp.close()
+            pool = worker.threadedmap(write, numthreads)
+            pending = collections.deque()
+
+        handled_bytes = 0
+        self.ui.progress(_('clone'), 0, total=total_bytes)
+        start = time.time()
+        try:
+            for i, l in enumerate(headers):
+                # XXX doesn't support '\n' or '\r' in filenames
                 try:
                     name, size = l.split('\0', 1)
                     size = int(size)
@@ -2480,50 +2749,66 @@ class localrepository(object):
                                   (name, util.bytecount(size)))
                 # for backwards compat, name was partially encoded
                 ofp = self.sopener(store.decodedir(name), 'w')
+                if pool is not None and size <= 65536:
+                    jobs[i] = ofp, changegroup.readexactly(fp, size)
+                    pool.put(i)
+                    pending.append(i)
+                    # bound the data waiting to be written
+                    if len(pending) > numthreads * 16:
+                        pool.get(pending.popleft())
+                    handled_bytes += size
+                    self.ui.progress(_('clone'), handled_bytes,
+                                     total=total_bytes)
+                    continue
                 for chunk in util.filechunkiter(fp, limit=size):
                     handled_bytes += len(chunk)
                     self.ui.progress(_('clone'), handled_bytes,
                                      total=total_bytes)
                     ofp.write(chunk)
                 ofp.close()
-            elapsed = time.time() - start
-            if elapsed <= 0:
-                elapsed = 0.001
-            self.ui.progress(_('clone'), None)
-            self.ui.status(_('transferred %s in %.1f seconds (%s/sec)\n') %
-                           (util.bytecount(total_bytes), elapsed,
-                            util.bytecount(total_bytes / elapsed)))
-
-            # new requirements = old non-format requirements +
-            #                    new format-related
-            # requirements from the streamed-in repository
-            requirements.update(set(self.requirements) - self.supportedformats)
-            self._applyrequirements(requirements)
-            self._writerequirements()
-
-            if rbranchmap:
-                rbheads = []
-                for bheads in rbranchmap.itervalues():
-                    rbheads.extend(bheads)
-
-                if rbheads:
-                    rtiprev = max((int(self.changelog.rev(node))
-                            for node in rbheads))
-                    cache = branchmap.branchcache(rbranchmap,
-                                                  self[rtiprev].node(),
-                                                  rtiprev)
-                    # Try to stick it as low as possible
-                    # filter above served are unlikely to be fetch from a clone
-                    for candidate in ('base', 'immutable', 'served'):
-                        rview = self.filtered(candidate)
-                        if cache.validfor(rview):
-                            self._branchcaches[candidate] = cache
-                            cache.write(rview)
-                            break
-            self.invalidate()
-            return len(self.heads()) + 1
+            if pool is not None:
+                while pending:
+                    pool.get(pending.popleft())
         finally:
-            lock.release()
+            if pool is not None:
+                pool.close()
+        elapsed = time.time() - start
+        if elapsed <= 0:
+            elapsed = 0.001
+        self.ui.progress(_('clone'), None)
+        self.ui.status(_('transferred %s in %.1f seconds (%s/sec)\n') %
+                       (util.bytecount(handled_bytes), elapsed,
+                        util.bytecount(handled_bytes / elapsed)))
+
+    def _adoptstream(self, requirements, rbranchmap):
+        # new requirements = old non-format requirements +
+        #                    new format-related
+        # requirements from the streamed-in repository
+        requirements.update(set(self.requirements) - self.supportedformats)
+        self._applyrequirements(requirements)
+        self._writerequirements()
+
+        if rbranchmap:
+            rbheads = []
+            for bheads in rbranchmap.itervalues():
+                rbheads.extend(bheads)
+
+            if rbheads:
+                rtiprev = max((int(self.changelog.rev(node))
+                        for node in rbheads))
+                cache = branchmap.branchcache(rbranchmap,
+                                              self[rtiprev].node(),
+                                              rtiprev)
+                # Try to stick it as low as possible
+                # filter above served are unlikely to be fetch from a clone
+                for candidate in ('base', 'immutable', 'served'):
+                    rview = self.filtered(candidate)
+                    if cache.validfor(rview):
+                        self._branchcaches[candidate] = cache
+                        cache.write(rview)
+                        break
+        self.invalidate()
+        return len(self.heads()) + 1
 
     def clone(self, remote, heads=[], stream=False):
         '''clone remote repository.
@@ -2544,6 +2829,11 @@ class localrepository(object):
             # if the server explicitly prefers to stream (for fast LANs)
             stream = remote.capable('stream-preferred')
 
+        if (not heads and remote.capable('clonebundles') and
+            self.ui.configbool('ui', 'clonebundles', True)):
+            if clonebundles.clone(self, remote, stream):
+                return self.pull(remote)
+
         if stream and not heads:
             # 'stream' means remote revlog format is revlogv1 only
             if remote.capable('stream'):
@@ -2585,6 +2875,19 @@ class localrepository(object):
             fp.close()
         return self.pathto(fp.name[len(self.root) + 1:])
 
+def cmpfiles(ctx1, ctx2, files):
+    '''compare files of the working directory context ctx2 with their
+    version in ctx1
+
+    yields (1, file) for modified files and (0, file) for clean ones
+    '''
+    for f in files:
+        if (f not in ctx1 or ctx2.flags(f) != ctx1.flags(f)
+            or ctx1[f].cmp(ctx2[f])):
+            yield 1, f
+        else:
+            yield 0, f
+
 # used to avoid circular references so destructors work
 def aftertrans(files):
     renamefiles = [tuple(t) for t in files]
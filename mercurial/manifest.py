@@ -32,7 +32,8 @@ class manifest(revlog.revlog):
     def __init__(self, opener):
         # we expect to deal with not more than three revs at a time in merge
         self._mancache = util.lrucachedict(3)
-        revlog.revlog.__init__(self, opener, "00manifest.i")
+        revlog.revlog.__init__(self, opener, "00manifest.i",
+                               persistentnodemap=True)
 
     def parse(self, lines):
         mfdict = manifestdict()
@@ -0,0 +1,291 @@
+# nodemap.py - persistent node to revision mapping for revlogs
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""persistent node to revision mapping
+
+Building the in-memory nodemap of a large revlog requires a scan of the
+whole index, which dominates the run time of short lived processes only
+looking up a handful of nodes. This module stores a radix tree of all
+the nodes of a revlog next to it, so that lookups can be answered by
+reading a few blocks of a memory mapped file.
+
+The file is a sequence of 64 bytes records. Most records are tree
+blocks made of 16 big endian signed 32 bits integers, one for each
+value of the hex digit at the block level:
+
+ -1      empty slot
+ >= 0    index of a child block in the file
+ <= -2   leaf for revision -(value + 2)
+
+Updates never rewrite existing records. The blocks touched by new
+revisions are copied, appended to the file and followed by a trailer
+record:
+
+  4 bytes: magic
+  4 bytes: number of revisions in the tree
+  4 bytes: index of the root block
+  4 bytes: number of blocks reachable from the root
+ 20 bytes: node of the last revision in the tree
+ 28 bytes: padding
+
+Only the last trailer of the file is used. It is validated against the
+index, revisions appended by clients not maintaining the file are looked
+up in a small in-memory map until the next write.
+"""
+
+from node import hex, nullid, nullrev
+from i18n import _
+import error, util
+import errno, struct
+
+_pack = struct.pack
+_unpack = struct.unpack
+
+_blockformat = ">16l"
+_trailerformat = ">4sIll20s28x"
+_recordsize = 64
+_magic = 'HGN1'
+_hexdigits = '0123456789abcdef'
+
+# rewrite the whole file once it is more than _maxwaste times larger
+# than the live tree
+_maxwaste = 4
+
+class nodemap(object):
+    """node to revision mapping backed by a persistent radix tree
+
+    This implements the same mapping protocol as the C index, so it can
+    be used as the nodemap of a revlog."""
+
+    def __init__(self, opener, filename, index):
+        self.filename = filename
+        self._opener = opener
+        self._index = index
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self._data = ''
+        self._records = 0
+        self._root = -1
+        self._live = 0
+        self._revcount = 0
+        self._blocks = {}
+        self._new = {}
+        self._tail = None
+
+    def _load(self):
+        try:
+            fp = self._opener(self.filename)
+        except IOError, inst:
+            if inst.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            data = util.mmapread(fp)
+        finally:
+            fp.close()
+        size = len(data)
+        if size < _recordsize or size % _recordsize:
+            return
+        trailer = data[size - _recordsize:size]
+        magic, revcount, root, live, tipnode = _unpack(_trailerformat, trailer)
+        if (magic != _magic or revcount > len(self._index) - 1
+            or revcount < 1 or self._index[revcount - 1][7] != tipnode):
+            return
+        self._data = data
+        self._records = size // _recordsize
+        self._root = root
+        self._live = live
+        self._revcount = revcount
+
+    def _block(self, b):
+        block = self._new.get(b)
+        if block is None:
+            block = self._blocks.get(b)
+            if block is None:
+                off = b * _recordsize
+                block = _unpack(_blockformat,
+                                self._data[off:off + _recordsize])
+                self._blocks[b] = block
+        return block
+
+    def _gettail(self):
+        """map of the revisions not stored in the tree"""
+        if self._tail is None:
+            index = self._index
+            tail = {}
+            for r in xrange(self._revcount, len(index) - 1):
+                tail[index[r][7]] = r
+            self._tail = tail
+        return self._tail
+
+    def _find(self, node):
+        if self._root < 0:
+            return None
+        b = self._root
+        for c in hex(node):
+            v = self._block(b)[int(c, 16)]
+            if v >= 0:
+                b = v
+            elif v == -1:
+                return None
+            else:
+                rev = -(v + 2)
+                if self._index[rev][7] == node:
+                    return rev
+                return None
+        return None
+
+    def __getitem__(self, node):
+        if node == nullid:
+            return nullrev
+        rev = self._gettail().get(node)
+        if rev is None:
+            rev = self._find(node)
+            if rev is None:
+                raise error.RevlogError(_('no node'))
+        return rev
+
+    def get(self, node, default=None):
+        try:
+            return self[node]
+        except error.RevlogError:
+            return default
+
+    def __contains__(self, node):
+        return self.get(node) is not None
+
+    def __setitem__(self, node, rev):
+        self._gettail()[node] = rev
+
+    def __delitem__(self, node):
+        rev = self[node]
+        if rev < self._revcount:
+            # the tree cannot forget revisions, fall back to the index
+            self._reset()
+        del self._gettail()[node]
+
+    def clearcaches(self):
+        self._blocks = {}
+        self._tail = None
+
+    def partialmatch(self, id):
+        """find the node whose hex form starts with id
+
+        Returns None when nothing matches, raises RevlogError if the
+        prefix is ambiguous and ValueError for unsupported prefixes."""
+        if len(id) < 4:
+            raise ValueError('key too short')
+        if len(id) > 40:
+            raise ValueError('key too long')
+        if id.strip(_hexdigits):
+            return None
+
+        found = [n for n in self._gettail() if hex(n).startswith(id)]
+        if hex(nullid).startswith(id):
+            found.append(nullid)
+        b = self._root
+        if b >= 0:
+            for c in id:
+                v = self._block(b)[int(c, 16)]
+                if v >= 0:
+                    b = v
+                    continue
+                if v != -1:
+                    node = self._index[-(v + 2)][7]
+                    if hex(node).startswith(id):
+                        found.append(node)
+                break
+            else:
+                # the prefix leads to a block with several entries
+                raise error.RevlogError(_('ambiguous identifier'))
+        if len(found) > 1:
+            raise error.RevlogError(_('ambiguous identifier'))
+        if found:
+            return found[0]
+        return None
+
+    def _newblock(self, block=None):
+        b = self._records + len(self._new)
+        if block is None:
+            block = [-1] * 16
+        self._new[b] = list(block)
+        return b
+
+    def _writable(self, b):
+        """return the index of a modifiable copy of block b"""
+        if b in self._new:
+            return b
+        if b < 0:
+            self._live += 1
+            return self._newblock()
+        return self._newblock(self._block(b))
+
+    def _insert(self, node, rev):
+        index = self._index
+        h = hex(node)
+        b = self._root = self._writable(self._root)
+        level = 0
+        while True:
+            block = self._new[b]
+            nibble = int(h[level], 16)
+            v = block[nibble]
+            if v == -1 or v == -rev - 2:
+                block[nibble] = -rev - 2
+                return
+            if v >= 0:
+                b = block[nibble] = self._writable(v)
+                level += 1
+                continue
+            other = index[-(v + 2)][7]
+            if other == node:
+                block[nibble] = -rev - 2
+                return
+            # both nodes share this prefix, push the existing leaf down
+            b = block[nibble] = self._writable(-1)
+            level += 1
+            self._new[b][int(hex(other)[level], 16)] = v
+
+    def write(self, tr):
+        """store the revisions missing from the file
+
+        The file is journaled in the transaction tr. It is extended in
+        place unless it is missing, invalid or mostly made of unreachable
+        blocks, in which case it is replaced by a fresh copy."""
+        index = self._index
+        count = len(index) - 1
+        if count == self._revcount or count < 1:
+            return
+
+        full = (self._root < 0 or
+                self._records > _maxwaste * (self._live + 1))
+        if full:
+            self._reset()
+
+        for r in xrange(self._revcount, count):
+            self._insert(index[r][7], r)
+
+        records = [_pack(_blockformat, *self._new[b])
+                   for b in sorted(self._new)]
+        records.append(_pack(_trailerformat, _magic, count, self._root,
+                             self._live, index[count - 1][7]))
+        data = ''.join(records)
+
+        if full:
+            tr.add(self.filename, 0)
+            fp = self._opener(self.filename, 'w', atomictemp=True)
+        else:
+            tr.add(self.filename, self._records * _recordsize)
+            fp = self._opener(self.filename, 'a')
+        try:
+            fp.write(data)
+        finally:
+            fp.close()
+
+        self._reset()
+        self._load()
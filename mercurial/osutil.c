@@ -19,6 +19,7 @@
 #include <io.h>
 #else
 #include <dirent.h>
+#include <sys/socket.h>
 #include <sys/stat.h>
 #include <sys/types.h>
 #include <unistd.h>
@@ -306,15 +307,21 @@ static PyObject *_listdir(char *path, int pathlen, int keepstat, char *skip)
 	strncpy(fullpath, path, PATH_MAX);
 	fullpath[pathlen] = '/';
 
+	/* the GIL is released around system calls, letting other threads
+	   list directories at the same time */
 #ifdef AT_SYMLINK_NOFOLLOW
+	Py_BEGIN_ALLOW_THREADS
 	dfd = open(path, O_RDONLY);
+	Py_END_ALLOW_THREADS
 	if (dfd == -1) {
 		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
 		goto error_value;
 	}
 	dir = fdopendir(dfd);
 #else
+	Py_BEGIN_ALLOW_THREADS
 	dir = opendir(path);
+	Py_END_ALLOW_THREADS
 #endif
 	if (!dir) {
 		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
@@ -325,20 +332,29 @@ static PyObject *_listdir(char *path, int pathlen, int keepstat, char *skip)
 	if (!list)
 		goto error_list;
 
-	while ((ent = readdir(dir))) {
+	for (;;) {
+		Py_BEGIN_ALLOW_THREADS
+		ent = readdir(dir);
+		Py_END_ALLOW_THREADS
+		if (!ent)
+			break;
 		if (!strcmp(ent->d_name, ".") || !strcmp(ent->d_name, ".."))
 			continue;
 
 		kind = entkind(ent);
 		if (kind == -1 || keepstat) {
 #ifdef AT_SYMLINK_NOFOLLOW
+			Py_BEGIN_ALLOW_THREADS
 			err = fstatat(dfd, ent->d_name, &st,
 				      AT_SYMLINK_NOFOLLOW);
+			Py_END_ALLOW_THREADS
 #else
 			strncpy(fullpath + pathlen + 1, ent->d_name,
 				PATH_MAX - pathlen);
 			fullpath[PATH_MAX] = 0;
+			Py_BEGIN_ALLOW_THREADS
 			err = lstat(fullpath, &st);
+			Py_END_ALLOW_THREADS
 #endif
 			if (err == -1) {
 				/* race with file deletion? */
@@ -438,6 +454,60 @@ bail:
 	return NULL;
 }
 
+/*
+ * recvfds() simply does not release GIL during blocking io operation because
+ * command server is known to be single-threaded.
+ */
+static PyObject *recvfds(PyObject *self, PyObject *args)
+{
+	int sockfd;
+	char dummy[1];
+	struct iovec iov = {dummy, sizeof(dummy)};
+	struct msghdr msgh = {0};
+	struct cmsghdr *cmsg;
+	/* enough for the file descriptors a client can send at once */
+	char cbuf[CMSG_SPACE(sizeof(int) * 253)];
+	ssize_t datalen;
+	int *rfds = NULL;
+	size_t rfdscount = 0, i;
+	PyObject *rfdslist;
+
+	if (!PyArg_ParseTuple(args, "i:recvfds", &sockfd))
+		return NULL;
+
+	msgh.msg_iov = &iov;
+	msgh.msg_iovlen = 1;
+	msgh.msg_control = cbuf;
+	msgh.msg_controllen = sizeof(cbuf);
+
+	datalen = recvmsg(sockfd, &msgh, 0);
+	if (datalen < 0)
+		return PyErr_SetFromErrno(PyExc_OSError);
+
+	for (cmsg = CMSG_FIRSTHDR(&msgh); cmsg;
+	     cmsg = CMSG_NXTHDR(&msgh, cmsg)) {
+		if (cmsg->cmsg_level != SOL_SOCKET ||
+		    cmsg->cmsg_type != SCM_RIGHTS)
+			continue;
+		rfds = (int *)CMSG_DATA(cmsg);
+		rfdscount = (cmsg->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+		break;
+	}
+
+	rfdslist = PyList_New(rfdscount);
+	if (rfdslist == NULL)
+		return NULL;
+	for (i = 0; i < rfdscount; i++) {
+		PyObject *obj = PyInt_FromLong(rfds[i]);
+		if (obj == NULL) {
+			Py_DECREF(rfdslist);
+			return NULL;
+		}
+		PyList_SET_ITEM(rfdslist, i, obj);
+	}
+	return rfdslist;
+}
+
 #endif /* ndef _WIN32 */
 
 static PyObject *listdir(PyObject *self, PyObject *args, PyObject *kwargs)
@@ -606,6 +676,8 @@ static PyMethodDef methods[] = {
 	{"statfiles", (PyCFunction)statfiles, METH_VARARGS | METH_KEYWORDS,
 	 "stat a series of files or symlinks\n"
 "Returns None for non-existent entries and entries of other types.\n"},
+	{"recvfds", (PyCFunction)recvfds, METH_VARARGS,
+	 "receive list of file descriptors via socket\n"},
 #endif
 #ifdef __APPLE__
 	{
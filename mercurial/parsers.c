@@ -391,6 +391,7 @@ typedef struct {
 	PyObject_HEAD
 	/* Type-specific fields go here. */
 	PyObject *data;        /* raw bytes of index */
+	Py_buffer buf;         /* buffer of data */
 	PyObject **cache;      /* cached tuples */
 	const char **offsets;  /* populated on demand */
 	Py_ssize_t raw_length; /* original number of elements */
@@ -445,7 +446,7 @@ static const char *index_deref(indexObject *self, Py_ssize_t pos)
 		return self->offsets[pos];
 	}
 
-	return PyString_AS_STRING(self->data) + pos * v1_hdrsize;
+	return (const char *)(self->buf.buf) + pos * v1_hdrsize;
 }
 
 /*
@@ -1657,8 +1658,8 @@ static int index_assign_subscript(indexObject *self, PyObject *item,
  */
 static long inline_scan(indexObject *self, const char **offsets)
 {
-	const char *data = PyString_AS_STRING(self->data);
-	const char *end = data + PyString_GET_SIZE(self->data);
+	const char *data = (const char *)(self->buf.buf);
+	const char *end = data + self->buf.len;
 	long incr = v1_hdrsize;
 	Py_ssize_t len = 0;
 
@@ -1693,16 +1694,8 @@ static int index_init(indexObject *self, PyObject *args)
 	PyObject *data_obj, *inlined_obj;
 	Py_ssize_t size;
 
-	if (!PyArg_ParseTuple(args, "OO", &data_obj, &inlined_obj))
-		return -1;
-	if (!PyString_Check(data_obj)) {
-		PyErr_SetString(PyExc_TypeError, "data is not a string");
-		return -1;
-	}
-	size = PyString_GET_SIZE(data_obj);
-
-	self->inlined = inlined_obj && PyObject_IsTrue(inlined_obj);
-	self->data = data_obj;
+	self->data = NULL;
+	memset(&self->buf, 0, sizeof(self->buf));
 	self->cache = NULL;
 
 	self->added = NULL;
@@ -1713,6 +1706,16 @@ static int index_init(indexObject *self, PyObject *args)
 	self->ntdepth = self->ntsplits = 0;
 	self->ntlookups = self->ntmisses = 0;
 	self->ntrev = -1;
+
+	if (!PyArg_ParseTuple(args, "OO", &data_obj, &inlined_obj))
+		return -1;
+	/* data may also be a buffer over a memory mapped file */
+	if (PyObject_GetBuffer(data_obj, &self->buf, PyBUF_SIMPLE) == -1)
+		return -1;
+	size = self->buf.len;
+
+	self->inlined = inlined_obj && PyObject_IsTrue(inlined_obj);
+	self->data = data_obj;
 	Py_INCREF(self->data);
 
 	if (self->inlined) {
@@ -1744,7 +1747,11 @@ static PyObject *index_nodemap(indexObject *self)
 static void index_dealloc(indexObject *self)
 {
 	_index_clearcaches(self);
-	Py_DECREF(self->data);
+	if (self->buf.buf) {
+		PyBuffer_Release(&self->buf);
+		memset(&self->buf, 0, sizeof(self->buf));
+	}
+	Py_XDECREF(self->data);
 	Py_XDECREF(self->added);
 	PyObject_Del(self);
 }
@@ -5,7 +5,7 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2 or any later version.
 
-import os
+import os, sys
 import stat as statmod
 
 def _mode_to_kind(mode):
@@ -57,6 +57,71 @@ def listdir(path, stat=False, skip=None):
 
 if os.name != 'nt':
     posixfile = open
+
+    try:
+        import ctypes, ctypes.util, socket
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _recvmsg = _libc.recvmsg
+    except (ImportError, OSError, AttributeError):
+        _recvmsg = None
+
+    if _recvmsg is not None:
+        _SCM_RIGHTS = 0x01
+        _socklen_t = ctypes.c_uint
+        if sys.platform.startswith('linux'):
+            _msg_controllen_t = _cmsg_len_t = ctypes.c_size_t
+        else:
+            _msg_controllen_t = _cmsg_len_t = _socklen_t
+
+        class _iovec(ctypes.Structure):
+            _fields_ = [
+                ('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t),
+            ]
+
+        class _msghdr(ctypes.Structure):
+            _fields_ = [
+                ('msg_name', ctypes.c_void_p),
+                ('msg_namelen', _socklen_t),
+                ('msg_iov', ctypes.POINTER(_iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', _msg_controllen_t),
+                ('msg_flags', ctypes.c_int),
+            ]
+
+        class _cmsghdr(ctypes.Structure):
+            _fields_ = [
+                ('cmsg_len', _cmsg_len_t),
+                ('cmsg_level', ctypes.c_int),
+                ('cmsg_type', ctypes.c_int),
+            ]
+
+        _recvmsg.restype = ctypes.c_ssize_t
+        _recvmsg.argtypes = (ctypes.c_int, ctypes.POINTER(_msghdr),
+                             ctypes.c_int)
+
+        def recvfds(sockfd):
+            """receive list of file descriptors via socket"""
+            dummy = (ctypes.c_ubyte * 1)()
+            iov = _iovec(ctypes.cast(dummy, ctypes.c_void_p), 1)
+            cbuf = ctypes.create_string_buffer(256)
+            msgh = _msghdr(None, 0, ctypes.pointer(iov), 1,
+                           ctypes.cast(cbuf, ctypes.c_void_p),
+                           ctypes.sizeof(cbuf), 0)
+            if _recvmsg(sockfd, ctypes.byref(msgh), 0) < 0:
+                e = ctypes.get_errno()
+                raise OSError(e, os.strerror(e))
+            # the control data holds a single message
+            cmsg = _cmsghdr.from_buffer_copy(cbuf)
+            if (not msgh.msg_controllen or cmsg.cmsg_level != socket.SOL_SOCKET
+                or cmsg.cmsg_type != _SCM_RIGHTS):
+                return []
+            headersize = ctypes.sizeof(_cmsghdr)
+            count = (cmsg.cmsg_len - headersize) // ctypes.sizeof(ctypes.c_int)
+            rfds = (ctypes.c_int * count).from_buffer_copy(cbuf, headersize)
+            return list(rfds)
+
 else:
     import ctypes, msvcrt
 
@@ -0,0 +1,236 @@
+# redelta.py - recompute the deltas of the revlogs of a store
+#
+# Copyright 2013 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""rewrite revlogs with better delta parents
+
+Finding the best delta base of a revision means diffing it against
+several candidates, which dominates the time needed to rewrite a
+revlog. The deltas are computed in parallel by worker processes, then
+added to a new revlog in revision order by the main process.
+"""
+
+from node import nullrev
+from i18n import _
+import errno, os, shutil, tempfile
+import mdiff, revlog, scmutil, transaction, util, worker
+
+# lists the files of the revlog being replaced by their rewritten version
+# and their backups, while the swap is in progress
+swapfile = 'redelta.swap'
+# holds the rewritten revlogs until they are swapped in, the deltas
+# computed by the workers and the journal of the rewrite, so that a crash
+# does not leave files looking like revlogs in the store
+tmpdir = 'redelta.tmp'
+
+def _candidates(rl, rev, generaldelta):
+    """revisions to compute a delta of rev against"""
+    prev = rev - 1
+    if not generaldelta:
+        if prev == nullrev:
+            return []
+        return [prev]
+    bases = []
+    for p in rl.parentrevs(rev) + (prev,):
+        if p != nullrev and p not in bases:
+            bases.append(p)
+    return bases
+
+def _computedeltas(rl, generaldelta, tmpdir, revs):
+    """find the smallest delta of each revision of revs against the
+    revisions a revlog of the given format can use as delta bases
+
+    The deltas are written to a temporary file in tmpdir, the worker
+    protocol only being able to carry lines of text. Yields for each
+    revision its number and the base, offset and length of its delta
+    in the file followed by the name of the file."""
+    fd, path = tempfile.mkstemp(prefix='redelta-', dir=tmpdir)
+    fp = os.fdopen(fd, 'wb')
+    offset = 0
+    for rev in revs:
+        text = rl.revision(rev)
+        best = None
+        for base in _candidates(rl, rev, generaldelta):
+            delta = mdiff.textdiff(rl.revision(base), text)
+            if best is None or len(delta) < len(best[1]):
+                best = (base, delta)
+        if best is None or len(best[1]) >= len(text):
+            yield rev, '%d 0 0 %s' % (nullrev, path)
+            continue
+        base, delta = best
+        fp.write(delta)
+        fp.flush()
+        yield rev, '%d %d %d %s' % (base, offset, len(delta), path)
+        offset += len(delta)
+    fp.close()
+
+def _redeltarevlog(ui, src, dst, tr, tmpdir):
+    """add all the revisions of src to the empty revlog dst"""
+    revs = list(src)
+    prog = worker.worker(ui, 0.001, _computedeltas,
+                         (src, dst._generaldelta, tmpdir), revs)
+
+    pending = {}
+    paths = set()
+    files = {}
+    nextrev = 0
+    try:
+        for rev, item in prog:
+            base, offset, length, path = item.split(' ', 3)
+            pending[rev] = int(base), int(offset), int(length), path
+            paths.add(path)
+            while nextrev in pending:
+                base, offset, length, path = pending.pop(nextrev)
+                cachedelta = None
+                if base != nullrev:
+                    fp = files.get(path)
+                    if fp is None:
+                        fp = files[path] = open(path, 'rb')
+                    fp.seek(offset)
+                    cachedelta = (base, fp.read(length))
+                node = src.node(nextrev)
+                p1, p2 = src.parents(node)
+                dst.addrevision(src.revision(nextrev), tr,
+                                src.linkrev(nextrev), p1, p2, cachedelta)
+                nextrev += 1
+                ui.progress(_('redelta'), nextrev, total=len(revs))
+    finally:
+        ui.progress(_('redelta'), None)
+        for fp in files.values():
+            fp.close()
+        for path in paths:
+            _unlinkmissing(path)
+    if nextrev != len(revs):
+        raise util.Abort(_('redelta of %s interrupted') % src.indexfile)
+
+def redelta(ui, repo):
+    """rewrite all the revlogs of the store of repo
+
+    Returns the sizes of the revlogs before and after the rewrite."""
+    vfs = scmutil.vfs(repo.spath)
+    vfs.createmode = repo.store.createmode
+    vfs.options = dict(repo.sopener.options)
+    vfs.options.pop('persistentnodemap', None)
+    # the texts of the parents of a revision are needed right after it
+    vfs.options.setdefault('revisioncachesize', 16 * 1024 * 1024)
+
+    oldsize = newsize = 0
+    lock = repo.lock()
+    try:
+        restore(ui, vfs)
+        vfs.makedirs(tmpdir)
+        indexes = [encoded for unencoded, encoded, size in repo.store.walk()
+                   if encoded.endswith('.i')]
+        for indexfile in indexes:
+            ui.note(_('rewriting %s\n') % indexfile)
+            src = revlog.revlog(vfs, indexfile)
+            if not len(src):
+                continue
+            tmpindex = '%s/%s' % (tmpdir, indexfile)
+            dst = revlog.revlog(vfs, tmpindex)
+            if indexfile == '00changelog.i':
+                # changelogs don't benefit from generaldelta
+                dst.version &= ~revlog.REVLOGGENERALDELTA
+                dst._generaldelta = False
+            dst._lazydeltabase = True
+            files = [(indexfile, tmpindex), (src.datafile, dst.datafile)]
+            tr = transaction.transaction(ui.warn, vfs,
+                                         vfs.join(tmpdir + '/journal'))
+            try:
+                try:
+                    _redeltarevlog(ui, src, dst, tr, vfs.join(tmpdir))
+                    tr.close()
+                finally:
+                    tr.release()
+            except: # re-raises
+                shutil.rmtree(vfs.join(tmpdir))
+                raise
+
+            for old, new in files:
+                if vfs.exists(old):
+                    oldsize += vfs.stat(old).st_size
+                if vfs.exists(new):
+                    newsize += vfs.stat(new).st_size
+            _swap(ui, vfs, files)
+        shutil.rmtree(vfs.join(tmpdir))
+        repo.invalidate()
+    finally:
+        lock.release()
+    return oldsize, newsize
+
+def _backupname(name):
+    return name + '.redelta-backup'
+
+def _swap(ui, vfs, files):
+    """replace the files of a revlog by their rewritten version
+
+    The index and data files cannot be renamed at once. The original files
+    are kept as backups and listed in the swap file until all of them are
+    replaced, so that restore() can undo an interrupted swap."""
+    entries = []
+    for old, new in files:
+        backup = ''
+        if vfs.exists(old):
+            backup = _backupname(old)
+            _unlinkmissing(vfs.join(backup))
+            try:
+                util.oslink(vfs.join(old), vfs.join(backup))
+            except (IOError, OSError):
+                util.copyfile(vfs.join(old), vfs.join(backup))
+        entries.append('%s\0%s\0%s\n' % (old, new, backup))
+    fp = vfs(swapfile, 'w', atomictemp=True)
+    fp.write(''.join(entries))
+    fp.close()
+
+    try:
+        for old, new in files:
+            if vfs.exists(new):
+                if vfs.exists(old):
+                    os.chmod(vfs.join(new), vfs.stat(old).st_mode)
+                vfs.rename(new, old)
+            else:
+                _unlinkmissing(vfs.join(old))
+    except: # re-raises
+        restore(ui, vfs)
+        raise
+    # the swap is complete once the swap file is removed
+    util.unlink(vfs.join(swapfile))
+    for old, new in files:
+        _unlinkmissing(vfs.join(_backupname(old)))
+
+def restore(ui, vfs):
+    """put back the original files of a revlog whose swap was interrupted
+    and remove the temporary files of an interrupted redelta
+
+    vfs is the opener of the store. Returns True if there was anything to
+    undo or remove."""
+    found = False
+    if vfs.exists(swapfile):
+        found = True
+        ui.warn(_('restoring revlog files of an interrupted redelta\n'))
+        for line in vfs.read(swapfile).splitlines():
+            old, new, backup = line.split('\0')
+            if not backup:
+                # the revlog had no such file
+                _unlinkmissing(vfs.join(old))
+            elif vfs.exists(backup):
+                vfs.rename(backup, old)
+            _unlinkmissing(vfs.join(new))
+        util.unlink(vfs.join(swapfile))
+    if vfs.isdir(tmpdir):
+        if not found:
+            ui.warn(_('removing temporary files of an interrupted '
+                      'redelta\n'))
+            found = True
+        shutil.rmtree(vfs.join(tmpdir))
+    return found
+
+def _unlinkmissing(path):
+    try:
+        util.unlink(path)
+    except OSError, inst:
+        if inst.errno != errno.ENOENT:
+            raise
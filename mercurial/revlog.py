@@ -15,6 +15,7 @@ and O(changes) merge between branches.
 from node import bin, hex, nullid, nullrev
 from i18n import _
 import ancestor, mdiff, parsers, error, util, dagutil
+import nodemap as nodemaputil
 import struct, zlib, errno
 
 _pack = struct.pack
@@ -39,6 +40,10 @@ REVIDX_KNOWN_FLAGS = 0
 # max size of revlog with inline data
 _maxinline = 131072
 _chunksize = 1048576
+# max distance between chunks read at once
+_maxchunkgap = 65536
+# max number of fulltexts kept by the revision cache
+_maxcachedtexts = 1000
 
 RevlogError = error.RevlogError
 LookupError = error.LookupError
@@ -164,6 +169,41 @@ class revlogio(object):
             p = _pack(versionformat, version) + p[4:]
         return p
 
+def truncationpoint(data, maxlinkrev):
+    """return the sizes of the index and data files of a revlog ending
+    with its last revision linked to a changeset up to maxlinkrev
+
+    data is the content of the index file, which may have been read
+    while revisions were appended to it. The data size is None for
+    inline revlogs. Returns None for revlogs of the old format.
+    """
+    if len(data) < 4:
+        return 0, 0
+    v = _unpack(versionformat, data[:4])[0]
+    if v & 0xFFFF != REVLOGNG:
+        return None
+    inline = v & REVLOGNGINLINEDATA
+    s = struct.calcsize(indexformatng)
+    l = len(data)
+    off = isize = dsize = 0
+    rev = 0
+    while off + s <= l:
+        e = _unpack(indexformatng, data[off:off + s])
+        off += s
+        if inline:
+            off += e[1]
+            if off > l:
+                # revision being written
+                break
+        if e[4] <= maxlinkrev:
+            isize = off
+            # the offset of the first revision holds the version
+            dsize = (rev and getoffset(e[0])) + e[1]
+        rev += 1
+    if inline:
+        dsize = None
+    return isize, dsize
+
 class revlog(object):
     """
     the underlying revision storage object
@@ -189,12 +229,15 @@ class revlog(object):
     remove data, and can use some simple techniques to avoid the need
     for locking while reading.
     """
-    def __init__(self, opener, indexfile):
+    def __init__(self, opener, indexfile, persistentnodemap=False):
         """
         create a revlog object
 
         opener is a function that abstracts the file opening operation
         and can be used to implement COW semantics or the like.
+
+        persistentnodemap allows the nodemap of the revlog to be kept on
+        disk when the persistentnodemap option of the opener is set.
         """
         self.indexfile = indexfile
         self.datafile = indexfile[:-2] + ".d"
@@ -206,6 +249,17 @@ class revlog(object):
         self._pcache = {}
         self._nodecache = {nullid: nullrev}
         self._nodepos = None
+        self._pnodemap = None
+        self._mmapthreshold = None
+        self._datamap = None
+        self._textcache = None
+        self._maxchainlen = None
+        self._maxchainspan = None
+        # use the base of deltas given to _addrevision when possible
+        self._lazydeltabase = False
+        # revision() calls answered from a cached text, starting their
+        # delta chain from one, or reading the whole chain
+        self.cachestats = {'hit': 0, 'partial': 0, 'miss': 0}
 
         v = REVLOG_DEFAULT_VERSION
         opts = getattr(opener, 'options', None)
@@ -215,12 +269,29 @@ class revlog(object):
                     v |= REVLOGGENERALDELTA
             else:
                 v = 0
+            if not opts.get('persistentnodemap'):
+                persistentnodemap = False
+            self._mmapthreshold = opts.get('mmapthreshold')
+            self._maxchainlen = opts.get('maxchainlen')
+            self._maxchainspan = opts.get('maxchainspan')
+            cachesize = opts.get('revisioncachesize')
+            if cachesize:
+                self._textcache = util.lrucachedict(_maxcachedtexts,
+                                                    maxcost=cachesize)
+        else:
+            persistentnodemap = False
 
         i = ''
         self._initempty = True
         try:
             f = self.opener(self.indexfile)
-            i = f.read()
+            if (self._mmapthreshold is not None and
+                util.fstat(f).st_size >= self._mmapthreshold):
+                # the parsers work on buffers over the mapped file, pages
+                # are shared with other processes reading the same revlog
+                i = util.buffer(util.mmapread(f))
+            else:
+                i = f.read()
             f.close()
             if len(i) > 0:
                 v = struct.unpack(versionformat, i[:4])[0]
@@ -254,6 +325,11 @@ class revlog(object):
         self.index, nodemap, self._chunkcache = d
         if nodemap is not None:
             self.nodemap = self._nodecache = nodemap
+        if persistentnodemap and self.version != REVLOGV0:
+            self._pnodemap = nodemaputil.nodemap(self.opener,
+                                                 self.indexfile[:-2] + ".n",
+                                                 self.index)
+            self.nodemap = self._nodecache = self._pnodemap
         if not self._chunkcache:
             self._chunkclear()
 
@@ -287,6 +363,8 @@ class revlog(object):
             return False
 
     def clearcaches(self):
+        if self._textcache is not None:
+            self._textcache.clear()
         try:
             self._nodecache.clearcaches()
         except AttributeError:
@@ -337,6 +415,20 @@ class revlog(object):
             rev = base
             base = index[rev][3]
         return base
+    def chainlen(self, rev):
+        """number of deltas to apply to rebuild rev"""
+        index = self.index
+        generaldelta = self._generaldelta
+        clen = 0
+        base = index[rev][3]
+        while base != rev:
+            clen += 1
+            if generaldelta:
+                rev = base
+            else:
+                rev -= 1
+            base = index[rev][3]
+        return clen
     def flags(self, rev):
         return self.index[rev][0] & 0xFFFF
     def rawsize(self, rev):
@@ -751,9 +843,9 @@ class revlog(object):
 
     def _partialmatch(self, id):
         try:
-            return self.index.partialmatch(id)
+            return self._nodecache.partialmatch(id)
         except RevlogError:
-            # parsers.c radix tree lookup gave multiple matches
+            # parsers.c or persistent radix tree lookup gave multiple matches
             raise LookupError(id, self.indexfile, _("ambiguous identifier"))
         except (AttributeError, ValueError):
             # we are pure python, or key was too short to search radix tree
@@ -809,7 +901,37 @@ class revlog(object):
         else:
             self._chunkcache = offset, data
 
+    def _mapchunk(self, offset, length):
+        """return a buffer over the mapped data, or None
+
+        The data file (or index for inline revlogs) is mapped once it is
+        larger than the mmapthreshold option and mapped again when it
+        grows."""
+        m = self._datamap
+        if m is None or offset + length > len(m):
+            self._datamap = None
+            if self._inline:
+                df = self.opener(self.indexfile)
+            else:
+                df = self.opener(self.datafile)
+            try:
+                if not util.safehasattr(df, 'fileno'):
+                    # changelog updates delayed in memory
+                    return None
+                size = util.fstat(df).st_size
+                if size < max(self._mmapthreshold, offset + length, 1):
+                    return None
+                m = self._datamap = util.mmapread(df)
+            finally:
+                df.close()
+        return util.buffer(m, offset, length)
+
     def _loadchunk(self, offset, length):
+        if self._mmapthreshold is not None:
+            d = self._mapchunk(offset, length)
+            if d is not None:
+                return d
+
         if self._inline:
             df = self.opener(self.indexfile)
         else:
@@ -843,16 +965,82 @@ class revlog(object):
         length = self.end(endrev) - start
         if self._inline:
             start += (startrev + 1) * self._io.size
+            length += (endrev - startrev) * self._io.size
         return self._getchunk(start, length)
 
     def _chunk(self, rev):
         return decompress(self._chunkraw(rev, rev))
 
-    def _chunkbase(self, rev):
-        return self._chunk(rev)
+    def _slicechunk(self, revs, stored=None):
+        """split revs in runs of revisions whose chunks can be read at once
+
+        A run is interrupted when revisions stop increasing, when the gap
+        between two chunks is larger than _maxchunkgap or when the run
+        would span more than _chunksize bytes.
+
+        stored, if given, tells whether the chunk of a revision is in the
+        revlog files. The other revisions make runs of their own."""
+        start = self.start
+        end = self.end
+        run = []
+        runstart = 0
+        for rev in revs:
+            if stored is not None and not stored(rev):
+                if run:
+                    yield run
+                    run = []
+                yield [rev]
+                continue
+            if run:
+                last = run[-1]
+                if (rev <= last or start(rev) - end(last) > _maxchunkgap
+                    or end(rev) - runstart > _chunksize):
+                    yield run
+                    run = []
+            if not run:
+                runstart = start(rev)
+            run.append(rev)
+        if run:
+            yield run
+
+    def _prefetchchunks(self, revs):
+        """load the chunks of a run of revisions in the chunk cache"""
+        if len(revs) > 1:
+            self._chunkraw(revs[0], revs[-1])
+
+    def _chunks(self, revs):
+        """faster version of [self._chunk(rev) for rev in revs]
+
+        The chunks of revisions close to each other in the file are read
+        with a single call to _chunkraw."""
+        start = self.start
+        length = self.length
+        inline = self._inline
+        iosize = self._io.size
+        buffer = util.buffer
+
+        l = []
+        ladd = l.append
+        for run in self._slicechunk(revs):
+            first = run[0]
+            if len(run) == 1:
+                ladd(self._chunk(first))
+                continue
+            data = self._chunkraw(first, run[-1])
+            offset = start(first)
+            if inline:
+                offset += (first + 1) * iosize
+            for rev in run:
+                chunkstart = start(rev)
+                if inline:
+                    chunkstart += (rev + 1) * iosize
+                ladd(decompress(buffer(data, chunkstart - offset,
+                                       length(rev))))
+        return l
 
     def _chunkclear(self):
         self._chunkcache = (0, '')
+        self._datamap = None
 
     def deltaparent(self, rev):
         """return deltaparent of the given revision"""
@@ -888,6 +1076,7 @@ class revlog(object):
             return ""
         if self._cache:
             if self._cache[0] == node:
+                self.cachestats['hit'] += 1
                 return self._cache[2]
             cachedrev = self._cache[1]
 
@@ -896,44 +1085,62 @@ class revlog(object):
         if rev is None:
             rev = self.rev(node)
 
+        textcache = self._textcache
+        if textcache is not None:
+            text = textcache.get(rev)
+            if text is not None:
+                self.cachestats['hit'] += 1
+                self._cache = (node, rev, text)
+                return text
+
         # check rev flags
         if self.flags(rev) & ~REVIDX_KNOWN_FLAGS:
             raise RevlogError(_('incompatible revision flag %x') %
                               (self.flags(rev) & ~REVIDX_KNOWN_FLAGS))
 
-        # build delta chain
+        # build delta chain, stopping at the first revision whose text
+        # is cached
         chain = []
         index = self.index # for performance
         generaldelta = self._generaldelta
         iterrev = rev
         e = index[iterrev]
-        while iterrev != e[3] and iterrev != cachedrev:
+        while True:
+            if iterrev == cachedrev:
+                text = self._cache[2]
+                break
+            if textcache is not None and iterrev in textcache:
+                text = textcache[iterrev]
+                break
             chain.append(iterrev)
+            if iterrev == e[3]:
+                break
             if generaldelta:
                 iterrev = e[3]
             else:
                 iterrev -= 1
             e = index[iterrev]
         chain.reverse()
-        base = iterrev
-
-        if iterrev == cachedrev:
-            # cache hit
-            text = self._cache[2]
+        if text is None:
+            self.cachestats['miss'] += 1
+        else:
+            self.cachestats['partial'] += 1
 
         # drop cache to save memory
         self._cache = None
 
-        self._chunkraw(base, rev)
+        bins = self._chunks(chain)
         if text is None:
-            text = str(self._chunkbase(base))
+            text = str(bins[0])
+            bins = bins[1:]
 
-        bins = [self._chunk(r) for r in chain]
         text = mdiff.patches(text, bins)
 
         text = self._checkhash(text, node, rev)
 
         self._cache = (node, rev, text)
+        if textcache is not None:
+            textcache.insert(rev, text, len(text))
         return text
 
     def _checkhash(self, text, node, rev):
@@ -1000,13 +1207,17 @@ class revlog(object):
             dfh = self.opener(self.datafile, "a")
         ifh = self.opener(self.indexfile, "a+")
         try:
-            return self._addrevision(node, text, transaction, link, p1, p2,
+            node = self._addrevision(node, text, transaction, link, p1, p2,
                                      cachedelta, ifh, dfh)
         finally:
             if dfh:
                 dfh.close()
             ifh.close()
 
+        if self._pnodemap is not None:
+            self._pnodemap.write(transaction)
+        return node
+
     def compress(self, text):
         """ generate a possibly-compressed representation of text """
         if not text:
@@ -1079,7 +1290,10 @@ class revlog(object):
                 base = rev
             else:
                 base = chainbase
-            return dist, l, data, base, chainbase
+            chainlen = None
+            if self._maxchainlen:
+                chainlen = self.chainlen(rev) + 1
+            return dist, l, data, base, chainbase, chainlen
 
         curr = len(self)
         prev = curr - 1
@@ -1093,7 +1307,9 @@ class revlog(object):
         # should we try to build a delta?
         if prev != nullrev:
             if self._generaldelta:
-                if p1r >= basecache[1]:
+                if self._lazydeltabase and cachedelta:
+                    d = builddelta(cachedelta[0])
+                elif p1r >= basecache[1]:
                     d = builddelta(p1r)
                 elif p2r >= basecache[1]:
                     d = builddelta(p2r)
@@ -1101,16 +1317,19 @@ class revlog(object):
                     d = builddelta(prev)
             else:
                 d = builddelta(prev)
-            dist, l, data, base, chainbase = d
+            dist, l, data, base, chainbase, chainlen = d
 
         # full versions are inserted when the needed deltas
-        # become comparable to the uncompressed text
+        # become comparable to the uncompressed text, or when the
+        # delta chain gets longer or spans more data than allowed
         if text is None:
             textlen = mdiff.patchedsize(self.rawsize(cachedelta[0]),
                                         cachedelta[1])
         else:
             textlen = len(text)
-        if d is None or dist > textlen * 2:
+        if (d is None or dist > textlen * 2 or
+            (self._maxchainspan and dist > self._maxchainspan) or
+            (self._maxchainlen and chainlen > self._maxchainlen)):
             text = buildtext()
             data = self.compress(text)
             l = len(data[1]) + len(data[0])
@@ -1140,6 +1359,8 @@ class revlog(object):
 
         if type(text) == str: # only accept immutable objects
             self._cache = (node, curr, text)
+            if self._textcache is not None:
+                self._textcache.insert(curr, text, len(text))
         self._basecache = (curr, chainbase)
         return node
 
@@ -1173,11 +1394,16 @@ class revlog(object):
         p = self.parentrevs(revs[0])[0]
         revs.insert(0, p)
 
-        # build deltas
-        for r in xrange(len(revs) - 1):
-            prev, curr = revs[r], revs[r + 1]
-            for c in bundler.revchunk(self, curr, prev):
-                yield c
+        # build deltas, the chunks of each run of revisions are loaded in
+        # the chunk cache at once before computing them
+        r = 0
+        for run in self._slicechunk(revs[1:]):
+            self._prefetchchunks(run)
+            for curr in run:
+                prev = revs[r]
+                for c in bundler.revchunk(self, curr, prev):
+                    yield c
+                r += 1
 
         yield bundler.close()
 
@@ -1253,6 +1479,8 @@ class revlog(object):
                 dfh.close()
             ifh.close()
 
+        if self._pnodemap is not None:
+            self._pnodemap.write(transaction)
         return content
 
     def strip(self, minlink, transaction):
@@ -1287,9 +1515,14 @@ class revlog(object):
             end += rev * self._io.size
 
         transaction.add(self.indexfile, end)
+        if self._pnodemap is not None:
+            # the persistent nodemap is rebuilt by the next write
+            transaction.add(self._pnodemap.filename, 0)
 
         # then reset internal state in memory to forget those revisions
         self._cache = None
+        if self._textcache is not None:
+            self._textcache.clear()
         self._chunkclear()
         for x in xrange(rev, len(self)):
             del self.nodemap[self.node(x)]
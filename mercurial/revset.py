@@ -5,7 +5,7 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2 or any later version.
 
-import re
+import re, heapq
 import parser, util, error, discovery, hbisect, phases
 import node
 import match as matchmod
@@ -13,19 +13,26 @@ from i18n import _
 import encoding
 import obsolete as obsmod
 import repoview
+import changesetcache as csetcachemod
 
 def _revancestors(repo, revs, followfirst):
-    """Like revlog.ancestors(), but supports followfirst."""
+    """Like revlog.ancestors(), but supports followfirst.
+
+    The revisions of revs are included and everything is yielded in
+    descending order, so that callers can stop early."""
     cut = followfirst and 1 or None
     cl = repo.changelog
-    visit = util.deque(revs)
-    seen = set([node.nullrev])
-    while visit:
-        for parent in cl.parentrevs(visit.popleft())[:cut]:
-            if parent not in seen:
-                visit.append(parent)
-                seen.add(parent)
-                yield parent
+    h = [-r for r in revs]
+    heapq.heapify(h)
+    seen = set()
+    while h:
+        current = -heapq.heappop(h)
+        if current not in seen:
+            seen.add(current)
+            yield current
+            for parent in cl.parentrevs(current)[:cut]:
+                if parent != node.nullrev:
+                    heapq.heappush(h, -parent)
 
 def _revdescendants(repo, revs, followfirst):
     """Like revlog.descendants() but supports followfirst."""
@@ -54,7 +61,7 @@ def _revsbetween(repo, roots, heads):
     if not roots:
         return []
     parentrevs = repo.changelog.parentrevs
-    visit = heads[:]
+    visit = list(heads)
     reachable = set()
     seen = {}
     minroot = min(roots)
@@ -194,7 +201,10 @@ def getargs(x, min, max, err):
 def getset(repo, subset, x):
     if not x:
         raise error.ParseError(_("missing argument"))
-    return methods[x[0]](repo, subset, *x[1:])
+    s = methods[x[0]](repo, subset, *x[1:])
+    if util.safehasattr(s, 'set'):
+        return s
+    return baseset(s)
 
 def _getrevsource(repo, r):
     extra = repo[r].extra()
@@ -206,15 +216,46 @@ def _getrevsource(repo, r):
                 pass
     return None
 
+# subsets smaller than the repository divided by this are filtered by
+# reading their changesets rather than by building the changeset cache
+_cachebuildratio = 10
+
+def _changesetcache(repo, subset):
+    """return the changeset cache of repo, or None if reading the
+    changesets of subset is cheaper
+
+    Building the cache reads the whole changelog, which is not worth it
+    for small subsets when it is neither loaded nor on disk already."""
+    if (not csetcachemod.available(repo)
+        and isinstance(subset, (baseset, spanset))
+        and len(subset) * _cachebuildratio < len(repo)):
+        return None
+    return repo.changesetcache()
+
+def _cachedfilter(repo, subset, condition, cached):
+    """lazyset of the revisions of subset for which condition is true
+
+    cached is called with the changeset cache and returns a faster
+    version of condition reading it. condition is still used for nullrev,
+    which the cache does not hold, and when _changesetcache() returns
+    None."""
+    cache = _changesetcache(repo, subset)
+    if cache is None:
+        return lazyset(subset, condition)
+    fast = cached(cache)
+    def check(r):
+        if r == node.nullrev:
+            return condition(r)
+        return fast(r)
+    return lazyset(subset, check)
+
 # operator methods
 
 def stringset(repo, subset, x):
     x = repo[x].rev()
-    if x == -1 and len(subset) == len(repo):
-        return [-1]
-    if len(subset) == len(repo) or x in subset:
-        return [x]
-    return []
+    if x in subset or len(subset) == len(repo):
+        return baseset([x])
+    return baseset([])
 
 def symbolset(repo, subset, x):
     if x in symbols:
@@ -227,34 +268,31 @@ def rangeset(repo, subset, x, y):
     n = getset(repo, cl, y)
 
     if not m or not n:
-        return []
+        return baseset([])
     m, n = m[0], n[-1]
 
     if m < n:
-        r = range(m, n + 1)
+        r = spanset(repo, m, n + 1)
     else:
-        r = range(m, n - 1, -1)
-    s = set(subset)
-    return [x for x in r if x in s]
+        r = spanset(repo, m, n - 1)
+    return r & subset
 
 def dagrange(repo, subset, x, y):
-    r = list(repo)
+    r = spanset(repo)
     xs = _revsbetween(repo, getset(repo, r, x), getset(repo, r, y))
-    s = set(subset)
-    return [r for r in xs if r in s]
+    return baseset(xs) & subset
 
 def andset(repo, subset, x, y):
     return getset(repo, getset(repo, subset, x), y)
 
 def orset(repo, subset, x, y):
     xl = getset(repo, subset, x)
-    s = set(xl)
-    yl = getset(repo, [r for r in subset if r not in s], y)
-    return xl + yl
+    yl = getset(repo, lazyset(subset, lambda r: r not in xl), y)
+    return addset(xl, yl)
 
 def notset(repo, subset, x):
-    s = set(getset(repo, subset, x))
-    return [r for r in subset if r not in s]
+    s = getset(repo, subset, x)
+    return lazyset(subset, lambda r: r not in s)
 
 def listset(repo, subset, a, b):
     raise error.ParseError(_("can't use a list in this context"))
@@ -284,7 +322,7 @@ def ancestor(repo, subset, x):
     """
     # i18n: "ancestor" is a keyword
     l = getlist(x)
-    rl = list(repo)
+    rl = spanset(repo)
     anc = None
 
     # (getset(repo, rl, i) for i in l) generates a list of lists
@@ -299,15 +337,15 @@ def ancestor(repo, subset, x):
                 anc = rev(ancestor(node(anc), node(r)))
 
     if anc is not None and anc in subset:
-        return [anc]
-    return []
+        return baseset([anc])
+    return baseset([])
 
 def _ancestors(repo, subset, x, followfirst=False):
-    args = getset(repo, list(repo), x)
+    args = getset(repo, spanset(repo), x)
     if not args:
-        return []
-    s = set(_revancestors(repo, args, followfirst)) | set(args)
-    return [r for r in subset if r in s]
+        return baseset([])
+    s = generatorset(_revancestors(repo, args, followfirst), ascending=False)
+    return lazyset(subset, s.__contains__)
 
 def ancestors(repo, subset, x):
     """``ancestors(set)``
@@ -335,7 +373,7 @@ def ancestorspec(repo, subset, x, n):
         for i in range(n):
             r = cl.parentrevs(r)[0]
         ps.add(r)
-    return [r for r in subset if r in ps]
+    return lazyset(subset, lambda r: r in ps)
 
 def author(repo, subset, x):
     """``author(string)``
@@ -344,7 +382,13 @@ def author(repo, subset, x):
     # i18n: "author" is a keyword
     n = encoding.lower(getstring(x, _("author requires a string")))
     kind, pattern, matcher = _substringmatcher(n)
-    return [r for r in subset if matcher(encoding.lower(repo[r].user()))]
+    def cached(cache):
+        ids = cache.matchingstrings(lambda u: matcher(encoding.lower(u)))
+        users = cache.user
+        return lambda r: users[r] in ids
+    return _cachedfilter(repo, subset,
+                         lambda r: matcher(encoding.lower(repo[r].user())),
+                         cached)
 
 def bisect(repo, subset, x):
     """``bisect(string)``
@@ -361,7 +405,7 @@ def bisect(repo, subset, x):
     # i18n: "bisect" is a keyword
     status = getstring(x, _("bisect requires a string")).lower()
     state = set(hbisect.get(repo, status))
-    return [r for r in subset if r in state]
+    return lazyset(subset, lambda r: r in state)
 
 # Backward-compatibility
 # - no help entry so that we do not advertise it any more
@@ -388,7 +432,7 @@ def bookmark(repo, subset, x):
             if not bmrev:
                 raise util.Abort(_("bookmark '%s' does not exist") % bm)
             bmrev = repo[bmrev].rev()
-            return [r for r in subset if r == bmrev]
+            return lazyset(subset, lambda r: r == bmrev)
         else:
             matchrevs = set()
             for name, bmrev in repo._bookmarks.iteritems():
@@ -400,11 +444,11 @@ def bookmark(repo, subset, x):
             bmrevs = set()
             for bmrev in matchrevs:
                 bmrevs.add(repo[bmrev].rev())
-            return [r for r in subset if r in bmrevs]
+            return lazyset(subset, lambda r: r in bmrevs)
 
     bms = set([repo[r].rev()
                for r in repo._bookmarks.values()])
-    return [r for r in subset if r in bms]
+    return lazyset(subset, lambda r: r in bms)
 
 def branch(repo, subset, x):
     """``branch(string or set)``
@@ -422,20 +466,38 @@ def branch(repo, subset, x):
         pass
     else:
         kind, pattern, matcher = _stringmatcher(b)
-        if kind == 'literal':
-            # note: falls through to the revspec case if no branch with
-            # this name exists
-            if pattern in repo.branchmap():
-                return [r for r in subset if matcher(repo[r].branch())]
-        else:
-            return [r for r in subset if matcher(repo[r].branch())]
-
-    s = getset(repo, list(repo), x)
+        # note: a literal falls through to the revspec case if no branch
+        # with this name exists
+        if kind != 'literal' or pattern in repo.branchmap():
+            def cached(cache):
+                ids = cache.matchingstrings(matcher)
+                branches = cache.branch
+                return lambda r: branches[r] in ids
+            return _cachedfilter(repo, subset,
+                                 lambda r: matcher(repo[r].branch()), cached)
+
+    s = getset(repo, spanset(repo), x)
     b = set()
-    for r in s:
-        b.add(repo[r].branch())
+    cache = _changesetcache(repo, s)
+    if cache is None:
+        for r in s:
+            b.add(repo[r].branch())
+    else:
+        strings, branches = cache.strings, cache.branch
+        ids = set()
+        for r in s:
+            if r == node.nullrev:
+                b.add(repo[r].branch())
+            else:
+                ids.add(branches[r])
+        b.update(encoding.tolocal(strings[i]) for i in ids)
     s = set(s)
-    return [r for r in subset if r in s or repo[r].branch() in b]
+    def cached(cache):
+        ids = cache.matchingstrings(lambda n: n in b)
+        branches = cache.branch
+        return lambda r: r in s or branches[r] in ids
+    return _cachedfilter(repo, subset,
+                         lambda r: r in s or repo[r].branch() in b, cached)
 
 def bumped(repo, subset, x):
     """``bumped()``
@@ -446,7 +508,7 @@ def bumped(repo, subset, x):
     # i18n: "bumped" is a keyword
     getargs(x, 0, 0, _("bumped takes no arguments"))
     bumped = obsmod.getrevs(repo, 'bumped')
-    return [r for r in subset if r in bumped]
+    return lazyset(subset, lambda r: r in bumped)
 
 def bundle(repo, subset, x):
     """``bundle()``
@@ -458,7 +520,7 @@ def bundle(repo, subset, x):
         bundlerevs = repo.changelog.bundlerevs
     except AttributeError:
         raise util.Abort(_("no bundle provided - specify with -R"))
-    return [r for r in subset if r in bundlerevs]
+    return lazyset(subset, lambda r: r in bundlerevs)
 
 def checkstatus(repo, subset, pat, field):
     m = None
@@ -509,9 +571,9 @@ def children(repo, subset, x):
     """``children(set)``
     Child changesets of changesets in set.
     """
-    s = set(getset(repo, list(repo), x))
+    s = set(getset(repo, spanset(repo), x))
     cs = _children(repo, subset, s)
-    return [r for r in subset if r in cs]
+    return lazyset(subset, lambda r: r in cs)
 
 def closed(repo, subset, x):
     """``closed()``
@@ -519,7 +581,11 @@ def closed(repo, subset, x):
     """
     # i18n: "closed" is a keyword
     getargs(x, 0, 0, _("closed takes no arguments"))
-    return [r for r in subset if repo[r].closesbranch()]
+    def cached(cache):
+        flags = cache.flags
+        return lambda r: flags[r] & csetcachemod.CLOSED
+    return _cachedfilter(repo, subset, lambda r: repo[r].closesbranch(),
+                         cached)
 
 def contains(repo, subset, x):
     """``contains(pattern)``
@@ -565,7 +631,7 @@ def converted(repo, subset, x):
         source = repo[r].extra().get('convert_revision', None)
         return source is not None and (rev is None or source.startswith(rev))
 
-    return [r for r in subset if _matchvalue(r)]
+    return lazyset(subset, lambda r: _matchvalue(r))
 
 def date(repo, subset, x):
     """``date(interval)``
@@ -574,7 +640,11 @@ def date(repo, subset, x):
     # i18n: "date" is a keyword
     ds = getstring(x, _("date requires a string"))
     dm = util.matchdate(ds)
-    return [r for r in subset if dm(repo[r].date()[0])]
+    def cached(cache):
+        dates = cache.date
+        return lambda r: dm(dates[r])
+    return _cachedfilter(repo, subset, lambda r: dm(repo[r].date()[0]),
+                         cached)
 
 def desc(repo, subset, x):
     """``desc(string)``
@@ -582,19 +652,15 @@ def desc(repo, subset, x):
     """
     # i18n: "desc" is a keyword
     ds = encoding.lower(getstring(x, _("desc requires a string")))
-    l = []
-    for r in subset:
-        c = repo[r]
-        if ds in encoding.lower(c.description()):
-            l.append(r)
-    return l
+    return lazyset(subset,
+                   lambda r: ds in encoding.lower(repo[r].description()))
 
 def _descendants(repo, subset, x, followfirst=False):
-    args = getset(repo, list(repo), x)
+    args = getset(repo, spanset(repo), x)
     if not args:
-        return []
-    s = set(_revdescendants(repo, args, followfirst)) | set(args)
-    return [r for r in subset if r in s]
+        return baseset([])
+    s = generatorset(_revdescendants(repo, args, followfirst), ascending=True)
+    return lazyset(subset, lambda r: r in s or r in args)
 
 def descendants(repo, subset, x):
     """``descendants(set)``
@@ -614,9 +680,9 @@ def destination(repo, subset, x):
     is the same as passing all().
     """
     if x is not None:
-        args = set(getset(repo, list(repo), x))
+        args = set(getset(repo, spanset(repo), x))
     else:
-        args = set(getall(repo, list(repo), x))
+        args = set(getall(repo, spanset(repo), x))
 
     dests = set()
 
@@ -649,7 +715,7 @@ def destination(repo, subset, x):
             r = src
             src = _getrevsource(repo, r)
 
-    return [r for r in subset if r in dests]
+    return lazyset(subset, lambda r: r in dests)
 
 def divergent(repo, subset, x):
     """``divergent()``
@@ -658,7 +724,7 @@ def divergent(repo, subset, x):
     # i18n: "divergent" is a keyword
     getargs(x, 0, 0, _("divergent takes no arguments"))
     divergent = obsmod.getrevs(repo, 'divergent')
-    return [r for r in subset if r in divergent]
+    return lazyset(subset, lambda r: r in divergent)
 
 def draft(repo, subset, x):
     """``draft()``
@@ -666,7 +732,7 @@ def draft(repo, subset, x):
     # i18n: "draft" is a keyword
     getargs(x, 0, 0, _("draft takes no arguments"))
     pc = repo._phasecache
-    return [r for r in subset if pc.phase(repo, r) == phases.draft]
+    return lazyset(subset, lambda r: pc.phase(repo, r) == phases.draft)
 
 def extinct(repo, subset, x):
     """``extinct()``
@@ -675,7 +741,7 @@ def extinct(repo, subset, x):
     # i18n: "extinct" is a keyword
     getargs(x, 0, 0, _("extinct takes no arguments"))
     extincts = obsmod.getrevs(repo, 'extinct')
-    return [r for r in subset if r in extincts]
+    return lazyset(subset, lambda r: r in extincts)
 
 def extra(repo, subset, x):
     """``extra(label, [value])``
@@ -702,7 +768,7 @@ def extra(repo, subset, x):
         extra = repo[r].extra()
         return label in extra and (value is None or matcher(extra[label]))
 
-    return [r for r in subset if _matchvalue(r)]
+    return lazyset(subset, lambda r: _matchvalue(r))
 
 def filelog(repo, subset, x):
     """``filelog(pattern)``
@@ -731,7 +797,7 @@ def filelog(repo, subset, x):
                 for fr in fl:
                     s.add(fl.linkrev(fr))
 
-    return [r for r in subset if r in s]
+    return lazyset(subset, lambda r: r in s)
 
 def first(repo, subset, x):
     """``first(set, [n])``
@@ -750,11 +816,11 @@ def _follow(repo, subset, x, name, followfirst=False):
             # include the revision responsible for the most recent version
             s.add(cx.linkrev())
         else:
-            return []
+            return baseset([])
     else:
-        s = set(_revancestors(repo, [c.rev()], followfirst)) | set([c.rev()])
+        s = set(_revancestors(repo, [c.rev()], followfirst))
 
-    return [r for r in subset if r in s]
+    return lazyset(subset, lambda r: r in s)
 
 def follow(repo, subset, x):
     """``follow([file])``
@@ -776,7 +842,7 @@ def getall(repo, subset, x):
     """
     # i18n: "all" is a keyword
     getargs(x, 0, 0, _("all takes no arguments"))
-    return subset
+    return lazyset(subset)
 
 def grep(repo, subset, x):
     """``grep(regex)``
@@ -789,14 +855,15 @@ def grep(repo, subset, x):
         gr = re.compile(getstring(x, _("grep requires a string")))
     except re.error, e:
         raise error.ParseError(_('invalid match pattern: %s') % e)
-    l = []
-    for r in subset:
+
+    def matches(r):
         c = repo[r]
         for e in c.files() + [c.user(), c.description()]:
             if gr.search(e):
-                l.append(r)
-                break
-    return l
+                return True
+        return False
+
+    return lazyset(subset, matches)
 
 def _matchfiles(repo, subset, x):
     # _matchfiles takes a revset list of prefixed arguments:
@@ -881,7 +948,7 @@ def head(repo, subset, x):
     hs = set()
     for b, ls in repo.branchmap().iteritems():
         hs.update(repo[h].rev() for h in ls)
-    return [r for r in subset if r in hs]
+    return lazyset(subset, lambda r: r in hs)
 
 def heads(repo, subset, x):
     """``heads(set)``
@@ -889,7 +956,7 @@ def heads(repo, subset, x):
     """
     s = getset(repo, subset, x)
     ps = set(parents(repo, subset, x))
-    return [r for r in s if r not in ps]
+    return lazyset(s, lambda r: r not in ps)
 
 def hidden(repo, subset, x):
     """``hidden()``
@@ -898,7 +965,7 @@ def hidden(repo, subset, x):
     # i18n: "hidden" is a keyword
     getargs(x, 0, 0, _("hidden takes no arguments"))
     hiddenrevs = repoview.filterrevs(repo, 'visible')
-    return [r for r in subset if r in hiddenrevs]
+    return lazyset(subset, lambda r: r in hiddenrevs)
 
 def keyword(repo, subset, x):
     """``keyword(string)``
@@ -907,13 +974,19 @@ def keyword(repo, subset, x):
     """
     # i18n: "keyword" is a keyword
     kw = encoding.lower(getstring(x, _("keyword requires a string")))
-    l = []
-    for r in subset:
+
+    def matches(r):
         c = repo[r]
         t = " ".join(c.files() + [c.user(), c.description()])
-        if kw in encoding.lower(t):
-            l.append(r)
-    return l
+        return kw in encoding.lower(t)
+
+    def cached(cache):
+        ids = cache.matchingstrings(lambda u: kw in encoding.lower(u))
+        users = cache.user
+        # no need to read the changeset when the user matches
+        return lambda r: users[r] in ids or matches(r)
+
+    return _cachedfilter(repo, subset, matches, cached)
 
 def limit(repo, subset, x):
     """``limit(set, [n])``
@@ -929,9 +1002,16 @@ def limit(repo, subset, x):
     except (TypeError, ValueError):
         # i18n: "limit" is a keyword
         raise error.ParseError(_("limit expects a number"))
-    ss = set(subset)
-    os = getset(repo, list(repo), l[0])[:lim]
-    return [r for r in os if r in ss]
+    result = []
+    it = iter(getset(repo, spanset(repo), l[0]))
+    for i in xrange(lim):
+        try:
+            y = it.next()
+        except StopIteration:
+            break
+        if y in subset:
+            result.append(y)
+    return baseset(result)
 
 def last(repo, subset, x):
     """``last(set, [n])``
@@ -947,20 +1027,30 @@ def last(repo, subset, x):
     except (TypeError, ValueError):
         # i18n: "last" is a keyword
         raise error.ParseError(_("last expects a number"))
-    ss = set(subset)
-    os = getset(repo, list(repo), l[0])[-lim:]
-    return [r for r in os if r in ss]
+    os = getset(repo, spanset(repo), l[0])
+    os.reverse()
+    result = []
+    it = iter(os)
+    for i in xrange(lim):
+        try:
+            y = it.next()
+        except StopIteration:
+            break
+        if y in subset:
+            result.append(y)
+    result.reverse()
+    return baseset(result)
 
 def maxrev(repo, subset, x):
     """``max(set)``
     Changeset with highest revision number in set.
     """
-    os = getset(repo, list(repo), x)
+    os = getset(repo, spanset(repo), x)
     if os:
-        m = max(os)
+        m = os.max()
         if m in subset:
-            return [m]
-    return []
+            return baseset([m])
+    return baseset([])
 
 def merge(repo, subset, x):
     """``merge()``
@@ -969,7 +1059,7 @@ def merge(repo, subset, x):
     # i18n: "merge" is a keyword
     getargs(x, 0, 0, _("merge takes no arguments"))
     cl = repo.changelog
-    return [r for r in subset if cl.parentrevs(r)[1] != -1]
+    return lazyset(subset, lambda r: cl.parentrevs(r)[1] != -1)
 
 def branchpoint(repo, subset, x):
     """``branchpoint()``
@@ -979,25 +1069,25 @@ def branchpoint(repo, subset, x):
     getargs(x, 0, 0, _("branchpoint takes no arguments"))
     cl = repo.changelog
     if not subset:
-        return []
+        return baseset([])
     baserev = min(subset)
     parentscount = [0]*(len(repo) - baserev)
     for r in cl.revs(start=baserev + 1):
         for p in cl.parentrevs(r):
             if p >= baserev:
                 parentscount[p - baserev] += 1
-    return [r for r in subset if (parentscount[r - baserev] > 1)]
+    return lazyset(subset, lambda r: parentscount[r - baserev] > 1)
 
 def minrev(repo, subset, x):
     """``min(set)``
     Changeset with lowest revision number in set.
     """
-    os = getset(repo, list(repo), x)
+    os = getset(repo, spanset(repo), x)
     if os:
-        m = min(os)
+        m = os.min()
         if m in subset:
-            return [m]
-    return []
+            return baseset([m])
+    return baseset([])
 
 def modifies(repo, subset, x):
     """``modifies(pattern)``
@@ -1023,7 +1113,7 @@ def node_(repo, subset, x):
         if pm is not None:
             rn = repo.changelog.rev(pm)
 
-    return [r for r in subset if r == rn]
+    return lazyset(subset, lambda r: r == rn)
 
 def obsolete(repo, subset, x):
     """``obsolete()``
@@ -1031,7 +1121,7 @@ def obsolete(repo, subset, x):
     # i18n: "obsolete" is a keyword
     getargs(x, 0, 0, _("obsolete takes no arguments"))
     obsoletes = obsmod.getrevs(repo, 'obsolete')
-    return [r for r in subset if r in obsoletes]
+    return lazyset(subset, lambda r: r in obsoletes)
 
 def origin(repo, subset, x):
     """``origin([set])``
@@ -1042,9 +1132,9 @@ def origin(repo, subset, x):
     for the first operation is selected.
     """
     if x is not None:
-        args = set(getset(repo, list(repo), x))
+        args = set(getset(repo, spanset(repo), x))
     else:
-        args = set(getall(repo, list(repo), x))
+        args = set(getall(repo, spanset(repo), x))
 
     def _firstsrc(rev):
         src = _getrevsource(repo, rev)
@@ -1059,7 +1149,7 @@ def origin(repo, subset, x):
             src = prev
 
     o = set([_firstsrc(r) for r in args])
-    return [r for r in subset if r in o]
+    return lazyset(subset, lambda r: r in o)
 
 def outgoing(repo, subset, x):
     """``outgoing([path])``
@@ -1082,7 +1172,7 @@ def outgoing(repo, subset, x):
     repo.ui.popbuffer()
     cl = repo.changelog
     o = set([cl.rev(r) for r in outgoing.missing])
-    return [r for r in subset if r in o]
+    return lazyset(subset, lambda r: r in o)
 
 def p1(repo, subset, x):
     """``p1([set])``
@@ -1090,13 +1180,13 @@ def p1(repo, subset, x):
     """
     if x is None:
         p = repo[x].p1().rev()
-        return [r for r in subset if r == p]
+        return lazyset(subset, lambda r: r == p)
 
     ps = set()
     cl = repo.changelog
-    for r in getset(repo, list(repo), x):
+    for r in getset(repo, spanset(repo), x):
         ps.add(cl.parentrevs(r)[0])
-    return [r for r in subset if r in ps]
+    return lazyset(subset, lambda r: r in ps)
 
 def p2(repo, subset, x):
     """``p2([set])``
@@ -1106,15 +1196,15 @@ def p2(repo, subset, x):
         ps = repo[x].parents()
         try:
             p = ps[1].rev()
-            return [r for r in subset if r == p]
+            return lazyset(subset, lambda r: r == p)
         except IndexError:
-            return []
+            return baseset([])
 
     ps = set()
     cl = repo.changelog
-    for r in getset(repo, list(repo), x):
+    for r in getset(repo, spanset(repo), x):
         ps.add(cl.parentrevs(r)[1])
-    return [r for r in subset if r in ps]
+    return lazyset(subset, lambda r: r in ps)
 
 def parents(repo, subset, x):
     """``parents([set])``
@@ -1122,13 +1212,13 @@ def parents(repo, subset, x):
     """
     if x is None:
         ps = tuple(p.rev() for p in repo[x].parents())
-        return [r for r in subset if r in ps]
+        return lazyset(subset, lambda r: r in ps)
 
     ps = set()
     cl = repo.changelog
-    for r in getset(repo, list(repo), x):
+    for r in getset(repo, spanset(repo), x):
         ps.update(cl.parentrevs(r))
-    return [r for r in subset if r in ps]
+    return lazyset(subset, lambda r: r in ps)
 
 def parentspec(repo, subset, x, n):
     """``set^0``
@@ -1153,7 +1243,7 @@ def parentspec(repo, subset, x, n):
             parents = cl.parentrevs(r)
             if len(parents) > 1:
                 ps.add(parents[1])
-    return [r for r in subset if r in ps]
+    return lazyset(subset, lambda r: r in ps)
 
 def present(repo, subset, x):
     """``present(set)``
@@ -1167,7 +1257,7 @@ def present(repo, subset, x):
     try:
         return getset(repo, subset, x)
     except error.RepoLookupError:
-        return []
+        return baseset([])
 
 def public(repo, subset, x):
     """``public()``
@@ -1175,7 +1265,7 @@ def public(repo, subset, x):
     # i18n: "public" is a keyword
     getargs(x, 0, 0, _("public takes no arguments"))
     pc = repo._phasecache
-    return [r for r in subset if pc.phase(repo, r) == phases.public]
+    return lazyset(subset, lambda r: pc.phase(repo, r) == phases.public)
 
 def remote(repo, subset, x):
     """``remote([id [,path]])``
@@ -1210,7 +1300,7 @@ def remote(repo, subset, x):
         r = repo[n].rev()
         if r in subset:
             return [r]
-    return []
+    return baseset([])
 
 def removes(repo, subset, x):
     """``removes(pattern)``
@@ -1232,7 +1322,9 @@ def rev(repo, subset, x):
     except (TypeError, ValueError):
         # i18n: "rev" is a keyword
         raise error.ParseError(_("rev expects a number"))
-    return [r for r in subset if r == l]
+    if l in subset:
+        return baseset([l])
+    return baseset([])
 
 def matching(repo, subset, x):
     """``matching(revision [, field])``
@@ -1344,15 +1436,13 @@ def matching(repo, subset, x):
                     break
             if match:
                 matches.add(r)
-    return [r for r in subset if r in matches]
+    return lazyset(subset, lambda r: r in matches)
 
 def reverse(repo, subset, x):
     """``reverse(set)``
     Reverse order of set.
     """
     l = getset(repo, subset, x)
-    if not isinstance(l, list):
-        l = list(l)
     l.reverse()
     return l
 
@@ -1363,7 +1453,7 @@ def roots(repo, subset, x):
     s = set(getset(repo, repo.changelog, x))
     subset = [r for r in subset if r in s]
     cs = _children(repo, subset, s)
-    return [r for r in subset if r not in cs]
+    return lazyset(subset, lambda r: r not in cs)
 
 def secret(repo, subset, x):
     """``secret()``
@@ -1371,7 +1461,7 @@ def secret(repo, subset, x):
     # i18n: "secret" is a keyword
     getargs(x, 0, 0, _("secret takes no arguments"))
     pc = repo._phasecache
-    return [r for r in subset if pc.phase(repo, r) == phases.secret]
+    return lazyset(subset, lambda r: pc.phase(repo, r) == phases.secret)
 
 def sort(repo, subset, x):
     """``sort(set[, [-]key...])``
@@ -1496,7 +1586,7 @@ def tag(repo, subset, x):
             s = set([cl.rev(n) for t, n in repo.tagslist() if matcher(t)])
     else:
         s = set([cl.rev(n) for t, n in repo.tagslist() if t != 'tip'])
-    return [r for r in subset if r in s]
+    return lazyset(subset, lambda r: r in s)
 
 def tagged(repo, subset, x):
     return tag(repo, subset, x)
@@ -1508,7 +1598,7 @@ def unstable(repo, subset, x):
     # i18n: "unstable" is a keyword
     getargs(x, 0, 0, _("unstable takes no arguments"))
     unstables = obsmod.getrevs(repo, 'unstable')
-    return [r for r in subset if r in unstables]
+    return lazyset(subset, lambda r: r in unstables)
 
 
 def user(repo, subset, x):
@@ -1525,11 +1615,11 @@ def user(repo, subset, x):
 def _list(repo, subset, x):
     s = getstring(x, "internal error")
     if not s:
-        return []
-    if not isinstance(subset, set):
-        subset = set(subset)
+        return baseset([])
+    if not util.safehasattr(subset, 'set'):
+        subset = baseset(subset)
     ls = [repo[r].rev() for r in s.split('\0')]
-    return [r for r in ls if r in subset]
+    return baseset([r for r in ls if r in subset])
 
 symbols = {
     "adds": adds,
@@ -1692,6 +1782,237 @@ def optimize(x, small):
         return w + wa, (op, x[1], ta)
     return 1, x
 
+# Cost model of plan(). Costs are counted in changesets read from the
+# changelog, selectivities are fractions of the repository.
+_indexcost = .01 # parent lookup, phase or membership test, changesetcache
+_changesetcost = 1
+_filescost = 20 # status of a changeset
+_manifestcost = 50
+_remotecost = 10000 # discovery with another repository
+
+# predicates filtering their subset, not changing its order:
+# name -> (cost per revision, selectivity)
+_filters = {
+    'adds': (_filescost, .1),
+    'all': (0, 1),
+    'ancestor': (_indexcost, 0),
+    'ancestors': (_indexcost, .5),
+    '_firstancestors': (_indexcost, .5),
+    'author': (_indexcost, .1),
+    'bisect': (_indexcost, .1),
+    'bisected': (_indexcost, .1),
+    'bookmark': (_indexcost, None),
+    'branch': (_indexcost, None),
+    'branchpoint': (_indexcost, .1),
+    'bumped': (_indexcost, None),
+    'bundle': (_indexcost, .5),
+    'children': (_indexcost, .5),
+    'closed': (_indexcost, .01),
+    'contains': (_manifestcost, .1),
+    'converted': (_changesetcost, .1),
+    'date': (_indexcost, .1),
+    'desc': (_changesetcost, .1),
+    'descendants': (_indexcost, .5),
+    '_firstdescendants': (_indexcost, .5),
+    'destination': (_changesetcost, .1),
+    'divergent': (_indexcost, None),
+    'draft': (_indexcost, None),
+    'extinct': (_indexcost, None),
+    'extra': (_changesetcost, .1),
+    'file': (_filescost, .1),
+    'filelog': (_indexcost, .1),
+    'follow': (_indexcost, .5),
+    '_followfirst': (_indexcost, .5),
+    'grep': (2 * _changesetcost, .1),
+    'head': (_indexcost, None),
+    'heads': (_indexcost, .5),
+    'hidden': (_indexcost, None),
+    'id': (_indexcost, 0),
+    'keyword': (_changesetcost, .1),
+    'matching': (_changesetcost, .1),
+    'max': (_indexcost, 0),
+    'merge': (_indexcost, .1),
+    'min': (_indexcost, 0),
+    'modifies': (_filescost, .1),
+    'obsolete': (_indexcost, None),
+    'origin': (_changesetcost, .1),
+    'outgoing': (_indexcost, .1),
+    'p1': (_indexcost, .5),
+    'p2': (_indexcost, .1),
+    'parents': (_indexcost, .5),
+    'public': (_indexcost, None),
+    'remote': (_indexcost, 0),
+    'removes': (_filescost, .1),
+    'rev': (_indexcost, 0),
+    'roots': (_indexcost, .5),
+    'secret': (_indexcost, None),
+    'tag': (_indexcost, .01),
+    'unstable': (_indexcost, None),
+    'user': (_indexcost, .1),
+}
+
+def _phaseselectivity(repo, phase):
+    """upper bound of the fraction of revisions in phase or above"""
+    roots = repo._phasecache.phaseroots[phase]
+    nodemap = repo.changelog.nodemap
+    revs = [nodemap[n] for n in roots if n in nodemap]
+    if not revs:
+        return 0.
+    return float(len(repo) - min(revs)) / len(repo)
+
+def _selectivity(repo, f, args):
+    """estimate the fraction of the repository selected by f(args)"""
+    total = float(len(repo))
+    if f == 'branch':
+        if len(args) == 1 and args[0][0] in ('string', 'symbol'):
+            branches = len(repo.branchmap())
+            if branches:
+                return 1. / branches
+        return .5
+    elif f == 'head':
+        heads = sum(len(h) for h in repo.branchmap().itervalues())
+        return heads / total
+    elif f == 'bookmark':
+        if args:
+            return 1. / total
+        return len(repo._bookmarks) / total
+    elif f == 'draft':
+        return max(_phaseselectivity(repo, phases.draft) -
+                   _phaseselectivity(repo, phases.secret), 0.)
+    elif f == 'secret':
+        return _phaseselectivity(repo, phases.secret)
+    elif f == 'public':
+        return 1. - _phaseselectivity(repo, phases.draft)
+    # obsolescence related predicates
+    if not repo.obsstore:
+        return 0.
+    return .1
+
+def _estimate(repo, x):
+    """estimate the cost of evaluating tree x, and reorder it
+
+    Returns (fixed, perrev, selectivity, ordered, tree): the cost paid
+    once and for each revision of the subset x is evaluated on, the
+    fraction of the subset expected to be selected, whether the result
+    keeps the order of the subset, and x with the operands of 'and'
+    reordered to run cheap and selective predicates first.
+    """
+    total = len(repo) or 1
+    op = x[0]
+    if op in ('string', 'symbol'):
+        return _indexcost, 0, 1. / total, True, x
+    elif op == 'and':
+        operands = []
+        def flatten(y):
+            if y[0] == 'and':
+                flatten(y[1])
+                flatten(y[2])
+            else:
+                operands.append(_estimate(repo, y))
+        flatten(x)
+        ordered = util.all(o[3] for o in operands)
+        if ordered:
+            # every operand filters the subset without reordering it,
+            # so they can run in any order: the cheapest per revision
+            # removed goes first
+            operands.sort(key=lambda o: o[1] / (1.0001 - o[2]))
+        fixed, perrev, selectivity = 0, 0, 1.
+        tree = None
+        for o in operands:
+            fixed += o[0]
+            perrev += o[1] * selectivity
+            selectivity *= o[2]
+            if tree is None:
+                tree = o[4]
+            else:
+                tree = ('and', tree, o[4])
+        return fixed, perrev, selectivity, ordered, tree
+    elif op == 'or':
+        a = _estimate(repo, x[1])
+        b = _estimate(repo, x[2])
+        perrev = a[1] + _indexcost + (1. - a[2]) * b[1]
+        selectivity = a[2] + (1. - a[2]) * b[2]
+        return a[0] + b[0], perrev, selectivity, False, (op, a[4], b[4])
+    elif op == 'not':
+        o = _estimate(repo, x[1])
+        return o[0], o[1] + _indexcost, 1. - o[2], True, (op, o[4])
+    elif op in ('range', 'dagrange'):
+        a = _estimate(repo, x[1])
+        b = _estimate(repo, x[2])
+        fixed = a[0] + a[1] * total + b[0] + b[1] * total
+        if op == 'dagrange':
+            fixed += _indexcost * total
+        return fixed, _indexcost, .5, False, (op, a[4], b[4])
+    elif op in ('parentpost', 'parent', 'ancestorspec'):
+        o = _estimate(repo, x[1])
+        fixed = o[0] + o[1] * total
+        return fixed, _indexcost, o[2], True, (op, o[4]) + x[2:]
+    elif op == 'func':
+        return _estimatefunc(repo, x)
+    return 0, _changesetcost, 1., False, x
+
+def _estimatefunc(repo, x):
+    total = len(repo) or 1
+    f = getstring(x[1], _("not a symbol"))
+    args = getlist(x[2])
+    estimates = []
+    def planargs(y):
+        if y is None or y[0] in ('string', 'symbol'):
+            return y
+        if y[0] == 'list':
+            return ('list', planargs(y[1]), planargs(y[2]))
+        e = _estimate(repo, y)
+        estimates.append(e)
+        return e[4]
+    tree = (x[0], x[1], planargs(x[2]))
+
+    if f in ('present', 'reverse', 'sort') and estimates:
+        # the argument is evaluated on the subset itself
+        fixed, perrev, selectivity, ordered = estimates[0][:4]
+        if f == 'sort':
+            perrev += _changesetcost
+        return fixed, perrev, selectivity, f == 'present' and ordered, tree
+
+    # other arguments are evaluated on the whole repository
+    fixed = sum(e[0] + e[1] * total for e in estimates)
+    if f in ('limit', 'first', 'last'):
+        try:
+            n = int(args[1][1])
+        except (IndexError, TypeError, ValueError):
+            n = 1
+        return fixed, _indexcost, min(float(n) / total, 1.), False, tree
+    if f not in _filters:
+        return fixed, _changesetcost, .5, False, tree
+
+    perrev, selectivity = _filters[f]
+    if f in ('ancestors', 'descendants', '_firstancestors',
+             '_firstdescendants', 'children', 'follow', '_followfirst'):
+        fixed += _indexcost * total
+    elif f in ('outgoing', 'remote'):
+        fixed += _remotecost
+    if selectivity is None:
+        selectivity = _selectivity(repo, f, args)
+    if f == 'heads' and estimates:
+        # heads(x) evaluates x on the subset
+        fixed = estimates[0][0] * 2
+        perrev += estimates[0][1] * 2
+        return fixed, perrev, estimates[0][2] * selectivity, True, tree
+    return fixed, perrev, selectivity, True, tree
+
+def plan(repo, tree):
+    """reorder the operands of 'and' in tree to run cheap and selective
+    predicates first, as estimated from the content of repo
+
+    Only operands filtering the subset without changing its order are
+    moved around, so the result of the query is unchanged. Returns the
+    estimated cost and size of the result of the new tree on the whole
+    repository, and the new tree.
+    """
+    if tree is None:
+        return 0, 0, tree
+    fixed, perrev, selectivity, ordered, tree = _estimate(repo, tree)
+    return fixed + perrev * len(repo), selectivity * len(repo), tree
+
 _aliasarg = ('func', ('symbol', '_aliasarg'))
 def _getaliasarg(tree):
     """If tree matches ('func', ('symbol', '_aliasarg'), ('string', X))
@@ -1823,7 +2144,13 @@ def match(ui, spec):
         tree = findaliases(ui, tree)
     weight, tree = optimize(tree, True)
     def mfunc(repo, subset):
-        return getset(repo, subset, tree)
+        if not util.safehasattr(subset, 'set'):
+            subset = baseset(subset)
+        s = getset(repo, subset, plan(repo, tree)[2])
+        if not isinstance(s, baseset):
+            # callers expect a list they can sort and slice
+            s = baseset(s)
+        return s
     return mfunc
 
 def formatspec(expr, *args):
@@ -1935,5 +2262,375 @@ def prettyformat(tree):
     output = '\n'.join(('  '*l + s) for l, s in lines)
     return output
 
+class baseset(list):
+    """Basic data structure that represents a revset and contains the basic
+    operation that it should be able to perform.
+
+    This is a list, so that the results of revset queries can still be
+    sorted, sliced and indexed by their users. Membership is tested
+    against a set built the first time it is needed.
+
+    >>> s = baseset([3, 1, 2])
+    >>> 2 in s, 4 in s
+    (True, False)
+    >>> s.append(4)
+    >>> 4 in s
+    True
+    >>> list(s - baseset([1, 4]))
+    [3, 2]
+    >>> s.sort()
+    >>> s.isascending(), s.max()
+    (True, 4)
+    """
+    def __init__(self, data=()):
+        super(baseset, self).__init__(data)
+        self._set = None
+        self._ascending = None
+
+    def set(self):
+        """return a structure providing fast membership tests"""
+        if self._set is None:
+            self._set = set(self)
+        return self._set
+
+    def __contains__(self, x):
+        return x in self.set()
+
+    def append(self, x):
+        super(baseset, self).append(x)
+        self._set = None
+        self._ascending = None
+
+    def extend(self, l):
+        super(baseset, self).extend(l)
+        self._set = None
+        self._ascending = None
+
+    def remove(self, x):
+        super(baseset, self).remove(x)
+        self._set = None
+
+    def reverse(self):
+        super(baseset, self).reverse()
+        if self._ascending is not None:
+            self._ascending = not self._ascending
+
+    def _reversedcopy(self):
+        s = baseset(reversed(self))
+        if self._ascending is not None:
+            s._ascending = not self._ascending
+        return s
+
+    def sort(self, *args, **kwargs):
+        super(baseset, self).sort(*args, **kwargs)
+        if args or 'cmp' in kwargs or 'key' in kwargs:
+            self._ascending = None
+        else:
+            self._ascending = not kwargs.get('reverse', False)
+
+    def __and__(self, other):
+        return lazyset(self, _tosmartset(other).__contains__)
+
+    def __sub__(self, other):
+        other = _tosmartset(other)
+        return lazyset(self, lambda r: r not in other)
+
+    def filter(self, condition):
+        """return the members of the set for which condition is true"""
+        return lazyset(self, condition)
+
+    def isascending(self):
+        return self._ascending is True
+
+    def isdescending(self):
+        return self._ascending is False
+
+    def min(self):
+        if self._ascending is not None:
+            return self[not self._ascending and -1 or 0]
+        return min(self)
+
+    def max(self):
+        if self._ascending is not None:
+            return self[self._ascending and -1 or 0]
+        return max(self)
+
+def _tosmartset(s):
+    if util.safehasattr(s, 'set'):
+        return s
+    return baseset(s)
+
+class abstractsmartset(object):
+    """Common methods of the lazily evaluated sets
+
+    Subclasses iterate over their members with _iterate() and implement
+    __contains__ without evaluating the whole set. Operations needing
+    random access or the size of the set turn it into a baseset first.
+    The order of the members, when known, is recorded in _ascending
+    (True, False or None) and used to stop iterating early."""
+    _ascending = None
+    _list = None
+
+    def __iter__(self):
+        if self._list is not None:
+            return iter(self._list)
+        return self._iterate()
+
+    def _aslist(self):
+        if self._list is None:
+            l = baseset(self._iterate())
+            l._ascending = self._ascending
+            self._list = l
+        return self._list
+
+    def __nonzero__(self):
+        for r in self:
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._aslist())
+
+    def __getitem__(self, x):
+        return self._aslist()[x]
+
+    def set(self):
+        return self
+
+    def __and__(self, other):
+        return lazyset(self, _tosmartset(other).__contains__)
+
+    def __sub__(self, other):
+        other = _tosmartset(other)
+        return lazyset(self, lambda r: r not in other)
+
+    def filter(self, condition):
+        """return the members of the set for which condition is true"""
+        return lazyset(self, condition)
+
+    def isascending(self):
+        return self._ascending is True
+
+    def isdescending(self):
+        return self._ascending is False
+
+    def reverse(self):
+        l = self._aslist()
+        l.reverse()
+        self._ascending = l._ascending
+
+    def sort(self, reverse=False):
+        l = self._aslist()
+        l.sort(reverse=reverse)
+        self._ascending = l._ascending
+
+    def min(self):
+        if self.isascending():
+            for r in self:
+                return r
+        return min(self)
+
+    def max(self):
+        if self.isdescending():
+            for r in self:
+                return r
+        return max(self)
+
+class lazyset(abstractsmartset):
+    """Members of subset for which condition is true
+
+    The condition is only evaluated on the revisions actually iterated
+    over or tested for membership, and the results are cached.
+
+    >>> s = lazyset(baseset([1, 2, 3, 4]), lambda r: r % 2 == 0)
+    >>> 2 in s, 3 in s, 6 in s
+    (True, False, False)
+    >>> list(s), len(s)
+    ([2, 4], 2)
+    """
+    def __init__(self, subset, condition=lambda r: True):
+        self._subset = subset
+        self._condition = condition
+        self._cache = {}
+        self._ascending = getattr(subset, '_ascending', None)
+
+    def __contains__(self, x):
+        c = self._cache
+        if x not in c:
+            c[x] = x in self._subset and self._condition(x)
+        return c[x]
+
+    def _iterate(self):
+        c = self._cache
+        cond = self._condition
+        for x in self._subset:
+            if x not in c:
+                c[x] = cond(x)
+            if c[x]:
+                yield x
+
+    def _reversedcopy(self):
+        """a reversed copy of the set, without evaluating it"""
+        if not util.safehasattr(self._subset, '_reversedcopy'):
+            return None
+        subset = self._subset._reversedcopy()
+        if subset is None:
+            return None
+        s = lazyset(subset, self._condition)
+        s._cache = self._cache
+        return s
+
+    def reverse(self):
+        if self._list is None:
+            s = self._reversedcopy()
+            if s is not None:
+                self._subset = s._subset
+                self._ascending = s._ascending
+                return
+        super(lazyset, self).reverse()
+
+class spanset(abstractsmartset):
+    """The visible revisions of repo from start (included) to end
+    (excluded)
+
+    The revisions are in descending order when start is greater than
+    end. Membership and size are computed without iterating.
+    """
+    def __init__(self, repo, start=0, end=None):
+        if end is None:
+            end = len(repo)
+        self._start = start
+        self._end = end
+        self._ascending = start <= end
+        self._hiddenrevs = repo.changelog.filteredrevs
+
+    def _iterate(self):
+        step = self._ascending and 1 or -1
+        hidden = self._hiddenrevs
+        for r in xrange(self._start, self._end, step):
+            if r not in hidden:
+                yield r
+
+    def _inrange(self, x):
+        if self._ascending:
+            return self._start <= x < self._end
+        return self._end < x <= self._start
+
+    def __contains__(self, x):
+        return self._inrange(x) and x not in self._hiddenrevs
+
+    def __len__(self):
+        hidden = len([r for r in self._hiddenrevs if self._inrange(r)])
+        return abs(self._end - self._start) - hidden
+
+    def __nonzero__(self):
+        for r in self:
+            return True
+        return False
+
+    def __getitem__(self, x):
+        return baseset(self)[x]
+
+    def _reversedcopy(self):
+        s = spanset.__new__(spanset)
+        if self._ascending:
+            s._start, s._end = self._end - 1, self._start - 1
+        else:
+            s._start, s._end = self._end + 1, self._start + 1
+        s._ascending = not self._ascending
+        s._hiddenrevs = self._hiddenrevs
+        return s
+
+    def reverse(self):
+        s = self._reversedcopy()
+        self._start, self._end = s._start, s._end
+        self._ascending = s._ascending
+
+    def sort(self, reverse=False):
+        if reverse == self._ascending:
+            self.reverse()
+
+class generatorset(abstractsmartset):
+    """Members yielded by a generator
+
+    The generator is consumed as needed and its values are kept, so the
+    set can be iterated over several times. When the values come in
+    ascending or descending order, membership tests stop consuming the
+    generator as soon as the answer is known.
+
+    >>> s = generatorset(iter([5, 3, 1]), ascending=False)
+    >>> 3 in s, 4 in s
+    (True, False)
+    >>> s._genlist
+    [5, 3]
+    >>> list(s), list(s)
+    ([5, 3, 1], [5, 3, 1])
+    """
+    def __init__(self, gen, ascending=None):
+        self._gen = gen
+        self._genlist = []
+        self._cache = {}
+        self._finished = False
+        self._ascending = ascending
+
+    def _consume(self):
+        """add the next value of the generator to _genlist"""
+        try:
+            r = self._gen.next()
+        except StopIteration:
+            self._finished = True
+            return False
+        self._cache[r] = True
+        self._genlist.append(r)
+        return True
+
+    def __contains__(self, x):
+        if x in self._cache:
+            return self._cache[x]
+        genlist = self._genlist
+        if genlist and self._ascending is not None:
+            last = genlist[-1]
+            if self._ascending and last > x or not self._ascending and last < x:
+                self._cache[x] = False
+                return False
+        while self._consume():
+            r = genlist[-1]
+            if r == x:
+                return True
+            if self._ascending and r > x or self._ascending is False and r < x:
+                break
+        self._cache[x] = False
+        return False
+
+    def _iterate(self):
+        genlist = self._genlist
+        i = 0
+        while i < len(genlist) or self._consume():
+            yield genlist[i]
+            i += 1
+
+class addset(abstractsmartset):
+    """Members of s1 followed by the members of s2 not in s1
+
+    >>> list(addset(baseset([3, 1]), baseset([1, 2])))
+    [3, 1, 2]
+    >>> 2 in addset(baseset([3, 1]), baseset([1, 2]))
+    True
+    """
+    def __init__(self, s1, s2):
+        self._s1 = s1
+        self._s2 = s2
+
+    def __contains__(self, x):
+        return x in self._s1 or x in self._s2
+
+    def _iterate(self):
+        s1 = self._s1
+        for r in s1:
+            yield r
+        for r in self._s2:
+            if r not in s1:
+                yield r
+
 # tell hggettext to extract docstrings from these functions:
 i18nfunctions = symbols.values()
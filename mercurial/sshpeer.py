@@ -7,7 +7,7 @@
 
 import re
 from i18n import _
-import util, error, wireproto
+import util, error, wireproto, changegroup
 
 class remotelock(object):
     def __init__(self, repo):
@@ -99,6 +99,19 @@ class sshpeer(wireproto.wirepeer):
                 self._caps.update(l[:-1].split(":")[1].split())
                 break
 
+        self.compengine = None
+        engine = changegroup.peerwireengine(ui, self.capable('compression'))
+        if engine is not None and engine.wiretype != 'none':
+            self.pipeo.write('compression\nengine %d\n%s'
+                             % (len(engine.wiretype), engine.wiretype))
+            self.pipeo.flush()
+            r = self._recv()
+            if r:
+                ui.debug('remote: %s\n' % r)
+            else:
+                ui.debug('using %s compression\n' % engine.name)
+                self.compengine = engine
+
     def _capabilities(self):
         return self._caps
 
@@ -177,7 +190,10 @@ class sshpeer(wireproto.wirepeer):
         return self._recv(), ''
 
     def _decompress(self, stream):
-        return stream
+        if self.compengine is None:
+            return stream
+        return util.chunkbuffer(
+            self.compengine.decompressstream(changegroup.readframes(stream)))
 
     def _recv(self):
         l = self.pipei.readline()
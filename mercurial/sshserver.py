@@ -16,6 +16,7 @@ class sshserver(object):
         self.lock = None
         self.fin = ui.fin
         self.fout = ui.fout
+        self.compengine = None
 
         hook.redirect(True)
         ui.fout = repo.ui.fout = ui.ferr
@@ -58,12 +59,12 @@ class sshserver(object):
     def redirect(self):
         pass
 
-    def groupchunks(self, changegroup):
-        while True:
-            d = changegroup.read(4096)
-            if not d:
-                break
-            yield d
+    def groupchunks(self, cg):
+        chunks = util.filechunkiter(cg, 4096)
+        if self.compengine is None:
+            return chunks
+        level = self.ui.configint('server', 'compressionlevel')
+        return changegroup.compressframes(self.compengine, chunks, level)
 
     def sendresponse(self, v):
         self.fout.write("%d\n" % len(v))
@@ -134,6 +135,16 @@ class sshserver(object):
         self.lock = None
         return ""
 
+    def do_compression(self):
+        '''compress the changegroups sent in this session with an engine
+        advertised by the "compression" capability'''
+        wiretype = self.getarg('engine')
+        engine = changegroup.wireengine(self.ui, wiretype)
+        if engine is None:
+            return 'unsupported compression engine: %s' % wiretype
+        self.compengine = engine
+        return ''
+
     def do_addchangegroup(self):
         '''DEPRECATED'''
 
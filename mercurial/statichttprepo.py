@@ -135,6 +135,7 @@ class statichttprepository(localrepo.localrepository):
         self._tags = None
         self.nodetagscache = None
         self._branchcaches = {}
+        self._changesetcache = None
         self.encodepats = None
         self.decodepats = None
 
@@ -331,6 +331,17 @@ class basicstore(object):
         for x in reversed(self._walk('', False)):
             yield x
 
+    def revlogindexes(self):
+        '''yields the unencoded names of the revlog index files, the
+        changelog last
+
+        Files listed may not exist.'''
+        for a, b, size in self.datafiles():
+            if a and a.endswith('.i'):
+                yield a
+        yield '00manifest.i'
+        yield '00changelog.i'
+
     def copylist(self):
         return ['requires'] + _data.split()
 
@@ -490,6 +501,14 @@ class fncachestore(basicstore):
             # (may be caused by rollback / strip)
             self.fncache.rewrite(existing)
 
+    def revlogindexes(self):
+        # the cached listing saves looking up every file of the store
+        for f in sorted(self.fncache):
+            if f.endswith('.i'):
+                yield f
+        yield '00manifest.i'
+        yield '00changelog.i'
+
     def copylist(self):
         d = ('data dh fncache phaseroots obsstore'
              ' 00manifest.d 00manifest.i 00changelog.d 00changelog.i')
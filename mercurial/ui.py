@@ -83,7 +83,7 @@ class ui(object):
         trusted = sections or trust or self._trusted(fp, filename)
 
         try:
-            cfg.read(filename, fp, sections=sections, remap=remap)
+            cfg.readcached(filename, fp, sections=sections, remap=remap)
             fp.close()
         except error.ConfigError, inst:
             if trusted:
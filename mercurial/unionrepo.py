@@ -63,6 +63,11 @@ class unionrevlog(revlog.revlog):
             return revlog.revlog._chunk(self, rev)
         return self.revlog2._chunk(self.node(rev))
 
+    def _slicechunk(self, revs):
+        # chunks not stored in the revlog are read one at a time by _chunk
+        return revlog.revlog._slicechunk(self, revs,
+                                         lambda rev: rev <= self.repotiprev)
+
     def revdiff(self, rev1, rev2):
         """return or calculate a delta between two revisions"""
         if rev1 > self.repotiprev and rev2 > self.repotiprev:
@@ -17,7 +17,7 @@ from i18n import _
 import error, osutil, encoding, collections
 import errno, re, shutil, sys, tempfile, traceback
 import os, time, datetime, calendar, textwrap, signal
-import imp, socket, urllib
+import imp, socket, urllib, mmap
 
 if os.name == 'nt':
     import windows as platform
@@ -218,11 +218,18 @@ except AttributeError:
                     break
 
 class lrucachedict(object):
-    '''cache most recent gets from or sets to this dictionary'''
-    def __init__(self, maxsize):
+    '''cache most recent gets from or sets to this dictionary
+
+    When maxcost is set, values are also evicted as long as the sum of
+    the costs given to insert() is larger than it. Values costing more
+    than maxcost on their own are not cached.'''
+    def __init__(self, maxsize, maxcost=0):
         self._cache = {}
+        self._costs = {}
         self._maxsize = maxsize
+        self._maxcost = maxcost
         self._order = deque()
+        self.totalcost = 0
 
     def __getitem__(self, key):
         value = self._cache[key]
@@ -231,17 +238,46 @@ class lrucachedict(object):
         return value
 
     def __setitem__(self, key, value):
-        if key not in self._cache:
-            if len(self._cache) >= self._maxsize:
-                del self._cache[self._order.popleft()]
-        else:
-            self._order.remove(key)
+        self.insert(key, value)
+
+    def insert(self, key, value, cost=0):
+        if key in self._cache:
+            self._remove(key)
+        if self._maxcost and cost > self._maxcost:
+            return
+        if len(self._cache) >= self._maxsize:
+            self._remove(self._order[0])
         self._cache[key] = value
+        self._costs[key] = cost
+        self.totalcost += cost
         self._order.append(key)
+        if self._maxcost:
+            while self.totalcost > self._maxcost:
+                self._remove(self._order[0])
+
+    def _remove(self, key):
+        del self._cache[key]
+        self.totalcost -= self._costs.pop(key)
+        self._order.remove(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._cache.clear()
+        self._costs.clear()
+        self._order.clear()
+        self.totalcost = 0
 
     def __contains__(self, key):
         return key in self._cache
 
+    def __len__(self):
+        return len(self._cache)
+
 def lrucachefunc(func):
     '''cache most recent results of function calls'''
     cache = {}
@@ -633,6 +669,18 @@ def fstat(fp):
     except AttributeError:
         return os.stat(fp.name)
 
+def mmapread(fp):
+    '''map the content of file object fp read-only into memory
+
+    The mapping stays valid after fp is closed. Empty files cannot be
+    mapped, an empty string is returned for them instead.'''
+    try:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        if fstat(fp).st_size == 0:
+            return ''
+        raise
+
 # File system features
 
 def checkcase(path):
@@ -947,6 +995,23 @@ class chunkbuffer(object):
                     yield chunk
         self.iter = splitbig(in_iter)
         self._queue = deque()
+        # position of the data left in the first chunk of the queue,
+        # which saves copying its end after each small read
+        self._chunkoffset = 0
+
+    def _fill(self):
+        """refill the queue, returning False if the iterator ran dry"""
+        queue = self._queue
+        if not queue:
+            target = 2**18
+            for chunk in self.iter:
+                if not chunk:
+                    continue
+                queue.append(chunk)
+                target -= len(chunk)
+                if target <= 0:
+                    break
+        return bool(queue)
 
     def read(self, l):
         """Read L bytes of data from the iterator of chunks of data.
@@ -954,26 +1019,44 @@ class chunkbuffer(object):
         left = l
         buf = []
         queue = self._queue
-        while left > 0:
-            # refill the queue
-            if not queue:
-                target = 2**18
-                for chunk in self.iter:
-                    queue.append(chunk)
-                    target -= len(chunk)
-                    if target <= 0:
-                        break
-                if not queue:
-                    break
-
-            chunk = queue.popleft()
-            left -= len(chunk)
-            if left < 0:
-                queue.appendleft(chunk[left:])
-                buf.append(chunk[:left])
-            else:
+        while left > 0 and self._fill():
+            chunk = queue[0]
+            offset = self._chunkoffset
+            remaining = len(chunk) - offset
+            if left >= remaining:
+                queue.popleft()
+                self._chunkoffset = 0
+                left -= remaining
+                if offset:
+                    chunk = chunk[offset:]
                 buf.append(chunk)
+            else:
+                self._chunkoffset = offset + left
+                buf.append(chunk[offset:offset + left])
+                left = 0
+
+        return ''.join(buf)
 
+    def readline(self):
+        """Read data up to and including the next newline. Returns the
+        remaining data if there is none."""
+        buf = []
+        queue = self._queue
+        while self._fill():
+            chunk = queue[0]
+            offset = self._chunkoffset
+            end = chunk.find('\n', offset) + 1
+            if end:
+                if end == len(chunk):
+                    queue.popleft()
+                    self._chunkoffset = 0
+                else:
+                    self._chunkoffset = end
+                buf.append(chunk[offset:end])
+                break
+            queue.popleft()
+            self._chunkoffset = 0
+            buf.append(chunk[offset:])
         return ''.join(buf)
 
 def filechunkiter(f, size=65536, limit=None):
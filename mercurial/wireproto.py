@@ -5,11 +5,11 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2 or any later version.
 
-import urllib, tempfile, os, sys
+import urllib, tempfile, os, sys, errno
 from i18n import _
 from node import bin, hex
 import changegroup as changegroupmod
-import peer, error, encoding, util, store
+import peer, error, encoding, util, store, revlog
 
 # abstract batching support
 
@@ -268,6 +268,14 @@ class wirepeer(peer.peerrepository):
     def stream_out(self):
         return self._callstream('stream_out')
 
+    def stream_out2(self, compression):
+        self.requirecap('stream2', _('stream the store'))
+        return self._callstream('stream_out2', compression=compression)
+
+    def clonebundles(self):
+        self.requirecap('clonebundles', _('get clone bundles'))
+        return self._call('clonebundles')
+
     def changegroup(self, nodes, kind):
         n = encodelist(nodes)
         f = self._callstream("changegroup", roots=n)
@@ -281,15 +289,18 @@ class wirepeer(peer.peerrepository):
                              bases=bases, heads=heads)
         return changegroupmod.unbundle10(self._decompress(f), 'UN')
 
-    def getbundle(self, source, heads=None, common=None):
+    def getbundle(self, source, heads=None, common=None, version='01'):
         self.requirecap('getbundle', _('look up remote changes'))
         opts = {}
         if heads is not None:
             opts['heads'] = encodelist(heads)
         if common is not None:
             opts['common'] = encodelist(common)
+        if version != '01':
+            opts['cgversion'] = version
         f = self._callstream("getbundle", **opts)
-        return changegroupmod.unbundle10(self._decompress(f), 'UN')
+        unbundler = changegroupmod.packermap[version][1]
+        return unbundler(self._decompress(f), 'UN')
 
     def unbundle(self, cg, heads, source):
         '''Send cg (a readable file-like object representing the
@@ -428,8 +439,17 @@ def capabilities(repo, proto):
         # otherwise, add 'streamreqs' detailing our local revlog format
         else:
             caps.append('streamreqs=%s' % ','.join(requiredformats))
+        caps.append('stream2')
     caps.append('unbundle=%s' % ','.join(changegroupmod.bundlepriority))
     caps.append('httpheader=1024')
+    caps.append('changegroupversions=%s'
+                % ','.join(sorted(changegroupmod.packermap)))
+    engines = changegroupmod.wireengines(repo.ui)
+    if engines:
+        caps.append('compression=%s' % ','.join(e.wiretype for e in engines))
+    if (repo.ui.configbool('server', 'clonebundles', True) and
+        repo.opener.exists('clonebundles.manifest')):
+        caps.append('clonebundles')
     return ' '.join(caps)
 
 def changegroup(repo, proto, roots):
@@ -443,15 +463,30 @@ def changegroupsubset(repo, proto, bases, heads):
     cg = repo.changegroupsubset(bases, heads, 'serve')
     return streamres(proto.groupchunks(cg))
 
+def clonebundles(repo, proto):
+    '''return the manifest of the pre-generated bundles of the repository
+
+    Each line describes a bundle: its URL followed by space separated
+    KEY=VALUE attributes (see the debugclonebundles command).
+    '''
+    if not repo.ui.configbool('server', 'clonebundles', True):
+        return ''
+    return repo.opener.tryread('clonebundles.manifest')
+
 def debugwireargs(repo, proto, one, two, others):
     # only accept optional args from the known set
     opts = options('debugwireargs', ['three', 'four'], others)
     return repo.debugwireargs(one, two, **opts)
 
 def getbundle(repo, proto, others):
-    opts = options('getbundle', ['heads', 'common'], others)
+    opts = options('getbundle', ['heads', 'common', 'cgversion'], others)
+    version = opts.pop('cgversion', '01')
+    if version not in changegroupmod.packermap:
+        return ooberror(_('unsupported changegroup version: %s') % version)
     for k, v in opts.iteritems():
         opts[k] = decodelist(v)
+    if version != '01':
+        opts['version'] = version
     cg = repo.getbundle('serve', **opts)
     return streamres(proto.groupchunks(cg))
 
@@ -537,57 +572,222 @@ def stream(repo, proto):
     if not _allowstream(repo.ui):
         return '1\n'
 
+    try:
+        entries, total_bytes = scanstream(repo)
+    except error.LockError:
+        return '2\n' # error: 2
+
+    def streamer(repo, entries, total):
+        yield '0\n' # success
+        for chunk in generatestream(repo, entries, total):
+            yield chunk
+
+    return streamres(streamer(repo, entries, total_bytes))
+
+def scanstream(repo):
+    '''return the list of (name, size) of the files of the store to
+    stream and their total size
+
+    The repository is locked during the scan to get a consistent
+    snapshot of it. Raises error.LockError if it cannot be locked.
+    '''
     entries = []
     total_bytes = 0
+    lock = repo.lock()
     try:
-        # get consistent snapshot of repo, lock during scan
-        lock = repo.lock()
-        try:
-            repo.ui.debug('scanning\n')
-            for name, ename, size in repo.store.walk():
-                if size:
-                    entries.append((name, size))
-                    total_bytes += size
-        finally:
-            lock.release()
+        repo.ui.debug('scanning\n')
+        for name, ename, size in repo.store.walk():
+            if size:
+                entries.append((name, size))
+                total_bytes += size
+    finally:
+        lock.release()
+    return entries, total_bytes
+
+def generatestream(repo, entries, total_bytes):
+    '''stream out all metadata files in repository.'''
+    repo.ui.debug('%d files, %d bytes to transfer\n' %
+                  (len(entries), total_bytes))
+    yield '%d %d\n' % (len(entries), total_bytes)
+
+    sopener = repo.sopener
+    oldaudit = sopener.mustaudit
+    debugflag = repo.ui.debugflag
+    sopener.mustaudit = False
+
+    try:
+        for name, size in entries:
+            if debugflag:
+                repo.ui.debug('sending %s (%d bytes)\n' % (name, size))
+            # partially encode name over the wire for backwards compat
+            yield '%s\0%d\n' % (store.encodedir(name), size)
+            if size <= 65536:
+                fp = sopener(name)
+                try:
+                    data = fp.read(size)
+                finally:
+                    fp.close()
+                yield data
+            else:
+                for chunk in util.filechunkiter(sopener(name), limit=size):
+                    yield chunk
+    # replace with "finally:" when support for python 2.4 has been dropped
+    except Exception:
+        sopener.mustaudit = oldaudit
+        raise
+    sopener.mustaudit = oldaudit
+
+def stream2(repo, proto, compression):
+    '''stream out the store like stream_out, without holding the lock
+    while files are read, compressed with the engine of the given wire
+    type
+
+    The status line is followed by frames of compressed data, as
+    written by changegroup.compressframes. The data starts with a line
+    holding the number of revlogs listed, followed by their files in the
+    stream_out format and an empty line. Revlogs are truncated after
+    their last revision linked to the changesets present when the
+    request started, so they are consistent with each other even if
+    changesets are added while they are sent.
+    '''
+    if not _allowstream(repo.ui):
+        return '1\n'
+
+    # the data is sent uncompressed to clients asking for it, as with
+    # stream_out
+    if compression == 'none':
+        engine = changegroupmod.compengines['none']
+    else:
+        engine = changegroupmod.wireengine(repo.ui, compression)
+        if engine is None:
+            return '3\n'
+
+    try:
+        names, tiprev = scanrevlogs(repo)
     except error.LockError:
         return '2\n' # error: 2
 
-    def streamer(repo, entries, total):
-        '''stream out all metadata files in repository.'''
+    level = repo.ui.configint('server', 'compressionlevel')
+    def streamer(repo, names, tiprev):
         yield '0\n' # success
-        repo.ui.debug('%d files, %d bytes to transfer\n' %
-                      (len(entries), total_bytes))
-        yield '%d %d\n' % (len(entries), total_bytes)
+        chunks = generatestream2(repo, names, tiprev)
+        for chunk in changegroupmod.compressframes(engine, chunks, level):
+            yield chunk
+
+    return streamres(streamer(repo, names, tiprev))
+
+def scanrevlogs(repo):
+    '''return the names of the revlog indexes of the store and the
+    revision of the tip of the changelog
+
+    The names are read from the cached listing of the store when it
+    has one, so the repository is only locked for a short time. Raises
+    error.LockError if it cannot be locked.
+    '''
+    lock = repo.lock()
+    try:
+        repo.ui.debug('listing revlogs\n')
+        names = list(repo.store.revlogindexes())
+        tiprev = len(repo.unfiltered().changelog) - 1
+    finally:
+        lock.release()
+    return names, tiprev
 
-        sopener = repo.sopener
-        oldaudit = sopener.mustaudit
-        debugflag = repo.ui.debugflag
-        sopener.mustaudit = False
+# files up to this size are read at once and sent together
+_packfilesize = 65536
+_packsize = 1048576
 
+def _revlogfiles(sopener, name, tiprev):
+    '''yield (name, size, data) for the files of the revlog indexed by
+    name, truncated after its last revision linked to tiprev or an
+    earlier changeset
+
+    data is None for the data file, which is read by the caller.'''
+    try:
+        fp = sopener(name)
+    except IOError, inst:
+        # listed by an outdated fncache
+        if inst.errno != errno.ENOENT:
+            raise
+        return
+    try:
+        data = fp.read()
+    finally:
+        fp.close()
+    dname = name[:-2] + '.d'
+    sizes = revlog.truncationpoint(data, tiprev)
+    if sizes is None:
+        # old format revlogs are sent whole
+        sizes = len(data), 0
         try:
-            for name, size in entries:
+            sizes = len(data), sopener.stat(dname).st_size
+        except OSError, inst:
+            if inst.errno != errno.ENOENT:
+                raise
+    isize, dsize = sizes
+    if not isize:
+        return
+    yield name, isize, data[:isize]
+    if dsize:
+        # the data file is written before the index, so it holds at
+        # least the revisions read from the index
+        yield dname, dsize, None
+
+def generatestream2(repo, names, tiprev):
+    '''stream out the revlogs indexed by names, truncated after their
+    last revision linked to tiprev or an earlier changeset
+
+    Small files are sent together in chunks of about _packsize bytes.
+    '''
+    repo.ui.debug('%d revlogs to transfer\n' % len(names))
+    yield '%d\n' % len(names)
+
+    sopener = repo.sopener
+    oldaudit = sopener.mustaudit
+    debugflag = repo.ui.debugflag
+    sopener.mustaudit = False
+
+    pack = []
+    packed = 0
+    try:
+        for name in names:
+            for fname, size, data in _revlogfiles(sopener, name, tiprev):
                 if debugflag:
-                    repo.ui.debug('sending %s (%d bytes)\n' % (name, size))
-                # partially encode name over the wire for backwards compat
-                yield '%s\0%d\n' % (store.encodedir(name), size)
-                if size <= 65536:
-                    fp = sopener(name)
-                    try:
-                        data = fp.read(size)
-                    finally:
+                    repo.ui.debug('sending %s (%d bytes)\n' % (fname, size))
+                # partially encode name like stream_out
+                pack.append('%s\0%d\n' % (store.encodedir(fname), size))
+                if data is None:
+                    fp = sopener(fname)
+                    if size <= _packfilesize:
+                        try:
+                            data = fp.read(size)
+                        finally:
+                            fp.close()
+                    else:
+                        yield ''.join(pack)
+                        pack = []
+                        packed = 0
+                        data = ''
+                        for chunk in util.filechunkiter(fp, limit=size):
+                            size -= len(chunk)
+                            yield chunk
                         fp.close()
-                    yield data
-                else:
-                    for chunk in util.filechunkiter(sopener(name), limit=size):
-                        yield chunk
-        # replace with "finally:" when support for python 2.4 has been dropped
-        except Exception:
-            sopener.mustaudit = oldaudit
-            raise
+                    if len(data) != size:
+                        raise util.Abort(_('%s changed while being sent')
+                                         % fname)
+                pack.append(data)
+                packed += len(data)
+                if packed >= _packsize:
+                    yield ''.join(pack)
+                    pack = []
+                    packed = 0
+        pack.append('\n')
+        yield ''.join(pack)
+    # replace with "finally:" when support for python 2.4 has been dropped
+    except Exception:
         sopener.mustaudit = oldaudit
-
-    return streamres(streamer(repo, entries, total_bytes))
+        raise
+    sopener.mustaudit = oldaudit
 
 def unbundle(repo, proto, heads):
     their_heads = decodelist(heads)
@@ -643,6 +843,7 @@ commands = {
     'capabilities': (capabilities, ''),
     'changegroup': (changegroup, 'roots'),
     'changegroupsubset': (changegroupsubset, 'bases heads'),
+    'clonebundles': (clonebundles, ''),
     'debugwireargs': (debugwireargs, 'one two *'),
     'getbundle': (getbundle, '*'),
     'heads': (heads, ''),
@@ -652,5 +853,6 @@ commands = {
     'lookup': (lookup, 'key'),
     'pushkey': (pushkey, 'namespace key old new'),
     'stream_out': (stream, ''),
+    'stream_out2': (stream2, 'compression'),
     'unbundle': (unbundle, 'heads'),
 }
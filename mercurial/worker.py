@@ -146,6 +146,111 @@ if os.name != 'nt':
     _platformworker = _posixworker
     _exitstatus = _posixexitstatus
 
+class threadedmap(object):
+    '''apply a function to items in a pool of threads
+
+    Items are queued with put() and their results are retrieved with
+    get(), which waits for them if needed and raises again any exception
+    raised by the function. The most recently queued items are processed
+    first. This only helps functions that release the GIL, like those
+    doing I/O.
+    '''
+
+    def __init__(self, func, numthreads):
+        self._func = func
+        self._pending = []
+        self._results = {}
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in xrange(numthreads):
+            t = threading.Thread(target=self._run)
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def put(self, item):
+        self._cond.acquire()
+        try:
+            self._pending.append(item)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def get(self, item):
+        self._cond.acquire()
+        try:
+            while not self._results.get(item):
+                self._cond.wait()
+            ok, r = self._results[item].pop(0)
+            if not self._results[item]:
+                del self._results[item]
+        finally:
+            self._cond.release()
+        if not ok:
+            raise r[0], r[1], r[2]
+        return r
+
+    def close(self):
+        self._cond.acquire()
+        try:
+            self._closed = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        func, cond = self._func, self._cond
+        while True:
+            cond.acquire()
+            try:
+                while not self._pending and not self._closed:
+                    cond.wait()
+                if self._closed:
+                    return
+                item = self._pending.pop()
+            finally:
+                cond.release()
+            try:
+                r = True, func(item)
+            except: # re-raises in get()
+                r = False, sys.exc_info()
+            cond.acquire()
+            try:
+                self._results.setdefault(item, []).append(r)
+                cond.notifyAll()
+            finally:
+                cond.release()
+
+class serialized(object):
+    '''proxy calling the methods of an object one at a time when they
+    are called from several threads
+
+    Calling the proxy calls the object itself the same way.'''
+
+    def __init__(self, obj):
+        self._obj = obj
+        self._lock = threading.RLock()
+
+    def _serialize(self, func):
+        lock = self._lock
+        def call(*args, **kwargs):
+            lock.acquire()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                lock.release()
+        return call
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if util.safehasattr(attr, '__call__'):
+            return self._serialize(attr)
+        return attr
+
+    def __call__(self, *args, **kwargs):
+        return self._serialize(self._obj)(*args, **kwargs)
+
 def partition(lst, nslices):
     '''partition a list into N slices of equal size'''
     n = len(lst)
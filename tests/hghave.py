@@ -37,6 +37,9 @@ def has_bzr114():
     except ImportError:
         return False
 
+def has_cc():
+    return matchoutput('cc --version 2>&1', r'')
+
 def has_cvs():
     re = r'Concurrent Versions System.*?server'
     return matchoutput('cvs --version 2>&1', re) and not has_msys()
@@ -284,6 +287,7 @@ checks = {
     "bzr": (has_bzr, "Canonical's Bazaar client"),
     "bzr114": (has_bzr114, "Canonical's Bazaar client >= 1.14"),
     "cacheable": (has_cacheable_fs, "cacheable filesystem"),
+    "cc": (has_cc, "C compiler"),
     "cvs": (has_cvs, "cvs client/server"),
     "cvs112": (has_cvs112, "cvs client/server >= 1.12"),
     "darcs": (has_darcs, "darcs client"),
@@ -1284,6 +1284,9 @@ def main():
     if 'HGPROF' in os.environ:
         os.environ['HGPROF'] = ''
         del os.environ['HGPROF']
+    if 'HGRCCACHE' in os.environ:
+        os.environ['HGRCCACHE'] = ''
+        del os.environ['HGRCCACHE']
 
     global TESTDIR, HGTMP, INST, BINDIR, PYTHONDIR, COVERAGE_FILE
     TESTDIR = os.environ["TESTDIR"] = os.getcwd()
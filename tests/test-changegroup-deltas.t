@@ -0,0 +1,135 @@
+  $ "$TESTDIR/hghave" serve || exit 80
+
+  $ cat >> $HGRCPATH <<EOF
+  > [format]
+  > generaldelta = True
+  > EOF
+
+Two branches committed alternately, so the stored delta of most file
+revisions is against their parent rather than the previous revision
+
+  $ hg init server
+  $ cd server
+  $ for i in 0 1 2 3 4 5 6 7 8 9; do echo line $i >> f; done
+  $ hg ci -qAm0
+  $ hg up -q null
+  $ echo other > f
+  $ hg ci -qAm1
+  $ for i in 2 3 4 5; do
+  >     hg up -q `expr $i - 2`
+  >     echo $i >> f
+  >     hg ci -qm$i
+  > done
+  $ hg debugindex f
+     rev    offset  length  delta linkrev nodeid       p1           p2
+       0         0      40     -1       0 b191638f836b 000000000000 000000000000
+       1        40       7     -1       1 48f0daf20d9d 000000000000 000000000000
+       2        47      14      0       2 9717858a5965 b191638f836b 000000000000
+       3        61       9     -1       3 0debb8251582 48f0daf20d9d 000000000000
+       4        70      14      2       4 f1eaf064c515 9717858a5965 000000000000
+       5        84      11     -1       5 6738c45b26fb 0debb8251582 000000000000
+  $ cd ..
+
+  $ cat > chunks.py <<EOF
+  > import sys
+  > from mercurial import ui as uimod, hg
+  > from mercurial.node import short
+  > u = uimod.ui()
+  > u.setconfig('bundle', 'reorder', 'False')
+  > repo = hg.repository(u, 'server')
+  > cg = repo.getbundle('test', version=sys.argv[1])
+  > def group():
+  >     chain = None
+  >     while True:
+  >         chunk = cg.deltachunk(chain)
+  >         if not chunk:
+  >             return
+  >         chain = chunk['node']
+  >         yield chunk
+  > cg.changelogheader()
+  > list(group())
+  > cg.manifestheader()
+  > list(group())
+  > while cg.filelogheader():
+  >     for c in group():
+  >         print short(c['node']), short(c['p1']), short(c['deltabase'])
+  > EOF
+
+Version 01 chunks are always deltas against the previous revision of the
+group, version 02 chunks name their base, so stored deltas are sent as is
+
+  $ python chunks.py 01
+  b191638f836b 000000000000 000000000000
+  48f0daf20d9d 000000000000 b191638f836b
+  9717858a5965 b191638f836b 48f0daf20d9d
+  0debb8251582 48f0daf20d9d 9717858a5965
+  f1eaf064c515 9717858a5965 0debb8251582
+  6738c45b26fb 0debb8251582 f1eaf064c515
+  $ python chunks.py 02
+  b191638f836b 000000000000 000000000000
+  48f0daf20d9d 000000000000 b191638f836b
+  9717858a5965 b191638f836b b191638f836b
+  0debb8251582 48f0daf20d9d 9717858a5965
+  f1eaf064c515 9717858a5965 9717858a5965
+  6738c45b26fb 0debb8251582 f1eaf064c515
+
+Peers advertise the changegroup versions they understand and pulls use
+the most recent one
+
+  $ hg -R server serve -p $HGPORT -d --pid-file=hg.pid -A access.log
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ hg init client
+  $ hg -R client pull -q http://localhost:$HGPORT/
+  $ hg -R client verify -q
+  $ hg -R client debugindex f
+     rev    offset  length  delta linkrev nodeid       p1           p2
+       0         0      40     -1       0 b191638f836b 000000000000 000000000000
+       1        40      14      0       2 9717858a5965 b191638f836b 000000000000
+       2        54      14      1       4 f1eaf064c515 9717858a5965 000000000000
+       3        68       7     -1       1 48f0daf20d9d 000000000000 000000000000
+       4        75       9     -1       3 0debb8251582 48f0daf20d9d 000000000000
+       5        84      11     -1       5 6738c45b26fb 0debb8251582 000000000000
+  $ grep getbundle access.log
+  * - - [*] "GET /?cmd=getbundle HTTP/1.1" 200 - x-hgarg-1:cgversion=02&common=0000000000000000000000000000000000000000&heads=4306496d20294f8b09a1198a58beba3e975bc297+9bf9fc20b0334636b43c10b449d4f8d68b025069 (glob)
+
+  $ hg clone -q --pull -e "python \"$TESTDIR/dummyssh\"" \
+  >   ssh://user@dummy/server ssh
+  $ hg -R ssh verify -q
+
+  $ hg clone -q --pull server local
+  $ hg -R local verify -q
+
+Peers not advertising versions are not passed one
+
+  $ cat > oldpeer.py <<EOF
+  > from mercurial import localrepo
+  > def getbundle(self, source, heads=None, common=None):
+  >     return self._repo.getbundle(source, heads=heads, common=common)
+  > localrepo.localpeer.getbundle = getbundle
+  > capable = localrepo.localpeer.capable
+  > def oldcapable(self, name):
+  >     if name == 'changegroupversions':
+  >         return False
+  >     return capable(self, name)
+  > localrepo.localpeer.capable = oldcapable
+  > EOF
+  $ hg clone -q --pull --config extensions.oldpeer=oldpeer.py server old
+  $ hg -R old verify -q
+
+Bundle files are still written with version 01, and pulling from them
+gives the same repository
+
+  $ hg -R server bundle -qa all.hg
+  $ python -c "print open('all.hg', 'rb').read(6)"
+  HG10BZ
+  $ hg init frombundle
+  $ hg -R frombundle pull -q all.hg
+  $ hg -R frombundle verify -q
+  $ hg -R frombundle debugindex f
+     rev    offset  length  delta linkrev nodeid       p1           p2
+       0         0      40     -1       0 b191638f836b 000000000000 000000000000
+       1        40      14      0       2 9717858a5965 b191638f836b 000000000000
+       2        54      14      1       4 f1eaf064c515 9717858a5965 000000000000
+       3        68       7     -1       1 48f0daf20d9d 000000000000 000000000000
+       4        75       9     -1       3 0debb8251582 48f0daf20d9d 000000000000
+       5        84      11     -1       5 6738c45b26fb 0debb8251582 000000000000
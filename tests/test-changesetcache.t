@@ -0,0 +1,184 @@
+  $ cat >> $HGRCPATH << EOF
+  > [extensions]
+  > mq =
+  > EOF
+
+  $ cat > checkcache.py << EOF
+  > from mercurial import hg, ui, changesetcache
+  > repo = hg.repository(ui.ui(), '.')
+  > cache = changesetcache.read(repo)
+  > if cache is None:
+  >     print 'no cache'
+  > else:
+  >     print '%d revisions, %d strings' % (len(cache), len(cache.strings))
+  >     for r in repo:
+  >         ctx = repo[r]
+  >         assert cache.node(r) == ctx.node()
+  >         assert cache.strings[cache.user[r]] == ctx.user()
+  >         assert cache.date[r] == ctx.date()[0]
+  >         assert cache.strings[cache.branch[r]] == ctx.branch()
+  >         assert bool(cache.flags[r] & 1) == ctx.closesbranch()
+  >         assert cache.files[r] == len(ctx.files())
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ echo a > a
+  $ hg ci -Am0 -u alice -d '0 0'
+  adding a
+  $ echo b > b
+  $ hg ci -Am1 -u bob -d '86400 0'
+  adding b
+  $ hg branch stable
+  marked working directory as branch stable
+  (branches are permanent and global, did you want a bookmark?)
+  $ echo c > a
+  $ hg ci -m2 -u alice -d '172800 0'
+  $ hg ci --close-branch -m3 -u carol -d '259200 0'
+  $ hg up -q default
+
+The cache is created the first time a predicate uses it
+
+  $ python ../checkcache.py
+  no cache
+  $ hg log -r 'user(alice)' --template '{rev}\n'
+  0
+  2
+  $ ls .hg/cache/changesets*
+  .hg/cache/changesets
+  .hg/cache/changesets-branch
+  .hg/cache/changesets-date
+  .hg/cache/changesets-files
+  .hg/cache/changesets-flags
+  .hg/cache/changesets-node
+  .hg/cache/changesets-strings
+  .hg/cache/changesets-user
+  $ cat .hg/cache/changesets
+  4 77cda52c1d4d1f418d0122f3252b9c93314d47f9 5
+  $ python ../checkcache.py
+  4 revisions, 5 strings
+
+  $ hg log -r 'author("re:^b")' --template '{rev}\n'
+  1
+  $ hg log -r 'branch(stable)' --template '{rev}\n'
+  2
+  3
+  $ hg log -r 'branch("re:^def")' --template '{rev}\n'
+  0
+  1
+  $ hg log -r 'branch(3)' --template '{rev}\n'
+  2
+  3
+  $ hg log -r 'closed()' --template '{rev}\n'
+  3
+  $ hg log -r 'date(">1970-01-03")' --template '{rev}\n'
+  2
+  3
+  $ hg log -r 'keyword(carol) or keyword(b)' --template '{rev}\n'
+  3
+  1
+
+It is kept up to date by commits
+
+  $ echo d > d
+  $ hg ci -Am4 -u dave -d '345600 0'
+  adding d
+  $ python ../checkcache.py
+  5 revisions, 6 strings
+  $ hg log -r 'user(dave)' --template '{rev}\n'
+  4
+
+by pulls
+
+  $ cd ..
+  $ hg clone -q -r 1 repo clone
+  $ cd clone
+  $ hg log -r 'user(bob)' --template '{rev}\n'
+  1
+  $ hg pull -q ../repo
+  $ python ../checkcache.py
+  5 revisions, 6 strings
+
+and by strip, which removes the revisions from the cache
+
+  $ cd ../repo
+  $ hg strip -q 4
+  $ python ../checkcache.py
+  4 revisions, 6 strings
+  $ hg log -r 'user(dave)' --template '{rev}\n'
+  $ echo e > e
+  $ hg ci -Am4 -u erin -d '345600 0'
+  adding e
+  $ python ../checkcache.py
+  5 revisions, 7 strings
+  $ hg log -r 'user(erin)' --template '{rev}\n'
+  4
+
+A broken cache is rebuilt
+
+  $ echo 'garbage' > .hg/cache/changesets
+  $ hg log -r 'user(erin)' --template '{rev}\n' --debug
+  invalid changeset cache: invalid literal for int() with base 10: 'garbage'
+  4
+  $ python ../checkcache.py
+  5 revisions, 6 strings
+
+  $ cd ..
+
+The null revision is not in the cache, its user is empty and its branch
+is default
+
+  $ cd repo
+  $ hg log -r 'null and author(bob)' --template '{rev}\n'
+  $ hg log -r 'null and author("")' --template '{rev}\n'
+  -1
+  $ hg log -r 'branch(null)' --template '{rev}\n'
+  0
+  1
+  4
+  $ hg log -r 'null and branch(default)' --template '{rev}\n'
+  -1
+  $ hg log -r 'null and closed()' --template '{rev}\n'
+  $ hg log -r 'null and date("<1970-01-02")' --template '{rev}\n'
+  -1
+  $ cd ..
+
+Filtering a few revisions does not build the cache from the whole
+changelog
+
+  $ hg clone -q repo small
+  $ cd small
+  $ for i in 0 1 2 3 4 5 6 7 8 9; do
+  >     echo $i > f
+  >     hg ci -qAm$i -u frank -d '432000 0'
+  > done
+  $ hg log -r 'tip and author(frank)' --template '{rev}\n'
+  14
+  $ python ../checkcache.py
+  no cache
+  $ hg log -r 'author(frank) and branch(stable)' --template '{rev}\n'
+  $ python ../checkcache.py
+  15 revisions, 7 strings
+  $ cd ..
+
+#if serve
+
+Nor does a keyword search of hgweb
+
+  $ hg clone -q small web
+  $ cd web
+  $ hg serve -p $HGPORT -d --pid-file=../hg.pid
+  $ cat ../hg.pid >> $DAEMON_PIDS
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT 'log?rev=frank+8&revcount=5' \
+  >   | grep -c "<td class=.author.>frank</td>"
+  1
+  $ python ../checkcache.py
+  no cache
+  $ hg log -r 'author(frank)' -q | wc -l
+  \s*10 (re)
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT 'log?rev=frank+8&revcount=5' \
+  >   | grep -c "<td class=.author.>frank</td>"
+  1
+  $ cd ..
+
+#endif
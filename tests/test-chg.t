@@ -0,0 +1,71 @@
+  $ "$TESTDIR/hghave" cc serve || exit 80
+
+  $ cc -std=gnu99 -o chg "$TESTDIR/../contrib/chg/chg.c"
+  $ CHGSOCKNAME="$TESTTMP/server"
+  $ export CHGSOCKNAME
+
+the servers started by chg record their pid for the test to stop them
+
+  $ cat > hgserver << EOF
+  > #!/bin/sh
+  > hg "\$@" --pid-file "$TESTTMP/server.pid" && cat "$TESTTMP/server.pid" >> "$DAEMON_PIDS"
+  > EOF
+  $ chmod +x hgserver
+  $ CHGHG="$TESTTMP/hgserver"
+  $ export CHGHG
+
+A server is started on first use
+
+  $ ./chg init repo
+  $ ls server*
+  server
+  server.lock
+  server.pid
+  $ cd repo
+  $ echo a > a
+  $ ../chg ci -qAm0 -u test
+  $ ../chg log --template '{rev} {desc}\n'
+  0 0
+
+Commands use the working directory, the standard input and output and the
+exit code of the client
+
+  $ mkdir sub
+  $ cd sub
+  $ ../../chg root
+  $TESTTMP/repo
+  $ cd ..
+  $ echo b >> a
+  $ ../chg diff --nodates > ../a.patch
+  $ ../chg revert -q --no-backup a
+  $ ../chg import -q --no-commit - < ../a.patch
+  $ ../chg st
+  M a
+  $ ../chg cat -r 0 nosuchfile
+  nosuchfile: no such file in rev f7b1eb17ad24
+  [1]
+
+The same server keeps running commands
+
+  $ cat ../server.pid > ../firstserver.pid
+  $ ../chg id -q
+  f7b1eb17ad24+
+  $ cmp ../server.pid ../firstserver.pid
+
+A new server is started when the configuration changes
+
+  $ echo '[ui]' >> $HGRCPATH
+  $ echo 'username = changed' >> $HGRCPATH
+  $ ../chg showconfig ui.username
+  changed
+  $ cmp -s ../server.pid ../firstserver.pid || echo restarted
+  restarted
+
+or when a client runs with another one
+
+  $ cat ../server.pid > ../firstserver.pid
+  $ HGRCPATH= ../chg showconfig ui.username
+  $ cmp -s ../server.pid ../firstserver.pid || echo restarted
+  restarted
+
+  $ cd ..
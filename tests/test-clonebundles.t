@@ -0,0 +1,214 @@
+  $ "$TESTDIR/hghave" serve || exit 80
+
+Set up a server
+
+  $ hg init server
+  $ cd server
+  $ echo a > a
+  $ hg -q commit -A -m a
+  $ echo b > b
+  $ hg -q commit -A -m b
+  $ cd ..
+  $ hg -R server serve -d -p $HGPORT --pid-file hg.pid
+  $ cat hg.pid >> $DAEMON_PIDS
+
+Clone bundles are not advertised before being generated
+
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT '?cmd=capabilities' | grep -c clonebundles
+  0
+  [1]
+
+A URL is needed to generate them
+
+  $ hg -R server debugclonebundles
+  abort: no URL configured for clone bundles
+  (set server.clonebundlesurl)
+  [255]
+
+  $ cat >> server/.hg/hgrc << EOF
+  > [server]
+  > clonebundlesurl = http://localhost:$HGPORT1/
+  > EOF
+  $ hg -R server debugclonebundles -t HG10BZ -t stream -v
+  writing ad6cc704db75.hg10bz
+  2 changesets found
+  writing ad6cc704db75.stream
+  http://localhost:$HGPORT1/ad6cc704db75.hg10bz
+  http://localhost:$HGPORT1/ad6cc704db75.stream
+  $ cat server/.hg/clonebundles.manifest
+  http://localhost:$HGPORT1/ad6cc704db75.hg10bz TYPE=HG10BZ
+  http://localhost:$HGPORT1/ad6cc704db75.stream REQUIREMENTS=revlogv1 TYPE=stream
+  $ ls server/.hg/clonebundles
+  ad6cc704db75.hg10bz
+  ad6cc704db75.stream
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT '?cmd=capabilities' | grep -c clonebundles
+  1
+
+Nothing changes when run again
+
+  $ hg -R server debugclonebundles -t HG10BZ -t stream
+  ad6cc704db75.hg10bz is up to date
+  ad6cc704db75.stream is up to date
+
+Falling back when the bundle cannot be fetched
+
+  $ hg clone http://localhost:$HGPORT/ fallback
+  applying clone bundle from http://localhost:$HGPORT1/ad6cc704db75.hg10bz
+  error fetching bundle: [Errno 111] Connection refused
+  falling back to regular clone
+  requesting all changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 2 changesets with 2 changes to 2 files
+  updating to branch default
+  2 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R fallback log -q
+  1:d2ae7f538514
+  0:cb9a9f314b8b
+
+Publish the bundles with a static web server
+
+  $ cat > dumb.py <<EOF
+  > import BaseHTTPServer, SimpleHTTPServer, os, signal, sys
+  > class handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+  >     def log_message(self, *args):
+  >         pass
+  > signal.signal(signal.SIGTERM, lambda x, y: sys.exit(0))
+  > httpd = BaseHTTPServer.HTTPServer(('localhost', int(os.environ['HGPORT1'])),
+  >                                   handler)
+  > os.chdir(sys.argv[1])
+  > fp = open(sys.argv[2], 'wb')
+  > fp.write(str(os.getpid()) + '\n')
+  > fp.close()
+  > httpd.serve_forever()
+  > EOF
+  $ python dumb.py server/.hg/clonebundles "$TESTTMP/dumb.pid" > /dev/null 2>&1 &
+  $ while [ ! -s dumb.pid ]; do sleep 0.1; done
+  $ cat dumb.pid >> $DAEMON_PIDS
+
+The changesets committed after the bundle was generated are pulled
+
+  $ echo c > server/c
+  $ hg -R server -q commit -A -m c
+  $ hg clone http://localhost:$HGPORT/ full
+  applying clone bundle from http://localhost:$HGPORT1/ad6cc704db75.hg10bz
+  adding changesets
+  adding manifests
+  adding file changes
+  added 2 changesets with 2 changes to 2 files
+  finished applying clone bundle
+  searching for changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 1 changesets with 1 changes to 1 files
+  updating to branch default
+  3 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R full log -q
+  2:177f92b77385
+  1:d2ae7f538514
+  0:cb9a9f314b8b
+  $ hg -R full verify -q
+
+  $ hg clone --uncompressed http://localhost:$HGPORT/ stream
+  applying clone bundle from http://localhost:$HGPORT1/ad6cc704db75.stream
+  4 files to transfer, 599 bytes of data
+  transferred 599 bytes in * seconds (*/sec) (glob)
+  finished applying clone bundle
+  searching for changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 1 changesets with 1 changes to 1 files
+  updating to branch default
+  3 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R stream log -q
+  2:177f92b77385
+  1:d2ae7f538514
+  0:cb9a9f314b8b
+  $ hg -R stream verify -q
+
+Falling back when the bundle is truncated, with whatever it wrote to the
+store removed
+
+  $ cd server/.hg/clonebundles
+  $ cp ad6cc704db75.hg10bz hg10bz.orig
+  $ cp ad6cc704db75.stream stream.orig
+  $ python -c "open('ad6cc704db75.hg10bz', 'r+b').truncate(100)"
+  $ python -c "open('ad6cc704db75.stream', 'r+b').truncate(300)"
+  $ cd ../../..
+  $ hg clone http://localhost:$HGPORT/ truncated
+  applying clone bundle from http://localhost:$HGPORT1/ad6cc704db75.hg10bz
+  adding changesets
+  transaction abort!
+  rollback completed
+  error applying bundle: stream ended unexpectedly (got 0 bytes, expected 4)
+  falling back to regular clone
+  requesting all changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 3 changesets with 3 changes to 3 files
+  updating to branch default
+  3 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R truncated log -q
+  2:177f92b77385
+  1:d2ae7f538514
+  0:cb9a9f314b8b
+  $ hg -R truncated verify -q
+  $ hg clone --uncompressed http://localhost:$HGPORT/ truncatedstream
+  applying clone bundle from http://localhost:$HGPORT1/ad6cc704db75.stream
+  4 files to transfer, 599 bytes of data
+  error applying bundle: stream ended unexpectedly (got 100 bytes, expected 227)
+  falling back to regular clone
+  streaming all changes
+  5 revlogs to transfer
+  transferred 904 bytes in * seconds (*/sec) (glob)
+  updating to branch default
+  3 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R truncatedstream log -q
+  2:177f92b77385
+  1:d2ae7f538514
+  0:cb9a9f314b8b
+  $ hg -R truncatedstream verify -q
+  $ cd server/.hg/clonebundles
+  $ mv hg10bz.orig ad6cc704db75.hg10bz
+  $ mv stream.orig ad6cc704db75.stream
+  $ cd ../../..
+
+Regenerating replaces the bundles and keeps the previous ones
+
+  $ hg -R server debugclonebundles -t HG10BZ -v
+  writing 05c9bf3505e4.hg10bz
+  3 changesets found
+  http://localhost:$HGPORT1/05c9bf3505e4.hg10bz
+  $ ls server/.hg/clonebundles
+  05c9bf3505e4.hg10bz
+  ad6cc704db75.hg10bz
+  ad6cc704db75.stream
+  $ hg -R server debugclonebundles -t HG10BZ -v
+  05c9bf3505e4.hg10bz is up to date
+  removing ad6cc704db75.hg10bz
+  removing ad6cc704db75.stream
+  http://localhost:$HGPORT1/05c9bf3505e4.hg10bz
+  $ echo d > server/d
+  $ hg -R server -q commit -A -m d
+  $ hg -R server debugclonebundles -t HG10BZ -v
+  writing eb5f5f88e374.hg10bz
+  4 changesets found
+  http://localhost:$HGPORT1/eb5f5f88e374.hg10bz
+  $ ls server/.hg/clonebundles
+  05c9bf3505e4.hg10bz
+  eb5f5f88e374.hg10bz
+
+Disabled on the client
+
+  $ hg clone --config ui.clonebundles=false http://localhost:$HGPORT/ plain
+  requesting all changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 4 changesets with 4 changes to 4 files
+  updating to branch default
+  4 files updated, 0 files merged, 0 files removed, 0 files unresolved
@@ -1,4 +1,4 @@
-import sys, os, struct, subprocess, cStringIO, re, shutil
+import sys, os, struct, subprocess, cStringIO, re, shutil, socket, time
 
 def connect(path=None):
     cmdline = ['hg', 'serve', '--cmdserver', 'pipe']
@@ -48,6 +48,8 @@ def runcommand(server, args, output=sys.stdout, error=sys.stderr, input=None):
             writeblock(server, input.readline(data))
         elif ch == 'r':
             return struct.unpack('>i', data)[0]
+        elif ch == 's':
+            print 'cache: %s' % data,
         else:
             print "unexpected channel %c: %r" % (ch, data)
             if ch.isupper():
@@ -72,7 +74,7 @@ def hellomessage(server):
     ch, data = readchannel(server)
     # escaping python tests output not supported
     print '%c, %r' % (ch, re.sub('encoding: [a-zA-Z0-9-]+', 'encoding: ***',
-                                 data))
+                                 re.sub('pid: [0-9]+', 'pid: ***', data)))
 
     # run an arbitrary command to make sure the next thing the server sends
     # isn't part of the hello message
@@ -257,6 +259,77 @@ def phasecacheafterstrip(server):
     # shouldn't raise "7966c8e3734d: no node!"
     runcommand(server, ['branches'])
 
+def streamstatus(server):
+    readchannel(server)
+    os.mkdir('streamed')
+    for name in 'abc':
+        f = open('streamed/' + name, 'wb')
+        f.write(name)
+        f.close()
+
+    # each file comes in its own output blocks
+    class blocks(list):
+        def write(self, data):
+            self.append(data)
+        def flush(self):
+            pass
+    out = blocks()
+    runcommand(server, ['status', '--stream', 'streamed'], output=out)
+    print '%d blocks' % len(out)
+    print ''.join(sorted(''.join(out).splitlines(True))),
+
+def cachestats(server):
+    readchannel(server)
+    runcommand(server, ['log', '-r', 'tip', '--template', '{rev}\n'])
+    runcommand(server, ['log', '-r', 'tip', '--template', '{rev}\n'])
+    runcommand(server, ['tags'])
+    runcommand(server, ['tags'])
+
+    # changed outside the server
+    os.system('hg tag -q -l outside')
+    runcommand(server, ['tags'])
+
+    # other repositories are cached too
+    os.system('hg init other')
+    runcommand(server, ['id', '-R', 'other'])
+    runcommand(server, ['id', '--cwd', 'other'])
+
+class unixconnection(object):
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.connect(path)
+        self.stdin = self.sock.makefile('wb')
+        self.stdout = self.sock.makefile('rb')
+
+    def close(self):
+        self.stdin.close()
+        self.stdout.close()
+        self.sock.close()
+
+def unixserver():
+    print
+    print 'testing unixserver:'
+    print
+    sys.stdout.flush()
+    os.system('hg serve --cmdserver unix -a sock -d --pid-file unix.pid')
+    for i in xrange(100):
+        if os.path.exists('sock'):
+            break
+        time.sleep(0.1)
+    try:
+        # each client is served by its own process
+        for i in xrange(2):
+            conn = unixconnection('sock')
+            ch, data = readchannel(conn)
+            data = re.sub('pid: [0-9]+', 'pid: ***', data)
+            print '%c, %r' % (ch, re.sub('encoding: [a-zA-Z0-9-]+',
+                                         'encoding: ***', data))
+            runcommand(conn, ['id', '-r', 'tip'])
+            runcommand(conn, ['tags'])
+            conn.close()
+    finally:
+        os.kill(int(open('unix.pid').read()), 15)
+
 if __name__ == '__main__':
     os.system('hg init')
 
@@ -280,3 +353,12 @@ if __name__ == '__main__':
     check(branch)
     check(hgignore)
     check(phasecacheafterstrip)
+    check(streamstatus)
+
+    hgrc = open('.hg/hgrc', 'a')
+    hgrc.write('[cmdserver]\ncachestats=True\n')
+    hgrc.close()
+    check(cachestats)
+
+    if getattr(socket, 'AF_UNIX', None):
+        unixserver()
@@ -71,6 +71,7 @@ Show debug commands if there are no other candidates
   debugbuilddag
   debugbundle
   debugcheckstate
+  debugclonebundles
   debugcommands
   debugcomplete
   debugconfig
@@ -93,6 +94,7 @@ Show debug commands if there are no other candidates
   debugpushkey
   debugpvec
   debugrebuilddirstate
+  debugredelta
   debugrename
   debugrevlog
   debugrevspec
@@ -210,7 +212,7 @@ Show all commands + options
   push: force, rev, bookmark, branch, new-branch, ssh, remotecmd, insecure
   remove: after, force, include, exclude
   serve: accesslog, daemon, daemon-pipefds, errorlog, port, address, prefix, name, web-conf, webdir-conf, pid-file, stdio, cmdserver, templates, style, ipv6, certificate
-  status: all, modified, added, removed, deleted, clean, unknown, ignored, no-status, copies, print0, rev, change, include, exclude, subrepos
+  status: all, modified, added, removed, deleted, clean, unknown, ignored, no-status, copies, print0, rev, change, stream, include, exclude, subrepos
   summary: remote
   update: clean, check, date, rev
   addremove: similarity, include, exclude, dry-run
@@ -227,6 +229,7 @@ Show all commands + options
   debugbuilddag: mergeable-file, overwritten-file, new-file
   debugbundle: all
   debugcheckstate: 
+  debugclonebundles: type
   debugcommands: 
   debugcomplete: options
   debugdag: tags, branches, dots, spaces
@@ -248,6 +251,7 @@ Show all commands + options
   debugpushkey: 
   debugpvec: 
   debugrebuilddirstate: rev
+  debugredelta: 
   debugrename: rev
   debugrevlog: changelog, manifest, dump
   debugrevspec: 
@@ -0,0 +1,61 @@
+Parsed configuration files are kept in HGRCCACHE
+
+  $ HGRCCACHE="$TESTTMP/rccache"; export HGRCCACHE
+  $ cat > showcache.py << EOF
+  > import marshal, os, sys
+  > entries = {}
+  > if os.path.exists(sys.argv[1]):
+  >     entries = marshal.load(open(sys.argv[1], "rb"))[1]
+  > for k, v in entries.iteritems():
+  >     if k[0].endswith("cached/.hg/hgrc"):
+  >         print k[0], len(v[0]), v[1][0]
+  > EOF
+  $ hg init cached
+  $ cd cached
+  $ cat > .hg/hgrc << EOF
+  > [extra]
+  > a = 1
+  > %include ../../included
+  > EOF
+  $ echo '[extra]' > ../included
+
+files are cached once they did not change for a few seconds
+
+  $ sleep 3
+  $ hg showconfig extra
+  extra.a=1
+  $ python ../showcache.py ../rccache
+  $TESTTMP/cached/.hg/hgrc 2 [('extra', [('a', '1', '$TESTTMP/cached/.hg/hgrc:2')])]
+
+the cache is only readable by its owner
+
+  $ ls -l ../rccache | cut -c1-10
+  -rw-------
+
+changes to the files and the included ones are seen
+
+  $ echo 'b = 2' >> ../included
+  $ hg showconfig extra
+  extra.a=1
+  extra.b=2
+  $ echo 'b = 3' >> .hg/hgrc
+  $ hg showconfig extra --debug | grep extra
+  $TESTTMP/cached/.hg/hgrc:2: extra.a=1
+  $TESTTMP/cached/.hg/hgrc:4: extra.b=3
+  $ cd ..
+
+included paths depending on the environment are expanded again
+
+  $ mkdir a b
+  $ echo '[env]' > a/rc
+  $ echo 'x = a' >> a/rc
+  $ echo '[env]' > b/rc
+  $ echo 'x = b' >> b/rc
+  $ echo '%include $RCDIR/rc' > envrc
+  $ sleep 3
+  $ RCDIR=a HGRCPATH=envrc hg showconfig env
+  env.x=a
+  $ RCDIR=b HGRCPATH=envrc hg showconfig env
+  env.x=b
+  $ RCDIR=a HGRCPATH=envrc hg showconfig env
+  env.x=a
@@ -0,0 +1,66 @@
+Benchmark suites run with contrib/perfbench.py
+
+  $ cat > suite.ini << EOF
+  > [repos]
+  > linear = debugbuilddag +20
+  > branchy = debugbuilddag '+5:a *a+3 /a+2'
+  >   phase --public -r 4
+  > [benchmarks]
+  > heads = perfheads
+  > draft = perfrevset 'draft()'
+  > EOF
+
+  $ perfbench() {
+  >     python "$TESTDIR/../contrib/perfbench.py" --hg hg -w repos \
+  >         --config perf.mintime=0 --config perf.maxtime=0 "$@"
+  > }
+
+Each benchmark runs on each repository
+
+  $ perfbench -v -o results.json suite.ini
+  creating $TESTTMP/repos/linear
+  running linear:heads
+  running linear:draft
+  creating $TESTTMP/repos/branchy
+  running branchy:heads
+  running branchy:draft
+  branchy:draft                    *.* +- *.* (3 runs) (glob)
+  branchy:heads                    *.* +- *.* (3 runs) (glob)
+  linear:draft                     *.* +- *.* (3 runs) (glob)
+  linear:heads                     *.* +- *.* (3 runs) (glob)
+  $ hg -R repos/branchy phase -r 4 -r 5
+  4: public
+  5: draft
+  $ python -c "import json; r = json.load(open('results.json'))['results']; \
+  >     print sorted(r['linear:heads']), sorted(r['linear:heads']['wall'])"
+  [u'comb', u'count', u'sys', u'title', u'user', u'wall'] [u'mean', u'median', u'min', u'stdev']
+
+Repositories are reused, results are compared with a baseline
+
+  $ python -c "import json; d = json.load(open('results.json')); \
+  >     r = d['results']; r['linear:heads']['wall']['median'] = 1000.; \
+  >     r['branchy:heads']['wall']['median'] = 1000.; \
+  >     r['linear:draft']['wall']['median'] = 0.000001; \
+  >     del r['branchy:draft']; json.dump(d, open('baseline.json', 'w'))"
+  $ perfbench -v -b baseline.json -k heads -k linear:draft suite.ini
+  running linear:heads
+  running linear:draft
+  running branchy:heads
+  branchy:heads                    *.* 1000.000000  -100.0% (glob)
+  linear:draft                     *.*   0.000001 +*.*% REGRESSION (glob)
+  linear:heads                     *.* 1000.000000  -100.0% (glob)
+  [1]
+  $ perfbench -b baseline.json -k branchy suite.ini
+  branchy:draft                    *.*        new (glob)
+  branchy:heads                    *.* 1000.000000  -100.0% (glob)
+
+Repositories are created again when their commands change
+
+  $ sed 's/+20/+10/' suite.ini > suite.tmp
+  $ mv suite.tmp suite.ini
+  $ perfbench -v -k linear:heads suite.ini
+  creating $TESTTMP/repos/linear
+  running linear:heads
+  linear:heads                     *.* +- *.* (3 runs) (glob)
+  $ hg -R repos/linear log -r tip --template '{rev}\n'
+  9
@@ -18,8 +18,13 @@
       deltas    :  0 ( 0.00%)
   
   avg chain length  : 0
+  max chain length  : 0
   compression ratio : 0
   
   uncompressed data size (min/max/avg) : 43 / 43 / 43
   full revision size (min/max/avg)     : 44 / 44 / 44
   delta size (min/max/avg)             : 0 / 0 / 0
+  chain span (min/max/avg)             : 44 / 44 / 44
+  
+  chain length distribution:
+      0        : 1 (100.00%)
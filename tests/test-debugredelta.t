@@ -0,0 +1,149 @@
+  $ hg init repo
+  $ cd repo
+  $ hg debugbuilddag --mergeable-file '+300:a *200/3 +10 <a +5/a'
+  $ hg debugrevlog mf | egrep 'flags|revision size :|chain length'
+  flags  : inline
+  revision size : 9323
+  avg chain length  : 152
+  max chain length  : 310
+  chain length distribution:
+
+Rewriting the store keeps the content of the revlogs
+
+  $ hg log --debug --template '{rev}:{node} {manifest}\n' > ../log
+  $ hg cat -r 'merge()' mf > ../mf
+  $ hg debugredelta
+  old store size: 106422 bytes
+  new store size: 106422 bytes
+  $ hg verify -q
+  $ hg log --debug --template '{rev}:{node} {manifest}\n' | cmp ../log
+  $ ls .hg/store/data
+  mf.i
+
+Revlogs created before generaldelta was enabled are converted
+
+  $ echo generaldelta >> .hg/requires
+  $ hg debugredelta -v
+  rewriting data/mf.i
+  rewriting 00manifest.i
+  rewriting 00changelog.i
+  old store size: 106422 bytes
+  new store size: 104726 bytes
+  $ hg debugrevlog -c | grep flags
+  flags  : inline
+  $ hg debugrevlog mf | egrep 'flags|revision size :|chain length'
+  flags  : inline, generaldelta
+  revision size : 7627
+  avg chain length  : 157
+  max chain length  : 308
+  chain length distribution:
+  $ hg verify -q
+  $ hg log --debug --template '{rev}:{node} {manifest}\n' | cmp ../log
+  $ hg cat -r 'merge()' mf | cmp ../mf
+
+The chain length limit applies to the rewritten revlogs
+
+  $ hg debugredelta --config format.maxchainlen=4 > /dev/null
+  $ hg debugrevlog mf | grep 'max chain length'
+  max chain length  :  4
+  $ hg verify -q
+  $ hg cat -r 'merge()' mf | cmp ../mf
+
+The original files are put back when replacing them is interrupted
+
+  $ cat > $TESTTMP/interrupt.py <<EOF
+  > import os
+  > from mercurial import util
+  > origrename = util.rename
+  > def rename(src, dst):
+  >     origrename(src, dst)
+  >     if src.endswith('redelta.tmp/00manifest.i'):
+  >         if os.environ.get('HARDEXIT'):
+  >             os._exit(1)
+  >         raise util.Abort('interrupted')
+  > util.rename = rename
+  > EOF
+  $ hg debugredelta --config extensions.interrupt=$TESTTMP/interrupt.py
+  restoring revlog files of an interrupted redelta
+  abort: interrupted
+  [255]
+  $ ls .hg/store
+  00changelog.i
+  00manifest.i
+  data
+  fncache
+  phaseroots
+  undo
+  undo.phaseroots
+  $ hg verify -q
+  $ hg log --debug --template '{rev}:{node} {manifest}\n' | cmp ../log
+
+or by hg recover after a crash
+
+  $ HARDEXIT=1 hg debugredelta --config extensions.interrupt=$TESTTMP/interrupt.py
+  [1]
+  $ ls .hg/store
+  00changelog.i
+  00manifest.i
+  00manifest.i.redelta-backup
+  data
+  fncache
+  lock
+  phaseroots
+  redelta.swap
+  redelta.tmp
+  undo
+  undo.phaseroots
+  $ echo a > a
+  $ hg ci -Am crashed
+  adding a
+  abort: abandoned transaction found - run hg recover!
+  [255]
+  $ hg forget -q a
+  $ rm a
+  $ hg recover
+  restoring revlog files of an interrupted redelta
+  checking changesets
+  checking manifests
+  crosschecking files in changesets and manifests
+  checking files
+  1 files, 317 changesets, 317 total revisions
+  $ ls .hg/store
+  00changelog.i
+  00manifest.i
+  data
+  fncache
+  phaseroots
+  undo
+  undo.phaseroots
+  $ hg verify -q
+  $ hg log --debug --template '{rev}:{node} {manifest}\n' | cmp ../log
+
+or when the rewrite itself crashed
+
+  $ cat > $TESTTMP/crash.py <<EOF
+  > import os
+  > from mercurial import redelta
+  > def swap(ui, vfs, files):
+  >     os._exit(1)
+  > redelta._swap = swap
+  > EOF
+  $ hg debugredelta --config extensions.crash=$TESTTMP/crash.py
+  [1]
+  $ ls .hg/store/redelta.tmp
+  data
+  $ hg recover
+  removing temporary files of an interrupted redelta
+  checking changesets
+  checking manifests
+  crosschecking files in changesets and manifests
+  checking files
+  1 files, 317 changesets, 317 total revisions
+  $ ls .hg/store
+  00changelog.i
+  00manifest.i
+  data
+  fncache
+  phaseroots
+  undo
+  undo.phaseroots
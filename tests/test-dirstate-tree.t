@@ -0,0 +1,148 @@
+  $ hg init --config format.dirstatetree=1 repo
+  $ cd repo
+  $ grep dirstatetree .hg/requires
+  dirstatetree
+
+The dirstate is a docket naming the data file holding the entries
+
+  $ mkdir -p a/b c build
+  $ echo a > a/f
+  $ echo b > a/b/g
+  $ echo c > c/h
+  $ for i in 0 1 2 3 4 5 6 7 8 9; do echo $i > c/$i; done
+  $ echo o > build/x.o
+  $ echo '\.o$' > .hgignore
+  $ touch -t 200001010000 a/f a/b/g c/* .hgignore
+  $ hg ci -qAm0
+  $ touch -t 200001010000 a a/b c build
+  $ hg st
+  $ wc -c < .hg/dirstate
+  \s*104 (re)
+  $ datafile() {
+  >     python -c 'import sys; sys.path.insert(0, "'$TESTDIR'/..")
+  > from mercurial import dirstatetree
+  > pl, uid, size, ignore = dirstatetree.parsedocket(open(".hg/dirstate").read())
+  > print dirstatetree.datafile(uid), size' > ../after
+  >     if [ "`cut -d' ' -f1 ../before`" = "`cut -d' ' -f1 ../after`" ]; then
+  >         echo "appended `cut -d' ' -f2 ../before` -> `cut -d' ' -f2 ../after`"
+  >     else
+  >         echo rewritten
+  >     fi
+  >     mv ../after ../before
+  > }
+  $ touch ../before
+  $ datafile
+  rewritten
+  $ ls .hg/dirstate.* | wc -l
+  \s*2 (re)
+
+Small changes are appended to the data file
+
+  $ echo u > a/u
+  $ touch -t 200001010000 a/u
+  $ touch -t 200101010000 a
+  $ hg st
+  ? a/u
+  $ hg add a/u
+  $ hg st
+  A a/u
+  $ datafile
+  appended * (glob)
+  $ hg forget a/u
+  $ hg st
+  ? a/u
+  $ hg debugstate --nodates | grep -v c/
+  n 644          5 .hgignore
+  n 644          2 a/b/g
+  n 644          2 a/f
+
+It is rewritten under a new name once it is mostly made of replaced
+blocks, the data file of the rollback dirstate being kept
+
+  $ hg rm -q c
+  $ datafile
+  rewritten
+  $ hg revert -q c
+  $ datafile
+  appended * (glob)
+  $ hg ci -qAm1
+  $ datafile
+  rewritten
+  $ ls .hg/dirstate.* | wc -l
+  \s*2 (re)
+  $ hg rollback -q
+  $ hg st
+  A a/u
+  $ hg ci -qm1
+  $ hg rm a/u
+  $ hg st
+  R a/u
+  $ hg ci -qm2
+  $ ls .hg/dirstate.* | wc -l
+  \s*2 (re)
+
+Directories holding only tracked and ignored files are not listed again
+until their modification time changes
+
+  $ touch -t 200001010000 a a/b c build
+  $ hg st
+  $ echo unseen > a/b/unseen
+  $ touch -t 200001010000 a/b
+  $ hg st
+  $ hg st -u a
+  ? a/b/unseen
+  $ touch a/b
+  $ hg st
+  ? a/b/unseen
+  $ rm a/b/unseen
+  $ hg st
+
+Directories holding unknown files are always listed
+
+  $ echo u > c/u
+  $ hg st
+  ? c/u
+  $ touch -t 200001010000 c
+  $ hg st
+  ? c/u
+  $ rm c/u
+
+New directories are found in unchanged ones
+
+  $ mkdir a/new
+  $ echo n > a/new/n
+  $ hg st
+  ? a/new/n
+  $ rm -r a/new
+
+The cached times are dropped when the ignore rules change
+
+  $ touch -t 200001010000 a a/b c build
+  $ hg st
+  $ echo unseen > build/unseen
+  $ touch -t 200001010000 build
+  $ hg st
+  $ echo 'build/x' >> .hgignore
+  $ hg st
+  M .hgignore
+  ? build/unseen
+
+Removing and adding files
+
+  $ hg rm -q a/b/g
+  $ hg st
+  M .hgignore
+  R a/b/g
+  ? build/unseen
+  $ hg revert -q a/b/g
+  $ hg st
+  M .hgignore
+  ? build/unseen
+  $ hg up -qC 0
+  $ hg st
+  ? build/unseen
+  $ hg debugrebuilddirstate
+  $ hg st
+  ? build/unseen
+
+  $ cd ..
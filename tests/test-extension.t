@@ -573,3 +573,42 @@ Declare the version as supporting this hg version, show regular bts link:
   ** Python * (glob)
   ** Mercurial Distributed SCM (*) (glob)
   ** Extensions loaded: throw
+
+The bundled extensions loaded only for their commands declare all of them
+and have nothing to set up:
+
+  $ mkdir lazy
+  $ cd lazy
+  $ cat > checklazy.py <<EOF
+  > from mercurial import extensions
+  > for name, cmds in sorted(extensions._lazycommands.items()):
+  >     mod = __import__('hgext.%s' % name, None, None, ['cmdtable'])
+  >     table = getattr(mod, 'cmdtable', {})
+  >     names = []
+  >     for key in table:
+  >         names.extend(key.lstrip('^').split('|'))
+  >     if sorted(names) != sorted(cmds):
+  >         print name, sorted(names)
+  >     for setup in ('uisetup', 'extsetup', 'reposetup'):
+  >         if getattr(mod, setup, None):
+  >             print name, setup
+  > EOF
+  $ python checklazy.py
+  $ cd ..
+
+They are loaded when one of their commands or aliases runs:
+
+  $ hg --config extensions.children= --config alias.kids=children \
+  >   kids --help | head -1
+  hg kids [-r REV] [FILE]
+  $ hg --config extensions.children= chi --help | head -1
+  hg children [-r REV] [FILE]
+  $ hg --config extensions.children= help -e children | head -1
+  children extension - command to display child changesets (DEPRECATED)
+
+Nothing is deferred when an extension wrapping the commands of all the
+others is enabled:
+
+  $ hg --config extensions.mq= --config extensions.children= \
+  >   help children | grep -- --mq
+      --mq                operate on patch repository
@@ -0,0 +1,117 @@
+Status only looks at the paths reported by the filesystem monitor
+
+  $ hg init repo
+  $ cd repo
+  $ mkdir -p a/b c
+  $ echo a > a/f
+  $ echo b > a/b/g
+  $ echo c > c/h
+  $ echo '\.o$' > .hgignore
+  $ touch -t 200001010000 a/f a/b/g c/h .hgignore
+  $ hg ci -qAm0
+  $ cat >> .hg/hgrc << EOF
+  > [fsmonitor]
+  > backend = eventlog
+  > EOF
+  $ changed() {
+  >     for f in "$@"; do
+  >         echo $f >> .hg/fsmonitor.log
+  >     done
+  > }
+  $ st() {
+  >     hg status --debug "$@" | grep -v '^fsmonitor: 0 paths' | grep -v '^skip '
+  > }
+
+Without a log, the whole working directory is walked
+
+  $ st
+  fsmonitor: walking the whole working directory
+  $ echo 'session 1' > .hg/fsmonitor.log
+  $ st
+  fsmonitor: walking the whole working directory
+  $ head -1 .hg/fsmonitor.state
+  session 1:10
+
+Then only the logged changes are seen
+
+  $ echo aa > a/f
+  $ echo cc > c/h
+  $ changed a/f
+  $ st
+  fsmonitor: 1 paths changed
+  M a/f
+
+Changed directories are listed for new files, new directories are walked
+
+  $ echo u > a/u
+  $ echo o > a/u.o
+  $ mkdir -p new/deep
+  $ echo n > new/deep/n
+  $ changed a new
+  $ st
+  fsmonitor: 2 paths changed
+  M a/f
+  ? a/u
+  ? new/deep/n
+  $ st -mard
+  M a/f
+
+Files removed with their directory are reported as missing
+
+  $ rm -r a/b
+  $ changed a/b
+  $ st
+  fsmonitor: 1 paths changed
+  M a/f
+  ! a/b/g
+  ? a/u
+  ? new/deep/n
+
+Changes to the dirstate are taken into account
+
+  $ hg add -q new
+  $ hg forget a/f
+  $ st
+  A new/deep/n
+  R a/f
+  ! a/b/g
+  ? a/u
+  $ hg add -q a/f
+  $ hg rm -q --after a/b/g
+  $ st
+  M a/f
+  A new/deep/n
+  R a/b/g
+  ? a/u
+  $ hg ci -qm1 a new
+  $ st
+  ? a/u
+
+The change to c/h was not logged, a full walk sees it as do the clean and
+ignored file listings
+
+  $ st -A c
+  M c/h
+  $ st -i
+  I a/u.o
+
+The whole working directory is walked again when the session changes,
+the dirstate is written by another program or the ignore rules change
+
+  $ echo 'session 2' > .hg/fsmonitor.log
+  $ st
+  fsmonitor: walking the whole working directory
+  M c/h
+  ? a/u
+  $ hg --config fsmonitor.backend= ci -qm2 c/h
+  $ st
+  fsmonitor: walking the whole working directory
+  ? a/u
+  $ echo 'u$' >> .hgignore
+  $ st
+  fsmonitor: walking the whole working directory
+  M .hgignore
+  $ st
+  M .hgignore
+
+  $ cd ..
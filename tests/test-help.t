@@ -478,6 +478,10 @@ Test command without options
       option can also be used as a shortcut to list the changed files of a
       revision from its first parent.
   
+      With --stream, files of the working directory are shown as soon as their
+      status is known rather than sorted and grouped by status, which lets
+      front-ends display them while the working directory is being walked.
+  
       The codes used to show the status of files are:
   
         M = modified
@@ -506,6 +510,7 @@ Test command without options
    -0 --print0              end filenames with NUL, for use with xargs
       --rev REV [+]         show difference from revision
       --change REV          list the changed files of a revision
+      --stream              show files as soon as their status is known
    -I --include PATTERN [+] include names matching the given patterns
    -X --exclude PATTERN [+] exclude names matching the given patterns
    -S --subrepos            recurse into subrepositories
@@ -134,3 +134,87 @@ Check patterns that match only the directory
   ? a.c
   ? a.o
   ? syntax
+
+The regular expressions of the patterns are cached until the ignore files
+are modified, once they are older than the current second
+
+  $ echo "syntax: glob" > .hgignore
+  $ echo "*.o" >> .hgignore
+  $ hg status
+  A dir/b.o
+  ? .hgignore
+  ? a.c
+  ? syntax
+  $ touch -t 200001010000 .hgignore
+  $ hg status
+  A dir/b.o
+  ? .hgignore
+  ? a.c
+  ? syntax
+  $ sed 1,2d .hg/cache/ignore
+  r
+  (?:|.*/)[^/]*\.o(?:/|$)
+  $ hg debugignore
+  (?:(?:|.*/)[^/]*\.o(?:/|$))
+  $ echo "a.*" >> .hgignore
+  $ hg status
+  A dir/b.o
+  ? .hgignore
+  ? syntax
+  $ touch -t 200001010001 .hgignore
+  $ hg status
+  A dir/b.o
+  ? .hgignore
+  ? syntax
+  $ sed 1,2d .hg/cache/ignore
+  r
+  (?:|.*/)[^/]*\.o(?:/|$)
+  (?:|.*/)a\.[^/]*(?:/|$)
+  $ echo "[ui]" >> .hg/hgrc
+  $ echo "ignore.other = $TESTTMP/.hg/otherignore" >> .hg/hgrc
+  $ echo "re:^syn" > $TESTTMP/.hg/otherignore
+  $ touch -t 200001010000 $TESTTMP/.hg/otherignore
+  $ hg status
+  A dir/b.o
+  ? .hgignore
+  $ sed 1,2d .hg/cache/ignore
+  r
+  (?:|.*/)[^/]*\.o(?:/|$)
+  (?:|.*/)a\.[^/]*(?:/|$)
+  ^syn
+  $ echo > $TESTTMP/.hg/otherignore
+  $ hg status
+  A dir/b.o
+  ? .hgignore
+  ? syntax
+
+A cached entry is only used while the files keep the same size and times
+
+  $ touch -t 200001010000 $TESTTMP/.hg/otherignore
+  $ hg status -q
+  A dir/b.o
+  $ echo "re:^sy" > $TESTTMP/.hg/otherignore
+  $ touch -t 200001010000 $TESTTMP/.hg/otherignore
+  $ hg status
+  A dir/b.o
+  ? .hgignore
+  $ echo > $TESTTMP/.hg/otherignore
+
+Warnings are not cached
+
+  $ echo "syntax: invalid" > .hgignore
+  $ hg status
+  $TESTTMP/.hgignore: ignoring invalid syntax 'invalid' (glob)
+  A dir/b.o
+  ? .hgignore
+  ? a.c
+  ? a.o
+  ? dir/c.o
+  ? syntax
+  $ hg status -u
+  $TESTTMP/.hgignore: ignoring invalid syntax 'invalid' (glob)
+  ? .hgignore
+  ? a.c
+  ? a.o
+  ? dir/c.o
+  ? syntax
@@ -1114,7 +1114,7 @@ capabilities
   $ "$TESTDIR/get-with-headers.py" 127.0.0.1:$HGPORT '?cmd=capabilities'; echo
   200 Script output follows
   
-  lookup changegroupsubset branchmap pushkey known getbundle unbundlehash batch unbundle=HG10GZ,HG10BZ,HG10UN httpheader=1024
+  lookup changegroupsubset branchmap pushkey known getbundle unbundlehash batch unbundle=(HG10ZS,)?HG10GZ,HG10BZ,HG10UN httpheader=1024 changegroupversions=01,02 compression=(zstd,)?zlib (re)
 
 heads
 
@@ -1291,7 +1291,7 @@ capabilities
   $ "$TESTDIR/get-with-headers.py" 127.0.0.1:$HGPORT '?cmd=capabilities'; echo
   200 Script output follows
   
-  lookup changegroupsubset branchmap pushkey known getbundle unbundlehash batch stream-preferred stream unbundle=HG10GZ,HG10BZ,HG10UN httpheader=1024
+  lookup changegroupsubset branchmap pushkey known getbundle unbundlehash batch stream-preferred stream stream2 unbundle=(HG10ZS,)?HG10GZ,HG10BZ,HG10UN httpheader=1024 changegroupversions=01,02 compression=(zstd,)?zlib (re)
 
 heads
 
@@ -0,0 +1,55 @@
+
+  $ "$TESTDIR/hghave" inotify || exit 80
+  $ cat >> $HGRCPATH << EOF
+  > [extensions]
+  > inotify =
+  > [fsmonitor]
+  > backend = inotify
+  > EOF
+  $ st() {
+  >     hg status --debug "$@" | grep '^fsmonitor\|^[MARC!?I] '
+  > }
+
+  $ hg init repo
+  $ cd repo
+  $ mkdir -p a/b c
+  $ echo a > a/f
+  $ echo b > a/b/g
+  $ echo c > c/h
+  $ touch -t 200001010000 a/f a/b/g c/h
+  $ hg ci -qAm0
+
+Without the recorder, the whole working directory is walked
+
+  $ st
+  fsmonitor: inotify recorder not running
+  fsmonitor: walking the whole working directory
+  $ hg inrecord -d --pid-file=../hg.pid
+  $ cat ../hg.pid >> $DAEMON_PIDS
+  $ st
+  fsmonitor: walking the whole working directory
+
+The changes are recorded
+
+  $ echo aa > a/f
+  $ rm a/b/g
+  $ mkdir -p new/deep
+  $ echo n > new/deep/n
+  $ st
+  fsmonitor: * paths changed (glob)
+  M a/f
+  ! a/b/g
+  ? new/deep/n
+  $ hg ci -qAm1
+  $ st
+  fsmonitor: * paths changed (glob)
+
+The recorder removes its pid file when it stops
+
+  $ kill `cat ../hg.pid`
+  $ sleep 1
+  $ st
+  fsmonitor: inotify recorder not running
+  fsmonitor: walking the whole working directory
+
+  $ cd ..
@@ -1786,6 +1786,7 @@ largefiles pulled on update - no server side problems:
   getting changed largefiles
   using http://localhost:$HGPORT2/
   sending capabilities command
+  using gzip compression
   sending batch command
   getting largefiles: 0/1 lfile (0.00%)
   getting f1:02a439e5c31c526465ab1a0ca1f431f76b827b90
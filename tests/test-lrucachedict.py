@@ -31,5 +31,30 @@ def test_lrucachedict():
     d['f'] = 'vf'
     printifpresent(d, ['b', 'c', 'd', 'e', 'f'])
 
+def test_lrucachedictcost():
+    d = util.lrucachedict(10, maxcost=10)
+    d.insert('a', 'va', 4)
+    d.insert('b', 'vb', 4)
+    d['a']
+    print 'totalcost: %d' % d.totalcost
+
+    # 'b' should be dropped to make room for 'c'
+    d.insert('c', 'vc', 4)
+    printifpresent(d, ['a', 'b', 'c'])
+    print 'totalcost: %d' % d.totalcost
+
+    # too expensive to be cached at all
+    d.insert('d', 'vd', 11)
+    printifpresent(d, ['a', 'c', 'd'])
+
+    # replacing a value updates its cost
+    d.insert('a', 'va2', 1)
+    print 'totalcost: %d' % d.totalcost
+
+    d.clear()
+    printifpresent(d, ['a', 'c'])
+    print 'len: %d totalcost: %d' % (len(d), d.totalcost)
+
 if __name__ == '__main__':
     test_lrucachedict()
+    test_lrucachedictcost()
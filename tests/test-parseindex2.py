@@ -110,6 +110,11 @@ def runtest() :
     if py_res_2 != c_res_2:
         print "Parse index result (no inlined data) differs!"
 
+    # buffers, as used for memory mapped revlogs, are accepted too
+    if list(parsers.parse_index2(buffer(data_non_inlined), False)[0]) != \
+       c_res_2[0]:
+        print "Parse index result (from a buffer) differs!"
+
     ix = parsers.parse_index2(data_inlined, True)[0]
     for i, r in enumerate(ix):
         if r[7] == nullid:
@@ -0,0 +1,98 @@
+  $ cat >> $HGRCPATH << EOF
+  > [format]
+  > persistentnodemap = yes
+  > [extensions]
+  > mq =
+  > EOF
+
+  $ cat > checknodemap.py << EOF
+  > import sys
+  > from mercurial import hg, ui, revlog, error
+  > from mercurial.node import hex
+  > repo = hg.repository(ui.ui(), '.')
+  > for rl in (repo.unfiltered().changelog, repo.manifest):
+  >     # reference revlog relying on the index only
+  >     plain = revlog.revlog(repo.sopener, rl.indexfile)
+  >     nm = rl._pnodemap
+  >     ambiguous = 0
+  >     for r in plain:
+  >         n = plain.node(r)
+  >         assert rl.rev(n) == r
+  >         for l in (4, 5, 6, 12):
+  >             prefix = hex(n)[:l]
+  >             try:
+  >                 expected = plain._partialmatch(prefix)
+  >             except error.LookupError:
+  >                 expected = None
+  >                 ambiguous += 1
+  >             try:
+  >                 found = rl._partialmatch(prefix)
+  >             except error.LookupError:
+  >                 found = None
+  >             assert found == expected, (prefix, found, expected)
+  >     assert not rl.hasnode('\1' * 20)
+  >     print '%s: %d revisions, %d persisted, %d ambiguous prefixes' % (
+  >         rl.indexfile, len(rl), nm._revcount, ambiguous)
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ hg debugbuilddag --new-file '+300'
+  $ ls .hg/store/*.n
+  .hg/store/00changelog.n
+  .hg/store/00manifest.n
+  $ python ../checknodemap.py
+  00changelog.i: 300 revisions, 300 persisted, 6 ambiguous prefixes
+  00manifest.i: 300 revisions, 300 persisted, 0 ambiguous prefixes
+
+Lookups by node prefix use it
+
+  $ hg log -r 3f85 --template '{rev}:{node|short}\n'
+  150:3f85033a5f44
+  $ hg id -r 3f85
+  3f85033a5f44
+
+Rollback restores the previous tree
+
+  $ hg up -q tip
+  $ echo a > a
+  $ hg commit -qAm a
+  $ wc -c < .hg/store/00changelog.n
+  25344
+  $ hg rollback -q
+  $ wc -c < .hg/store/00changelog.n
+  25088
+  $ python ../checknodemap.py
+  00changelog.i: 300 revisions, 300 persisted, 6 ambiguous prefixes
+  00manifest.i: 300 revisions, 300 persisted, 0 ambiguous prefixes
+
+Stripping drops the file, it is rebuilt by the next transaction
+
+  $ hg strip -q -f 200
+  $ wc -c < .hg/store/00changelog.n
+  0
+  $ python ../checknodemap.py
+  00changelog.i: 200 revisions, 0 persisted, 6 ambiguous prefixes
+  00manifest.i: 200 revisions, 0 persisted, 0 ambiguous prefixes
+  $ echo a > a
+  $ hg commit -qAm a
+  $ python ../checknodemap.py
+  00changelog.i: 201 revisions, 201 persisted, 6 ambiguous prefixes
+  00manifest.i: 201 revisions, 201 persisted, 0 ambiguous prefixes
+
+Revisions added without the option are looked up from the index
+
+  $ echo b > b
+  $ hg commit -qAm b --config format.persistentnodemap=no
+  $ python ../checknodemap.py
+  00changelog.i: 202 revisions, 201 persisted, 6 ambiguous prefixes
+  00manifest.i: 202 revisions, 201 persisted, 0 ambiguous prefixes
+  $ echo c > c
+  $ hg commit -qAm c
+  $ python ../checknodemap.py
+  00changelog.i: 203 revisions, 203 persisted, 6 ambiguous prefixes
+  00manifest.i: 203 revisions, 203 persisted, 0 ambiguous prefixes
+
+  $ hg verify -q
+
+  $ cd ..
@@ -28,4 +28,41 @@ test --profile
 
 #endif
 
+test --profile with the startup report
+
+  $ hg --profile --config profiling.type=startup --config profiling.limit=2 \
+  >   --config extensions.children= st 2>../out
+  $ cat ../out
+  imported \d+ modules in \d+\.\d{3} secs: (re)
+    \d+\.\d{3} [a-z.]+ (re)
+    \d+\.\d{3} [a-z.]+ (re)
+  set up 0 extensions in \d+\.\d{3} secs: (re)
+
+the command-only extensions are loaded for their commands
+
+  $ hg --profile --config profiling.type=startup --config profiling.limit=2 \
+  >   --config extensions.children= children 2>../out
+  $ grep children ../out
+    \d+\.\d{3} children \(import \d+\.\d{3}\) (re)
+
+or as soon as mq, which wraps the commands of other extensions, is enabled
+
+  $ hg --profile --config profiling.type=startup --config profiling.limit=2 \
+  >   --config extensions.children= --config extensions.mq= st 2>../out
+  $ grep extensions ../out
+  set up 2 extensions in \d+\.\d{3} secs: (re)
+  $ grep children ../out
+    \d+\.\d{3} children \(import \d+\.\d{3}\) (re)
+
+the modules imported before the configuration is read are timed with
+HGPROF=startup
+
+  $ HGPROF=startup hg --profile --config profiling.limit=1000 st 2>&1 \
+  >   | grep -c mercurial.dispatch
+  1
+  $ hg --profile --config profiling.type=startup --config profiling.limit=1000 \
+  >   st 2>&1 | grep -c mercurial.dispatch
+  0
+  [1]
+
   $ cd ..
@@ -40,6 +40,22 @@ expect error, cloning not allowed
   requesting all changes
   abort: authorization failed
   [255]
+
+nor streaming the store or reading the manifest of clone bundles
+
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT '?cmd=stream_out2&compression=none'
+  401 pull not authorized
+  
+  0
+  pull not authorized
+  [1]
+
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT '?cmd=clonebundles'
+  401 pull not authorized
+  
+  0
+  pull not authorized
+  [1]
   $ "$TESTDIR/killdaemons.py" $DAEMON_PIDS
 
 serve errors
@@ -0,0 +1,45 @@
+Adding the file revisions of a changegroup with several threads gives
+the same repository
+
+  $ hg init source
+  $ cd source
+  $ for i in 0 1 2 3 4 5 6 7 8 9; do
+  >     mkdir -p d$i
+  >     echo $i > d$i/f
+  >     echo $i > g$i
+  > done
+  $ python -c "import random; random.seed(0); print '%x' % random.getrandbits(1200000)" > big
+  $ hg ci -qAm0
+  $ for i in 1 2 3; do
+  >     echo $i >> d$i/f
+  >     echo $i >> g0
+  >     echo $i >> big
+  >     hg ci -qm$i
+  > done
+  $ cd ..
+
+  $ hg init serial
+  $ hg -R serial pull -q source
+  $ hg init threads
+  $ hg -R threads --config worker.filelogthreads=4 --config server.validate=True \
+  >   pull --debug source | egrep "^files:|^added" | sed -n '1p;$p'
+  files: 1/21 chunks (4.76%)
+  added 4 changesets with 30 changes to 21 files
+  $ hg -R threads verify -q
+  $ for f in `cd serial/.hg/store; find . -name "*.[id]" | sort`; do
+  >     cmp serial/.hg/store/$f threads/.hg/store/$f
+  > done
+
+The transaction is rolled back once all the file revisions are written
+
+  $ hg init aborted
+  $ hg -R aborted --config worker.filelogthreads=4 \
+  >   --config hooks.pretxnchangegroup=false pull -q source
+  transaction abort!
+  rollback completed
+  abort: pretxnchangegroup hook exited with status 1
+  [255]
+  $ hg -R aborted verify -q
+  $ find aborted/.hg/store/data -type f -size +0
+  $ hg -R aborted --config worker.filelogthreads=4 pull -q source
+  $ hg -R aborted verify -q
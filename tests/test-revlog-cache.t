@@ -0,0 +1,36 @@
+Revision texts kept in a bounded cache per revlog
+
+  $ cat >> $HGRCPATH <<EOF
+  > [extensions]
+  > perf = $TESTDIR/../contrib/perf.py
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ for i in 0 1 2 3 4 5 6 7 8 9; do
+  >   for j in 0 1 2 3 4 5 6 7 8 9; do echo "line $i$j" >> f; done
+  >   hg ci -qAm $i
+  > done
+
+Without cache, going back to a revision rebuilds its delta chain
+
+  $ hg perfrevlogcache -d 3 .hg/store/data/f.i 2> /dev/null
+  hit 1 partial 3 miss 4
+
+With a cache, the texts are reused
+
+  $ hg perfrevlogcache -d 3 --cachesize 100000 .hg/store/data/f.i 2> /dev/null
+  hit 4 partial 3 miss 1
+
+Texts larger than the cache are not kept
+
+  $ hg perfrevlogcache -d 3 --cachesize 300 .hg/store/data/f.i 2> /dev/null
+  hit 2 partial 5 miss 1
+
+Commands give the same results with the cache enabled
+
+  $ hg annotate -r 5 f > ../nocache
+  $ hg --config format.revisioncachesize=1MB annotate -r 5 f > ../cache
+  $ cmp ../nocache ../cache
+  $ hg --config format.revisioncachesize=1MB update -q 3
+  $ hg --config format.revisioncachesize=1MB verify -q
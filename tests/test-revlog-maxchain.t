@@ -0,0 +1,54 @@
+Limits on the length and span of delta chains
+
+  $ cat > mkfile.py <<EOF
+  > import sys
+  > n = int(sys.argv[1])
+  > for i in xrange(200):
+  >     print 'line %d of revision %d' % (i, i < n and n or 0)
+  > EOF
+
+  $ hg init unbounded
+  $ cd unbounded
+  $ for i in 1 2 3 4 5 6 7 8 9 10; do
+  >   python ../mkfile.py $i > f
+  >   hg ci -qAm $i
+  > done
+  $ hg debugrevlog f | grep 'chain length'
+  avg chain length  :  4
+  max chain length  :  9
+  chain length distribution:
+  $ cd ..
+
+  $ hg init bounded
+  $ cd bounded
+  $ for i in 1 2 3 4 5 6 7 8 9 10; do
+  >   python ../mkfile.py $i > f
+  >   hg ci -qAm $i --config format.maxchainlen=3
+  > done
+  $ hg debugrevlog f | grep 'chain length'
+  avg chain length  :  1
+  max chain length  :  3
+  chain length distribution:
+  $ hg debugrevlog f | grep -A3 'distribution'
+  chain length distribution:
+      0        :  3 (30.00%)
+      1        :  3 (30.00%)
+      2-3      :  4 (40.00%)
+  $ hg verify -q
+  $ cd ..
+
+The limits also apply to revisions added by pull
+
+  $ hg init pulled
+  $ hg -R pulled pull -q unbounded --config format.maxchainlen=2
+  $ hg -R pulled debugrevlog f | grep 'max chain length'
+  max chain length  :  2
+
+  $ hg init spanned
+  $ hg -R spanned pull -q unbounded --config format.maxchainspan=600
+  $ hg -R spanned debugrevlog f | egrep 'chain (length|span)'
+  avg chain length  :  0
+  max chain length  :  2
+  chain span (min/max/avg)             : 475 / 596 / 522
+  chain length distribution:
+  $ hg -R spanned verify -q
@@ -0,0 +1,58 @@
+Revlogs read through memory mappings
+
+  $ cat >> $HGRCPATH << EOF
+  > [format]
+  > mmapthreshold = 0
+  > [extensions]
+  > mq =
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ for i in 1 2 3; do
+  >     python -c "import hashlib; print '\n'.join([hashlib.sha1('%d.%d' % (l, $i)).hexdigest() for l in xrange(4000)] + ['rev $i'])" > big
+  >     echo $i > small
+  >     hg commit -qAm $i
+  > done
+
+The file revlog was split from its index while being read
+
+  $ ls .hg/store/data
+  big.d
+  big.i
+  small.i
+  $ hg log -r tip -p --config diff.unified=0 small
+  changeset:   2:* (glob)
+  tag:         tip
+  user:        test
+  date:        Thu Jan 01 00:00:00 1970 +0000
+  summary:     3
+  
+  diff -r * -r * small (glob)
+  --- a/small	Thu Jan 01 00:00:00 1970 +0000
+  +++ b/small	Thu Jan 01 00:00:00 1970 +0000
+  @@ -1,1 +1,1 @@
+  -2
+  +3
+  
+  $ hg cat -r 1 big | tail -1
+  rev 2
+  $ hg verify -q
+
+Revisions added and removed while the files are mapped
+
+  $ hg rollback -q
+  $ hg cat -r tip big | tail -1
+  rev 2
+  $ hg commit -qm 3
+  $ hg strip -q 1
+  $ hg cat -r tip big | tail -1
+  rev 1
+  $ hg verify -q
+
+Small files are still read when the threshold is not reached
+
+  $ hg cat -r tip big --config format.mmapthreshold=1G | tail -1
+  rev 1
+
+  $ cd ..
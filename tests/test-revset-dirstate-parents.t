@@ -13,10 +13,18 @@
   $ cd repo
 
   $ try 'p1()'
+  (func
+    ('symbol', 'p1')
+    None)
+  * plan (estimated cost 0.0, 0.0 revisions):
   (func
     ('symbol', 'p1')
     None)
   $ try 'p2()'
+  (func
+    ('symbol', 'p2')
+    None)
+  * plan (estimated cost 0.0, 0.0 revisions):
   (func
     ('symbol', 'p2')
     None)
@@ -24,6 +32,10 @@
   (func
     ('symbol', 'parents')
     None)
+  * plan (estimated cost 0.0, 0.0 revisions):
+  (func
+    ('symbol', 'parents')
+    None)
 
 null revision
   $ log 'p1()'
@@ -97,27 +97,48 @@ names that should work without quoting
 
   $ try a
   ('symbol', 'a')
+  * plan (estimated cost 0.0, 1.0 revisions):
+  ('symbol', 'a')
   0
   $ try b-a
   (minus
     ('symbol', 'b')
     ('symbol', 'a'))
+  * plan (estimated cost 0.0, 0.9 revisions):
+  (and
+    ('symbol', 'b')
+    (not
+      ('symbol', 'a')))
   1
   $ try _a_b_c_
   ('symbol', '_a_b_c_')
+  * plan (estimated cost 0.0, 1.0 revisions):
+  ('symbol', '_a_b_c_')
   6
   $ try _a_b_c_-a
   (minus
     ('symbol', '_a_b_c_')
     ('symbol', 'a'))
+  * plan (estimated cost 0.0, 0.9 revisions):
+  (and
+    ('symbol', '_a_b_c_')
+    (not
+      ('symbol', 'a')))
   6
   $ try .a.b.c.
   ('symbol', '.a.b.c.')
+  * plan (estimated cost 0.0, 1.0 revisions):
+  ('symbol', '.a.b.c.')
   7
   $ try .a.b.c.-a
   (minus
     ('symbol', '.a.b.c.')
     ('symbol', 'a'))
+  * plan (estimated cost 0.0, 0.9 revisions):
+  (and
+    ('symbol', '.a.b.c.')
+    (not
+      ('symbol', 'a')))
   7
   $ try -- '-a-b-c-' # complains
   hg: parse error at 7: not a prefix: end
@@ -134,10 +155,23 @@ names that should work without quoting
       ('symbol', 'c'))
     (negate
       ('symbol', 'a')))
+  * plan (estimated cost 0.1, 0.7 revisions):
+  (and
+    (and
+      (and
+        ('string', '-a')
+        (not
+          ('symbol', 'b')))
+      (not
+        ('symbol', 'c')))
+    (not
+      ('string', '-a')))
   abort: unknown revision '-a'!
   [255]
   $ try é
   ('symbol', '\xc3\xa9')
+  * plan (estimated cost 0.0, 1.0 revisions):
+  ('symbol', '\xc3\xa9')
   9
 
 quoting needed
@@ -146,6 +180,11 @@ quoting needed
   (minus
     ('string', '-a-b-c-')
     ('symbol', 'a'))
+  * plan (estimated cost 0.0, 0.9 revisions):
+  (and
+    ('string', '-a-b-c-')
+    (not
+      ('symbol', 'a')))
   4
 
   $ log '1 or 2'
@@ -157,6 +196,12 @@ quoting needed
   $ log '1 and 2'
   $ log '1&2'
   $ try '1&2|3' # precedence - and is higher
+  (or
+    (and
+      ('symbol', '1')
+      ('symbol', '2'))
+    ('symbol', '3'))
+  * plan (estimated cost 0.1, 1.1 revisions):
   (or
     (and
       ('symbol', '1')
@@ -164,6 +209,12 @@ quoting needed
     ('symbol', '3'))
   3
   $ try '1|2&3'
+  (or
+    ('symbol', '1')
+    (and
+      ('symbol', '2')
+      ('symbol', '3')))
+  * plan (estimated cost 0.1, 1.1 revisions):
   (or
     ('symbol', '1')
     (and
@@ -171,6 +222,12 @@ quoting needed
       ('symbol', '3')))
   1
   $ try '1&2&3' # associativity
+  (and
+    (and
+      ('symbol', '1')
+      ('symbol', '2'))
+    ('symbol', '3'))
+  * plan (estimated cost 0.0, 0.0 revisions):
   (and
     (and
       ('symbol', '1')
@@ -183,6 +240,12 @@ quoting needed
       (or
         ('symbol', '2')
         ('symbol', '3'))))
+  * plan (estimated cost 0.2, 2.7 revisions):
+  (or
+    ('symbol', '1')
+    (or
+      ('symbol', '2')
+      ('symbol', '3')))
   1
   2
   3
@@ -251,6 +314,36 @@ ancestor can accept 0 or more arguments
   7
   8
   9
+
+operands of 'and' run cheap and selective predicates first
+
+  $ try 'contains(a) and author(bob) and not merge()'
+  (and
+    (and
+      (func
+        ('symbol', 'contains')
+        ('symbol', 'a'))
+      (func
+        ('symbol', 'author')
+        ('symbol', 'bob')))
+    (not
+      (func
+        ('symbol', 'merge')
+        None)))
+  * plan (estimated cost 45.1, 0.1 revisions):
+  (and
+    (and
+      (func
+        ('symbol', 'author')
+        ('symbol', 'bob'))
+      (not
+        (func
+          ('symbol', 'merge')
+          None)))
+    (func
+      ('symbol', 'contains')
+      ('symbol', 'a')))
+
   $ log 'branch(é)'
   8
   9
@@ -297,16 +390,28 @@ ancestor can accept 0 or more arguments
   $ log 'grep("issue\d+")'
   6
   $ try 'grep("(")' # invalid regular expression
+  (func
+    ('symbol', 'grep')
+    ('string', '('))
+  * plan (estimated cost 20.0, 1.0 revisions):
   (func
     ('symbol', 'grep')
     ('string', '('))
   hg: parse error: invalid match pattern: unbalanced parenthesis
   [255]
   $ try 'grep("\bissue\d+")'
+  (func
+    ('symbol', 'grep')
+    ('string', '\x08issue\\d+'))
+  * plan (estimated cost 20.0, 1.0 revisions):
   (func
     ('symbol', 'grep')
     ('string', '\x08issue\\d+'))
   $ try 'grep(r"\bissue\d+")'
+  (func
+    ('symbol', 'grep')
+    ('string', '\\bissue\\d+'))
+  * plan (estimated cost 20.0, 1.0 revisions):
   (func
     ('symbol', 'grep')
     ('string', '\\bissue\\d+'))
@@ -567,6 +672,10 @@ aliases:
 
   $ try m
   ('symbol', 'm')
+  (func
+    ('symbol', 'merge')
+    None)
+  * plan (estimated cost 0.1, 1.0 revisions):
   (func
     ('symbol', 'merge')
     None)
@@ -576,6 +685,12 @@ test alias recursion
 
   $ try sincem
   ('symbol', 'sincem')
+  (func
+    ('symbol', 'descendants')
+    (func
+      ('symbol', 'merge')
+      None))
+  * plan (estimated cost 0.3, 5.0 revisions):
   (func
     ('symbol', 'descendants')
     (func
@@ -605,6 +720,12 @@ test infinite recursion
           ('symbol', '1')
           ('symbol', '2')))
       ('symbol', '3')))
+  (or
+    ('symbol', '3')
+    (or
+      ('symbol', '1')
+      ('symbol', '2')))
+  * plan (estimated cost 0.2, 2.7 revisions):
   (or
     ('symbol', '3')
     (or
@@ -625,6 +746,12 @@ test nesting and variable passing
     (range
       ('symbol', '2')
       ('symbol', '5')))
+  (func
+    ('symbol', 'max')
+    (range
+      ('symbol', '2')
+      ('symbol', '5')))
+  * plan (estimated cost 0.2, 0.0 revisions):
   (func
     ('symbol', 'max')
     (range
@@ -644,6 +771,12 @@ far away.
     (range
       ('symbol', '2')
       ('symbol', '5')))
+  (func
+    ('symbol', 'descendants')
+    (func
+      ('symbol', 'max')
+      ('string', '$1')))
+  * plan (estimated cost 0.3, 5.0 revisions):
   (func
     ('symbol', 'descendants')
     (func
@@ -671,6 +804,16 @@ far away.
     (range
       ('symbol', '2')
       ('symbol', '5')))
+  (func
+    ('symbol', 'reverse')
+    (func
+      ('symbol', 'sort')
+      (list
+        (range
+          ('symbol', '2')
+          ('symbol', '5'))
+        ('symbol', 'date'))))
+  * plan (estimated cost 10.1, 5.0 revisions):
   (func
     ('symbol', 'reverse')
     (func
@@ -692,6 +835,16 @@ far away.
         ('symbol', '2')
         ('symbol', '3'))
       ('symbol', 'date')))
+  (func
+    ('symbol', 'reverse')
+    (func
+      ('symbol', 'sort')
+      (list
+        (or
+          ('symbol', '2')
+          ('symbol', '3'))
+        ('symbol', 'date'))))
+  * plan (estimated cost 10.1, 1.9 revisions):
   (func
     ('symbol', 'reverse')
     (func
@@ -737,6 +890,16 @@ far away.
           ('symbol', 'x'))
         ('symbol', 'x'))
       ('symbol', 'date')))
+  (func
+    ('symbol', 'reverse')
+    (func
+      ('symbol', 'sort')
+      (list
+        (or
+          ('symbol', '2')
+          ('symbol', '3'))
+        ('symbol', 'date'))))
+  * plan (estimated cost 10.1, 1.9 revisions):
   (func
     ('symbol', 'reverse')
     (func
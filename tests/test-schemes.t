@@ -36,6 +36,7 @@ check that {1} syntax works
   $ hg incoming --debug parts://localhost
   using http://localhost:$HGPORT/
   sending capabilities command
+  using gzip compression
   comparing with parts://localhost/
   query 1; heads
   sending batch command
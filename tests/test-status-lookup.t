@@ -0,0 +1,44 @@
+Files whose size is unchanged but mtime differs are compared in worker
+processes when there are enough of them
+
+  $ hg init repo
+  $ cd repo
+  $ mkdir a b
+  $ for i in `python -c "print ' '.join(map(str, range(200)))"`; do
+  >     echo "file $i" > a/f$i
+  >     echo "file $i" > b/f$i
+  > done
+  $ touch -t 200001010000 a/* b/*
+  $ hg ci -qAm0
+  $ hg debugstate | grep -c ' 2000-01-01 '
+  400
+
+Modify a few files without changing their size and touch everything
+
+  $ for f in a/f3 a/f150 b/f42; do
+  >     sed s/file/elif/ $f > tmp; mv tmp $f
+  > done
+  $ touch -t 200101010000 a/* b/*
+
+  $ hg --config worker.numcpus=1 status > ../serial
+  $ cat ../serial
+  M a/f150
+  M a/f3
+  M b/f42
+  $ hg debugstate | grep ' 2000-01-01 '
+  n 644          9 2000-01-01 00:00:00 a/f150
+  n 644          7 2000-01-01 00:00:00 a/f3
+  n 644          8 2000-01-01 00:00:00 b/f42
+
+The clean files were written back to the dirstate, so do it again
+
+  $ touch -t 200201010000 a/* b/*
+  $ hg --config worker.numcpus=4 status > ../parallel
+  $ cmp ../serial ../parallel
+  $ hg debugstate | grep -c ' 2002-01-01 '
+  397
+  $ hg status -A a/f3 a/f4
+  M a/f3
+  C a/f4
+
+  $ cd ..
@@ -0,0 +1,87 @@
+Walking the working directory with several threads gives the same results
+
+  $ hg init repo
+  $ cd repo
+  $ for d in a a/b a/b/c d e e/f; do
+  >     mkdir -p $d
+  >     echo $d > $d/tracked
+  >     echo $d > $d/unknown
+  >     echo $d > $d/ignored.o
+  > done
+  $ echo 'syntax: glob' > .hgignore
+  $ echo '*.o' >> .hgignore
+  $ hg add -q */tracked */*/tracked */*/*/tracked .hgignore
+  $ hg ci -qm0
+  $ echo changed > a/b/tracked
+  $ rm e/f/tracked
+  $ mkdir g
+  $ echo g > g/unknown
+
+  $ hg status -A > ../serial
+  $ hg --config worker.walkthreads=4 status -A > ../threads
+  $ cmp ../serial ../threads
+  $ cat ../threads
+  M a/b/tracked
+  ! e/f/tracked
+  ? a/b/c/unknown
+  ? a/b/unknown
+  ? a/unknown
+  ? d/unknown
+  ? e/f/unknown
+  ? e/unknown
+  ? g/unknown
+  I a/b/c/ignored.o
+  I a/b/ignored.o
+  I a/ignored.o
+  I d/ignored.o
+  I e/f/ignored.o
+  I e/ignored.o
+  C .hgignore
+  C a/b/c/tracked
+  C a/tracked
+  C d/tracked
+  C e/tracked
+
+  $ hg --config worker.walkthreads=4 status a e nonexistent
+  nonexistent: * (glob)
+  M a/b/tracked
+  ! e/f/tracked
+  ? a/b/c/unknown
+  ? a/b/unknown
+  ? a/unknown
+  ? e/f/unknown
+  ? e/unknown
+  $ hg --config worker.walkthreads=4 addremove -n
+  adding a/b/c/unknown
+  adding a/b/unknown
+  adding a/unknown
+  adding d/unknown
+  removing e/f/tracked
+  adding e/f/unknown
+  adding e/unknown
+  adding g/unknown
+  recording removal of e/f/tracked as rename to e/f/unknown (100% similar)
+
+Errors raised while listing a directory are reported as usual
+
+  $ cat > $TESTTMP/failing.py << EOF
+  > import errno, os
+  > from mercurial import osutil, extensions
+  > def listdir(orig, path, *args, **kwargs):
+  >     if path.endswith('/a/b'):
+  >         raise OSError(errno.EACCES, os.strerror(errno.EACCES), path)
+  >     return orig(path, *args, **kwargs)
+  > def uisetup(ui):
+  >     extensions.wrapfunction(osutil, 'listdir', listdir)
+  > EOF
+  $ hg --config extensions.failing=$TESTTMP/failing.py status a
+  a/b: Permission denied
+  M a/b/tracked
+  ? a/unknown
+  $ hg --config extensions.failing=$TESTTMP/failing.py \
+  >     --config worker.walkthreads=4 status a
+  a/b: Permission denied
+  M a/b/tracked
+  ? a/unknown
+
+  $ cd ..
@@ -343,3 +343,47 @@ warning message about such pattern.
 #endif
 
   $ cd ..
+
+status --stream shows the same files as they are found
+
+  $ hg init repo7
+  $ cd repo7
+  $ echo a > modified
+  $ echo a > removed
+  $ echo a > deleted
+  $ echo a > clean
+  $ echo a > unsure
+  $ echo '^ignored$' > .hgignore
+  $ hg ci -qAm0
+  $ echo b > modified
+  $ echo b > unsure
+  $ touch -t 200001010000 unsure
+  $ hg rm -q removed
+  $ rm deleted
+  $ echo a > added
+  $ hg add added
+  $ hg cp clean copied
+  $ echo a > unknown
+  $ echo a > ignored
+  $ hg st -A --stream | sort
+    clean
+  ! deleted
+  ? unknown
+  A added
+  A copied
+  C .hgignore
+  C clean
+  I ignored
+  M modified
+  M unsure
+  R removed
+  $ hg st -A --stream -C | sort > stream
+  $ hg st -A -C | sort | cmp - stream
+  $ hg st --stream -mar modified added removed unknown | sort
+  A added
+  M modified
+  R removed
+  $ hg st --stream --rev 0
+  abort: cannot specify --stream with --rev, --change or --subrepos
+  [255]
+  $ cd ..
@@ -0,0 +1,100 @@
+  $ "$TESTDIR/hghave" serve || exit 80
+
+  $ hg init server
+  $ cd server
+  $ echo a > a
+  $ hg ci -Am0 -q
+  $ python -c "import random; random.seed(0); print '%x' % random.getrandbits(1200000)" > big
+  $ hg ci -Am1 -q
+  $ echo c >> a
+  $ hg ci -m2
+  $ mkdir d
+  $ echo e > d/e
+  $ hg ci -Am3 -q
+  $ cd ..
+
+Store files are streamed compressed with the engine picked by the client
+
+  $ hg -R server serve -p $HGPORT -d --pid-file=hg.pid
+  $ cat hg.pid >> $DAEMON_PIDS
+
+  $ hg clone --uncompressed --config ui.compression=gzip --debug \
+  >   http://localhost:$HGPORT/ gzip | egrep "^streaming|revlogs|^transferred"
+  streaming with gzip compression
+  streaming all changes
+  5 revlogs to transfer
+  transferred 169 KB in * seconds (*/sec) (glob)
+  $ hg -R gzip verify -q
+  $ ls gzip/.hg/store/data
+  a.i
+  big.d
+  big.i
+  d
+  $ cat gzip/.hg/store/fncache | sort
+  data/a.i
+  data/big.d
+  data/big.i
+  data/d/e.i
+
+Clients can ask for uncompressed data, and write files one at a time
+
+  $ hg clone --uncompressed --config ui.compression=none \
+  >   --config worker.streamthreads=1 http://localhost:$HGPORT/ none
+  streaming all changes
+  5 revlogs to transfer
+  transferred 169 KB in * seconds (*/sec) (glob)
+  updating to branch default
+  3 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R none verify -q
+
+  $ hg clone --uncompressed -e "python \"$TESTDIR/dummyssh\"" \
+  >   ssh://user@dummy/server ssh
+  streaming all changes
+  5 revlogs to transfer
+  transferred 169 KB in * seconds (*/sec) (glob)
+  updating to branch default
+  3 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R ssh verify -q
+
+Revlogs are truncated after the last revision linked to the changesets
+present when the clone started
+
+  $ cat > streamat.py <<EOF
+  > import sys
+  > from mercurial import hg, ui as uimod, util, wireproto
+  > u = uimod.ui()
+  > src = hg.repository(u, 'server')
+  > dst = hg.repository(u, sys.argv[2], create=True)
+  > names, tiprev = wireproto.scanrevlogs(src)
+  > fp = util.chunkbuffer(wireproto.generatestream2(src, names,
+  >                                                 int(sys.argv[1])))
+  > lock = dst.lock()
+  > try:
+  >     dst.applystream2(fp, set(['revlogv1']))
+  > finally:
+  >     lock.release()
+  > EOF
+  $ python streamat.py 1 partial
+  5 revlogs to transfer
+  transferred 168 KB in * seconds (*/sec) (glob)
+  $ hg -R partial log --template '{rev}:{desc}\n'
+  1:1
+  0:0
+  $ hg -R partial verify -q
+  $ python streamat.py 2 partial2
+  5 revlogs to transfer
+  transferred 168 KB in * seconds (*/sec) (glob)
+  $ hg -R partial2 verify -q
+  $ hg -R partial2 pull -q server
+  $ hg -R partial2 verify -q
+  $ hg -R partial2 tip -q
+  3:* (glob)
+
+Servers refusing streaming clones
+
+  $ "$TESTDIR/killdaemons.py" $DAEMON_PIDS
+  $ hg -R server serve -p $HGPORT -d --pid-file=hg.pid \
+  >   --config server.uncompressed=False
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ hg clone --uncompressed -q http://localhost:$HGPORT/ refused
+  $ hg -R refused verify -q
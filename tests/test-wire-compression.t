@@ -0,0 +1,92 @@
+  $ "$TESTDIR/hghave" serve || exit 80
+
+  $ cat >> $HGRCPATH << EOF
+  > [ui]
+  > ssh = python "$TESTDIR/dummyssh"
+  > EOF
+
+  $ hg init server
+  $ cd server
+  $ for i in 1 2 3; do echo $i > f$i; hg -q commit -A -m $i; done
+  $ cd ..
+
+Bundles can use any engine
+
+  $ hg -R server bundle -a -t gzip gzip.hg
+  3 changesets found
+  $ hg -R server bundle -a -t none none.hg
+  3 changesets found
+  $ hg -R server bundle -a -t foo foo.hg
+  abort: unknown bundle type specified with --type
+  [255]
+  $ dd if=gzip.hg bs=6 count=1 2>/dev/null; echo
+  HG10GZ
+  $ dd if=none.hg bs=6 count=1 2>/dev/null; echo
+  HG10UN
+  $ hg init unbundled
+  $ hg -R unbundled -q unbundle gzip.hg
+  $ hg -R unbundled log -q
+  2:* (glob)
+  1:* (glob)
+  0:* (glob)
+
+The server advertises the engines it offers
+
+  $ hg -R server serve -d -p $HGPORT --pid-file hg.pid
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT '?cmd=capabilities' | tr ' ' '\n' | grep compression
+  compression=(zstd,)?zlib (re)
+
+  $ cat > server/.hg/hgrc << EOF
+  > [server]
+  > compression = none, gzip
+  > EOF
+  $ hg -R server serve -d -p $HGPORT1 --pid-file hg.pid
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ "$TESTDIR/get-with-headers.py" localhost:$HGPORT1 '?cmd=capabilities' | tr ' ' '\n' | grep compression
+  compression=none,zlib
+
+The client uses the first engine offered by the server
+
+  $ hg clone --debug http://localhost:$HGPORT1/ http-none | grep 'using.*compression'
+  using none compression
+  $ hg -R http-none verify -q
+  $ hg clone --debug ssh://user@dummy/server ssh-none | grep 'using.*compression'
+  [1]
+  $ hg -R ssh-none verify -q
+
+unless it prefers another one
+
+  $ hg clone --debug --config ui.compression=gzip http://localhost:$HGPORT1/ http-gzip | grep 'using.*compression'
+  using gzip compression
+  $ hg -R http-gzip verify -q
+  $ hg clone --debug --config ui.compression=gzip ssh://user@dummy/server ssh-gzip | grep 'using.*compression'
+  using gzip compression
+  $ hg -R ssh-gzip verify -q
+  $ hg -R ssh-gzip log -q
+  2:* (glob)
+  1:* (glob)
+  0:* (glob)
+
+Pulls through a server using a compression level
+
+  $ echo 4 > server/f4
+  $ hg -R server -q commit -A -m 4
+  $ hg -R ssh-gzip pull --config ui.compression=gzip --config server.compressionlevel=1
+  pulling from ssh://user@dummy/server
+  searching for changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 1 changesets with 1 changes to 1 files
+  (run 'hg update' to get a working copy)
+  $ hg -R http-gzip pull --config ui.compression=gzip
+  pulling from http://localhost:$HGPORT1/
+  searching for changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 1 changesets with 1 changes to 1 files
+  (run 'hg update' to get a working copy)
+  $ hg -R ssh-gzip verify -q
+  $ hg -R http-gzip verify -q